@@ -0,0 +1,204 @@
+# Benchmarks the phases of the simulator for a matrix of mesh sizes and element orders.
+#
+# Run from the repository root:
+#   python -m Benchmarks.benchmark_simulator_phases --sizes 5x3 9x5 17x9 --orders 1 2 3 4
+#
+# For every phase it reports the wall time and the peak memory (tracemalloc) and fits the scaling
+# exponent p of time ~ (number of dofs)^p over the mesh sizes. The results are saved as JSON, and a
+# previous JSON file can be given with --compare to print the speedup of every phase.
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+import Materials.MaterialProperties as mat_prop
+from Mesh.Cantilever.generate_2d_cantilever_kennys import generate_2d_cantilever_kennys
+from Mesh.HigherOrderMesh.generate_FEM_mesh import generate_FEM_mesh
+from Plots.plot_sim_result_1 import plot_sim_result_1
+from Simulator.simulator import Simulator
+
+LENGTH = 6.0
+HEIGHT = 2.0
+TIME_STEP = 0.001
+TRACTION_FORCE = [0, -10]
+GRAVITY = [0, -3]
+
+
+def measure(function, repeats=1):
+    """
+    Returns the best wall time over the repeats, the peak memory of the first run and the return
+    value of the function.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = function()
+    times = [time.perf_counter() - start]
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), peak_memory, value
+
+
+def benchmark_configuration(number_of_nodes_x, number_of_nodes_y, element_order, number_of_steps, repeats):
+    material_properties = mat_prop.MaterialPropertiesQuery().get_material_properties("Test 1")
+    phases = dict()
+
+    def record(name, function, phase_repeats=repeats):
+        seconds, peak_memory, value = measure(function, phase_repeats)
+        phases[name] = {'seconds': seconds, 'peak_memory_bytes': peak_memory}
+        return value
+
+    # Mesh generation
+    points, faces = record('generate_2d_cantilever_kennys', lambda: generate_2d_cantilever_kennys(
+        LENGTH, HEIGHT, number_of_nodes_x, number_of_nodes_y))
+    record('generate_FEM_mesh', lambda: generate_FEM_mesh(points, faces, element_order))
+
+    def make_simulator(number_of_time_steps):
+        return Simulator(number_of_time_steps, TIME_STEP, material_properties, LENGTH, HEIGHT,
+                         number_of_nodes_x, number_of_nodes_y, TRACTION_FORCE, GRAVITY, element_order)
+
+    simulator = record('simulator_init', lambda: make_simulator(1), 1)
+
+    # Precomputation
+    M = record('compute_mass_matrix', simulator.compute_mass_matrix)
+    C = record('compute_damping_matrix', simulator.compute_damping_matrix)
+    f_g = record('compute_body_forces', simulator.compute_body_forces)
+    f_t = record('compute_traction_forces', simulator.compute_traction_forces)
+    Minv = simulator.compute_inverse_mass_matrix(M)
+    f = - f_t - f_g
+
+    # A single internal force evaluation at a perturbed state
+    rng = np.random.default_rng(0)
+    x_n = simulator.FEM_V.reshape([-1]) + 1e-3 * rng.standard_normal(2 * simulator.total_number_of_nodes)
+    record('compute_stiffness_matrix', lambda: simulator.compute_stiffness_matrix(x_n))
+
+    # A full step
+    v_n = np.zeros(2 * simulator.total_number_of_nodes, dtype=np.float64)
+    record('step', lambda: simulator.step(0.0, x_n, v_n, Minv, C, lambda time: f))
+
+    # A short simulation to plot
+    result = make_simulator(max(number_of_steps, 1)).simulate()
+
+    # Plotting
+    def plot():
+        plot_sim_result_1(simulator.FEM_V, simulator.FEM_encoding, result.nodal_displacements[-1],
+                          number_of_nodes_x, number_of_nodes_y, TRACTION_FORCE, result.time_steps[-1],
+                          element_order)
+        plt.close('all')
+    record('plot_sim_result_1', plot)
+
+    return {
+        'number_of_nodes_x': number_of_nodes_x,
+        'number_of_nodes_y': number_of_nodes_y,
+        'element_order': element_order,
+        'number_of_dofs': 2 * simulator.total_number_of_nodes,
+        'number_of_elements': len(simulator.mesh_faces),
+        'phases': phases,
+    }
+
+
+def fit_scaling_exponents(runs):
+    """
+    Fits time ~ (number of dofs)^p for every phase and element order.
+    :return exponents: {element_order: {phase: p}}
+    """
+    exponents = dict()
+    for element_order in sorted({run['element_order'] for run in runs}):
+        order_runs = [run for run in runs if run['element_order'] == element_order]
+        if len(order_runs) < 2:
+            continue
+        exponents[str(element_order)] = dict()
+        for phase in order_runs[0]['phases']:
+            dofs = np.array([run['number_of_dofs'] for run in order_runs], dtype=np.float64)
+            seconds = np.array([run['phases'][phase]['seconds'] for run in order_runs], dtype=np.float64)
+            if np.any(seconds <= 0):
+                continue
+            exponents[str(element_order)][phase] = float(np.polyfit(np.log(dofs), np.log(seconds), 1)[0])
+
+    return exponents
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(benchmark, previous_benchmark=None):
+    previous_runs = dict()
+    if previous_benchmark is not None:
+        for run in previous_benchmark['runs']:
+            previous_runs[(run['number_of_nodes_x'], run['number_of_nodes_y'], run['element_order'])] = run
+
+    print("----------------------------------------------------")
+    for run in benchmark['runs']:
+        key = (run['number_of_nodes_x'], run['number_of_nodes_y'], run['element_order'])
+        print("{}x{} nodes, order {}, {} dofs:".format(key[0], key[1], key[2], run['number_of_dofs']))
+        for phase, measurement in run['phases'].items():
+            line = "  {:<30} {:>12.6f} s {:>10.2f} MB".format(
+                phase, measurement['seconds'], measurement['peak_memory_bytes'] / 1024 ** 2)
+            previous_run = previous_runs.get(key)
+            if previous_run is not None and phase in previous_run['phases'] and measurement['seconds'] > 0:
+                line += "   speedup {:.2f}x".format(previous_run['phases'][phase]['seconds'] / measurement['seconds'])
+            print(line)
+    print("----------------------------------------------------")
+    print("Scaling exponents p of time ~ dofs^p:")
+    for element_order, exponents in benchmark['scaling_exponents'].items():
+        print("  order {}: ".format(element_order) +
+              ", ".join("{} {:.2f}".format(phase, p) for phase, p in exponents.items()))
+    print("----------------------------------------------------")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the phases of the simulator.")
+    parser.add_argument('--sizes', nargs='+', default=['5x3', '9x5', '17x9'],
+                        help="Mesh sizes as number_of_nodes_x x number_of_nodes_y, e.g. 9x5.")
+    parser.add_argument('--orders', nargs='+', type=int, default=[1, 2, 3, 4])
+    parser.add_argument('--steps', type=int, default=10, help="Number of steps of the simulation that is plotted.")
+    parser.add_argument('--repeats', type=int, default=3, help="Number of repeats of the cheap phases.")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help="A previous benchmark JSON file to compare with.")
+    arguments = parser.parse_args()
+
+    runs = []
+    for size in arguments.sizes:
+        number_of_nodes_x, number_of_nodes_y = [int(n) for n in size.lower().split('x')]
+        for element_order in arguments.orders:
+            runs.append(benchmark_configuration(number_of_nodes_x, number_of_nodes_y, element_order,
+                                                arguments.steps, arguments.repeats))
+
+    benchmark = {
+        'version': get_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'runs': runs,
+        'scaling_exponents': fit_scaling_exponents(runs),
+    }
+
+    with open(arguments.output, 'w') as f:
+        json.dump(benchmark, f, indent=2)
+
+    previous_benchmark = None
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as f:
+            previous_benchmark = json.load(f)
+    print_report(benchmark, previous_benchmark)
+
+
+if __name__ == '__main__':
+    main()
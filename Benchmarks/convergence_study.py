@@ -0,0 +1,228 @@
+# Accuracy-versus-cost study of the mesh size (h), element order (p) and time step (dt).
+#
+# Run from the repository root:
+#   python -m Benchmarks.convergence_study --sizes 5x3 9x5 17x9 --orders 1 2 3 --time-steps 0.002 0.001 0.0005
+#       --end-time 0.2 --tolerance 0.01
+#
+# Every combination of the sizes, orders and time steps is simulated up to the same end time. The
+# finest run (largest mesh, highest order, smallest time step) is the reference, and the other runs
+# are compared with it at the same material points and times:
+# - tip: the vertical deflection of the middle of the free end over time,
+# - energy: the strain energy over time,
+# - field: the final displacement field, sampled on a grid of points.
+# The errors are relative to the largest value of the reference. The wall time and the peak memory
+# (tracemalloc, and the estimate of the cost model) of every run are recorded, and the runs on the
+# Pareto front of wall time and error are reported with the cheapest run that meets the tolerance.
+import argparse
+import json
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+import Materials.MaterialProperties as mat_prop
+from Benchmarks.benchmark_simulator_phases import measure, get_version, LENGTH, HEIGHT, TRACTION_FORCE, GRAVITY
+from Simulator.simulator import Simulator
+
+ERROR_METRICS = ['tip', 'energy', 'field', 'max']
+
+
+def get_tip_point():
+    # The mesh is centered at the origin and clamped at x = -LENGTH / 2
+    return np.array([[LENGTH / 2, 0.0]])
+
+
+def get_field_points(number_of_points_x=25, number_of_points_y=9):
+    x, y = np.meshgrid(np.linspace(-LENGTH / 2, LENGTH / 2, number_of_points_x),
+                       np.linspace(-HEIGHT / 2, HEIGHT / 2, number_of_points_y))
+    return np.stack([x.ravel(), y.ravel()], axis=-1)
+
+
+def run_configuration(number_of_nodes_x, number_of_nodes_y, element_order, time_step, end_time, sample_times,
+                      material_name):
+    """
+    Simulates one configuration and samples the quantities that are compared with the reference.
+    """
+    material_properties = mat_prop.MaterialPropertiesQuery().get_material_properties(material_name)
+    number_of_time_steps = int(round(end_time / time_step))
+
+    def simulate():
+        simulator = Simulator(number_of_time_steps, time_step, material_properties, LENGTH, HEIGHT,
+                              number_of_nodes_x, number_of_nodes_y, TRACTION_FORCE, GRAVITY, element_order)
+        return simulator, simulator.simulate(track_energy=True)
+
+    seconds, peak_memory, (simulator, result) = measure(simulate)
+
+    tip_probe = simulator.create_probe(get_tip_point())
+    field_probe = simulator.create_probe(get_field_points())
+    tip_deflections = tip_probe.sample_displacements_at_times(result, sample_times)[:, 0, 1]
+    strain_energies = np.interp(sample_times, np.asarray(result.time_steps, dtype=np.float64),
+                                np.asarray(result.energies[2], dtype=np.float64))
+    final_displacements = field_probe.sample_displacements(result.nodal_displacements[-1])
+
+    return {
+        'number_of_nodes_x': number_of_nodes_x,
+        'number_of_nodes_y': number_of_nodes_y,
+        'element_order': element_order,
+        'time_step': time_step,
+        'number_of_time_steps': number_of_time_steps,
+        'number_of_dofs': 2 * simulator.total_number_of_nodes,
+        'seconds': seconds,
+        'peak_memory_bytes': peak_memory,
+        'estimated_peak_memory_bytes': simulator.cost_estimate.get_peak_memory_bytes(
+            simulator.mass_matrix_backend, simulator.output_policy),
+        'stable': bool(np.all(np.isfinite(final_displacements)) and np.all(np.isfinite(tip_deflections))),
+        'tip_deflections': tip_deflections.tolist(),
+        'strain_energies': strain_energies.tolist(),
+        'final_displacements': final_displacements.tolist(),
+    }
+
+
+def compute_relative_error(values, reference_values):
+    values = np.asarray(values, dtype=np.float64)
+    reference_values = np.asarray(reference_values, dtype=np.float64)
+    scale = np.max(np.abs(reference_values))
+    error = np.max(np.abs(values - reference_values))
+    if not np.isfinite(error):
+        return np.inf
+    return float(error / scale) if scale > 0 else float(error)
+
+
+def compute_errors(run, reference_run):
+    errors = {
+        'tip': compute_relative_error(run['tip_deflections'], reference_run['tip_deflections']),
+        'energy': compute_relative_error(run['strain_energies'], reference_run['strain_energies']),
+        'field': compute_relative_error(run['final_displacements'], reference_run['final_displacements']),
+    }
+    errors['max'] = max(errors.values())
+    return errors
+
+
+def get_key(run):
+    return '{}x{} p{} dt{:g}'.format(run['number_of_nodes_x'], run['number_of_nodes_y'], run['element_order'],
+                                     run['time_step'])
+
+
+def find_pareto_front(runs, metric):
+    """
+    Returns the runs for which no other run is both faster and more accurate, sorted by wall time.
+    """
+    front = []
+    for run in sorted(runs, key=lambda r: (r['seconds'], r['errors'][metric])):
+        if not front or run['errors'][metric] < front[-1]['errors'][metric]:
+            front.append(run)
+    return front
+
+
+def find_cheapest_run(runs, metric, tolerance):
+    """
+    Returns the fastest run, other than the reference, whose error is within the tolerance, or None.
+    """
+    candidates = [run for run in runs if not run['reference'] and run['errors'][metric] <= tolerance]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda run: run['seconds'])
+
+
+def print_report(study):
+    metric = study['metric']
+    print("----------------------------------------------------")
+    print("{:<22} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        'configuration', 'dofs', 'seconds', 'MB', 'tip', 'energy', 'field', 'front'))
+    for run in study['runs']:
+        print("{:<22} {:>8} {:>10.3f} {:>10.2f} {:>10.2e} {:>10.2e} {:>10.2e} {:>10}".format(
+            run['key'], run['number_of_dofs'], run['seconds'], run['peak_memory_bytes'] / 1024 ** 2,
+            run['errors']['tip'], run['errors']['energy'], run['errors']['field'],
+            'reference' if run['reference'] else ('yes' if run['key'] in study['pareto_front'] else '')))
+    print("----------------------------------------------------")
+    if study['cheapest'] is None:
+        print("No run coarser than the reference has a {} error within {:g}".format(metric, study['tolerance']))
+    else:
+        print("Cheapest run with a {} error within {:g}: {}".format(metric, study['tolerance'], study['cheapest']))
+    print("----------------------------------------------------")
+
+
+def plot_study(study, file_name):
+    metric = study['metric']
+    runs = [run for run in study['runs'] if not run['reference'] and np.isfinite(run['errors'][metric])]
+    front = [run for run in runs if run['key'] in study['pareto_front']]
+
+    plt.figure()
+    plt.loglog([run['seconds'] for run in runs], [run['errors'][metric] for run in runs], 'o', label='runs')
+    plt.loglog([run['seconds'] for run in front], [run['errors'][metric] for run in front], 'r-o',
+               label='Pareto front')
+    for run in front:
+        plt.annotate(run['key'], (run['seconds'], run['errors'][metric]), fontsize=7)
+    plt.axhline(study['tolerance'], color='gray', linestyle='--', label='tolerance')
+    plt.xlabel('wall time [s]')
+    plt.ylabel('relative {} error'.format(metric))
+    plt.legend()
+    plt.savefig(file_name)
+    plt.close('all')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Study the accuracy and cost of mesh, order and time step refinement.")
+    parser.add_argument('--sizes', nargs='+', default=['5x3', '9x5', '17x9'],
+                        help="Mesh sizes as number_of_nodes_x x number_of_nodes_y, e.g. 9x5.")
+    parser.add_argument('--orders', nargs='+', type=int, default=[1, 2, 3])
+    parser.add_argument('--time-steps', nargs='+', type=float, default=[0.002, 0.001, 0.0005])
+    parser.add_argument('--end-time', type=float, default=0.2)
+    parser.add_argument('--samples', type=int, default=50, help="Number of times the time series are compared at.")
+    parser.add_argument('--material', default='Test 1')
+    parser.add_argument('--metric', choices=ERROR_METRICS, default='max',
+                        help="The error used for the Pareto front and the tolerance.")
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--output', default='convergence_study.json')
+    parser.add_argument('--plot', default=None, help="File name of a plot of the error against the wall time.")
+    arguments = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.lower().split('x')) for size in arguments.sizes]
+    sample_times = np.linspace(0, arguments.end_time, arguments.samples + 1)
+
+    # The finest configuration is the reference
+    reference_configuration = (max(sizes, key=lambda size: size[0] * size[1]), max(arguments.orders),
+                               min(arguments.time_steps))
+
+    runs = []
+    for size in sizes:
+        for element_order in arguments.orders:
+            for time_step in arguments.time_steps:
+                run = run_configuration(size[0], size[1], element_order, time_step, arguments.end_time,
+                                        sample_times, arguments.material)
+                run['key'] = get_key(run)
+                run['reference'] = (size, element_order, time_step) == reference_configuration
+                runs.append(run)
+
+    reference_run = next(run for run in runs if run['reference'])
+    for run in runs:
+        run['errors'] = compute_errors(run, reference_run)
+
+    metric = arguments.metric
+    finite_runs = [run for run in runs if run['stable'] and np.isfinite(run['errors'][metric])]
+    cheapest = find_cheapest_run(finite_runs, metric, arguments.tolerance)
+    study = {
+        'version': get_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'end_time': arguments.end_time,
+        'material': arguments.material,
+        'metric': metric,
+        'tolerance': arguments.tolerance,
+        'reference': reference_run['key'],
+        'pareto_front': [run['key'] for run in find_pareto_front(finite_runs, metric)],
+        'cheapest': cheapest['key'] if cheapest is not None else None,
+        'runs': runs,
+    }
+
+    with open(arguments.output, 'w') as f:
+        json.dump(study, f, indent=2)
+
+    print_report(study)
+    if arguments.plot is not None:
+        plot_study(study, arguments.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+import scipy.sparse as sparse
+
+
+def compute_energy_time_series(displacements, velocities, Es, M, reference_vertices, faces, areas,
+                               density, gravity, lambda_, mu, damping_forces=None, quadrature_weights=None,
+                               constitutive_model=None):
+    """
+    Computes the kinetic, potential, strain and damping energies for every stored time step at once.
+
+    All time steps are stacked along the first axis, so each energy is evaluated with a few batched
+    operations instead of a Python loop over time steps and faces.
+
+    :param displacements: (T, 2N) array of nodal displacements.
+    :param velocities: (T, 2N) array of nodal velocities.
+    :param Es: (T, n_elements, 2, 2) array of Green strains for every element, or
+        (T, n_elements, n_quadrature_points, 2, 2) array of Green strains at every quadrature point.
+    :param M: The (2N)x(2N) mass matrix (dense or scipy.sparse).
+    :param reference_vertices: (N, 2) array of reference (non-deformed) vertices.
+    :param faces: (n_elements, 3) array of the corner vertex indices of every element.
+    :param areas: (n_elements,) array of element areas.
+    :param density:
+    :param gravity:
+    :param lambda_:
+    :param mu:
+    :param damping_forces: Optional (T, 2N) array of the damping forces C@v used in every step.
+    :param quadrature_weights: The quadrature weights (summing to one). Required when Es holds the
+        Green strains at the quadrature points.
+    :param constitutive_model: Optional ConstitutiveModel giving the strain energy density. Defaults
+        to the Saint Venant-Kirchhoff model with lambda_ and mu.
+    :return kinetic_energies, potential_energies, strain_energies, damping_energies:
+    """
+
+    displacements = np.asarray(displacements, dtype=np.float64)
+    velocities = np.asarray(velocities, dtype=np.float64)
+    Es = np.asarray(Es, dtype=np.float64)
+    faces = np.asarray(faces)
+    areas = np.asarray(areas, dtype=np.float64)
+    if Es.ndim == 5:
+        if quadrature_weights is None:
+            raise Exception("Es holds the Green strains at {} quadrature points per element, so the "
+                            "quadrature_weights are required".format(Es.shape[2]))
+        if len(quadrature_weights) != Es.shape[2]:
+            raise Exception("There are {} quadrature weights for {} quadrature points".format(
+                len(quadrature_weights), Es.shape[2]))
+    elif quadrature_weights is not None:
+        raise Exception("Es holds one Green strain per element, so there are no quadrature weights")
+
+    # Kinetic energy: 0.5 * v^T M v for all time steps using a single sparse product
+    M = sparse.csr_matrix(M)
+    Mv = (M @ velocities.T).T
+    kinetic_energies = 0.5 * np.einsum('ti,ti->t', velocities, Mv)
+
+    # Potential energy: the mass of every element placed at the mean height of its corner vertices
+    ys = reference_vertices[:, 1] + displacements[:, 1::2]
+    centers_of_mass = ys[:, faces].mean(axis=2)
+    potential_energies = -gravity[1] * density * (centers_of_mass @ areas)
+
+    # Strain energy: by default the Saint Venant-Kirchhoff energy density (lambda/2) tr(E)^2 + mu tr(E^T E)
+    if constitutive_model is not None:
+        strain_energy_densities = constitutive_model.compute_strain_energy_density(Es)
+    else:
+        trace_E = np.einsum('...ii->...', Es)
+        E_squared = np.einsum('...ij,...ij->...', Es, Es)
+        strain_energy_densities = (lambda_ / 2) * trace_E ** 2 + mu * E_squared
+    if quadrature_weights is not None:
+        strain_energy_densities = strain_energy_densities @ np.asarray(quadrature_weights, dtype=np.float64)
+    strain_energies = strain_energy_densities @ areas
+
+    # Damping energy: the accumulated work done by the damping forces over every step
+    damping_energies = np.zeros(len(displacements), dtype=np.float64)
+    if damping_forces is not None:
+        damping_forces = np.asarray(damping_forces, dtype=np.float64)
+        step_work = np.einsum('ti,ti->t', damping_forces[1:], np.diff(displacements, axis=0))
+        damping_energies[1:] = np.cumsum(step_work)
+
+    return kinetic_energies, potential_energies, strain_energies, damping_energies
@@ -11,14 +11,15 @@ import numpy as np
 #
 #     return -gravity[1] * mass * center_of_mass
 
-global_damping_energy_lost = 0
-
-def compute_lost_damping_energy(displacements, damping_forces):
+def compute_lost_damping_energy(displacements, damping_forces, damping_energy_lost=0.0):
     """
     Computes the total lost damping energy of the mesh over time.
-    """
+    The running total is passed in by the caller, so concurrent runs do not share any state.
 
-    global global_damping_energy_lost
-    global_damping_energy_lost += np.dot(np.transpose(displacements), damping_forces)
+    :param displacements: The displacement increment of the step.
+    :param damping_forces: The damping forces of the step.
+    :param damping_energy_lost: The damping energy lost before this step.
+    :return damping_energy_lost:
+    """
 
-    return global_damping_energy_lost
+    return damping_energy_lost + np.dot(np.transpose(displacements), damping_forces)
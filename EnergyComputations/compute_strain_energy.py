@@ -10,9 +10,11 @@ def compute_element_strain_energy(A_e, E_e, lambda_, mu):
 
     return element_strain_energy * A_e
 
-def compute_strain_energy(index, faces, result, areas, lambda_, mu):
+def compute_strain_energy(index, faces, result, areas, lambda_, mu, quadrature_weights=None):
     """
     Computes the strain energy of the mesh.
+    If quadrature_weights is given, result.Es holds the Green strains at every quadrature point of
+    every element.
     """
 
 
@@ -20,6 +22,10 @@ def compute_strain_energy(index, faces, result, areas, lambda_, mu):
     for i in range(len(faces)):
         A_e = areas[i]
         E_e = result.Es[index][i]
-        strain_energy += compute_element_strain_energy(A_e, E_e, lambda_, mu)
+        if quadrature_weights is None:
+            strain_energy += compute_element_strain_energy(A_e, E_e, lambda_, mu)
+        else:
+            for q in range(len(quadrature_weights)):
+                strain_energy += quadrature_weights[q] * compute_element_strain_energy(A_e, E_e[q], lambda_, mu)
 
     return strain_energy
\ No newline at end of file
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class EnergyAccumulator:
+    """
+    Tracks the kinetic, strain, potential and damping energies while the simulation is running.
+
+    The energies are updated incrementally from quantities the simulation step already computes:
+    the strain and damping energies are accumulated as the work done by the internal and damping
+    forces over the displacement increment of each step, and the potential energy is the negative
+    work done by the external forces. For constant external forces this is -f u, for time-dependent
+    loads the work is accumulated like the strain energy.
+
+    The velocities of the semi-implicit Euler and central difference steps live at the half steps
+    (staggered velocities), so the energies of time step n are recorded while step n is taken: the
+    kinetic energy uses the velocities on both sides of time step n and the work uses the
+    trapezoidal rule over the previous step. The velocities of the other integrators are at the time
+    steps, so the kinetic energy uses the velocities of time step n and the damping work also uses
+    the trapezoidal rule. The energies of the last time step are recorded after the last step, so
+    there is one record for every time step.
+    """
+
+    def __init__(self, M, f_external, number_of_time_steps, drift_tolerance=None, warmup_steps=10,
+                 staggered_velocities=True):
+        """
+        :param M: The mass matrix.
+        :param f_external: The external forces (gravity and traction) acting on the nodes.
+        :param number_of_time_steps: The number of time steps the series are allocated for.
+        :param drift_tolerance: The relative total energy drift at which the simulation is aborted.
+            None disables the check.
+        :param warmup_steps: The number of steps before the drift is checked.
+        :param staggered_velocities: True if the velocities of the integrator are at the half steps
+            (see TimeIntegrator.staggered_velocities).
+        """
+        self.M = M
+        self.staggered_velocities = staggered_velocities
+        self.f_external = f_external
+        self.drift_tolerance = drift_tolerance
+        self.warmup_steps = warmup_steps
+
+        # Row n holds the kinetic, potential, strain and damping energy at time step n
+        self.series = np.zeros([number_of_time_steps + 1, 4], dtype=np.float64)
+        self.number_of_records = 0
+
+        self.strain_energy = 0.0
+        self.damping_energy = 0.0
+        self.external_work = 0.0
+        self.energy_scale = 0.0
+        self.drift = 0.0
+
+        self.previous_x = None
+        self.previous_internal_forces = None
+        self.previous_damping_forces = None
+
+    def record(self, x_n, u_n, v_n, v_n_1, internal_forces, damping_forces, external_forces=None):
+        """
+        Records the energies at the start of a step and returns True if the total energy drift
+        exceeds the drift tolerance.
+
+        :param x_n: The positions at the start of the step.
+        :param u_n: The displacements at the start of the step.
+        :param v_n: The velocities at the start of the step.
+        :param v_n_1: The velocities computed in the step. Only used with staggered velocities.
+        :param internal_forces: The internal forces at x_n.
+        :param damping_forces: The damping forces C@v_n used in the step.
+        :param external_forces: The external forces of the step if they change over time, None if
+            they are the constant external forces the accumulator was created with.
+        :return drift_exceeded:
+        """
+        if self.previous_x is not None:
+            displacement_increment = x_n - self.previous_x
+            self.strain_energy += 0.5 * np.dot(self.previous_internal_forces + internal_forces, displacement_increment)
+            if self.staggered_velocities:
+                self.damping_energy += np.dot(damping_forces, displacement_increment)
+            else:
+                self.damping_energy += 0.5 * np.dot(self.previous_damping_forces + damping_forces,
+                                                    displacement_increment)
+            if external_forces is not None:
+                self.external_work += 0.5 * np.dot(self.f_external + external_forces, displacement_increment)
+        self.previous_x = x_n
+        self.previous_internal_forces = internal_forces
+        self.previous_damping_forces = damping_forces
+
+        kinetic_energy = 0.5 * np.dot(v_n, self.M @ (v_n_1 if self.staggered_velocities else v_n))
+        if external_forces is None:
+            potential_energy = -np.dot(self.f_external, u_n)
+        else:
+            self.f_external = external_forces
+            potential_energy = -self.external_work
+
+        energies = (kinetic_energy, potential_energy, self.strain_energy, self.damping_energy)
+        self.series[self.number_of_records] = energies
+        self.number_of_records += 1
+
+        # The energies start at zero, so the total energy should stay zero
+        total_energy = np.sum(energies)
+        self.energy_scale = max(self.energy_scale, np.max(np.abs(energies)))
+        if self.energy_scale > 0:
+            self.drift = np.abs(total_energy) / self.energy_scale
+
+        if self.drift_tolerance is None or self.number_of_records <= self.warmup_steps:
+            return False
+        return self.drift > self.drift_tolerance or not np.isfinite(total_energy)
+
+    def get_energy_series(self):
+        """
+        Returns the recorded energy series. Entry n belongs to time step n of the result.
+        :return kinetic_energies, potential_energies, strain_energies, damping_energies:
+        """
+        series = self.series[:self.number_of_records]
+        return series[:, 0], series[:, 1], series[:, 2], series[:, 3]
@@ -1,11 +1,14 @@
 # Material properties class with young's modulus, poisson ratio, and density
 # Has a function for computing lambda and mu
+# The constitutive model is the name of a model in Materials.constitutive_models.CONSTITUTIVE_MODELS
 class MaterialProperties:
-    def __init__(self, youngs_modulus, poisson_ratio, density, damping_coefficient):
+    def __init__(self, youngs_modulus, poisson_ratio, density, damping_coefficient,
+                 constitutive_model='saint_venant_kirchhoff'):
         self.youngs_modulus = youngs_modulus
         self.poisson_ratio = poisson_ratio
         self.density = density
         self.damping_coefficient = damping_coefficient
+        self.constitutive_model = constitutive_model
 
     def get_lambda_and_mu(self):
         lambda_ = self.youngs_modulus * self.poisson_ratio / ((1 + self.poisson_ratio) * (1 - 2 * self.poisson_ratio))
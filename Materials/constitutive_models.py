@@ -0,0 +1,223 @@
+# Constitutive models evaluated for whole batches of deformation gradients.
+#
+# Every model computes the second Piola-Kirchhoff stress S, the strain energy density and optionally
+# the material tangent dS/dE for arrays of shape (..., 2, 2), so the internal force kernel evaluates
+# all quadrature points of all elements with a few array operations. The 2x2 inverses and
+# determinants are computed in closed form.
+#
+# The models are plane strain: the out-of-plane stretch is 1, so the invariants of the 3D right
+# Cauchy-Green tensor are I_C = tr(C) + 1 and III_C = det(C).
+#
+# The models compute in the precision of the arrays they are given, so float32 deformation gradients
+# give float32 stresses.
+import numpy as np
+
+IDENTITY = np.eye(2)
+
+
+def compute_determinants_2x2(A):
+    """
+    :param A: (..., 2, 2) array.
+    :return determinants: (...) array.
+    """
+    return A[..., 0, 0] * A[..., 1, 1] - A[..., 0, 1] * A[..., 1, 0]
+
+
+def compute_inverses_2x2(A, determinants=None):
+    """
+    :param A: (..., 2, 2) array.
+    :param determinants: Optional (...) array of the determinants of A.
+    :return inverses: (..., 2, 2) array.
+    """
+    if determinants is None:
+        determinants = compute_determinants_2x2(A)
+
+    inverses = np.empty_like(A)
+    inverses[..., 0, 0] = A[..., 1, 1]
+    inverses[..., 0, 1] = -A[..., 0, 1]
+    inverses[..., 1, 0] = -A[..., 1, 0]
+    inverses[..., 1, 1] = A[..., 0, 0]
+    inverses /= determinants[..., None, None]
+
+    return inverses
+
+
+def compute_symmetric_identity_product(A, B):
+    """
+    Returns the fourth order tensor (A_ik B_jl + A_il B_jk) / 2 for every pair of 2x2 matrices.
+    :return tensors: (..., 2, 2, 2, 2) array.
+    """
+    return 0.5 * (np.einsum('...ik,...jl->...ijkl', A, B) + np.einsum('...il,...jk->...ijkl', A, B))
+
+
+def compute_right_cauchy_green_tensors(E):
+    """
+    :param E: (..., 2, 2) array of Green strains.
+    :return C: (..., 2, 2) array C = 2 E + I with the dtype of E.
+    """
+    C = 2 * E
+    C[..., 0, 0] += 1
+    C[..., 1, 1] += 1
+    return C
+
+
+class ConstitutiveModel:
+    """
+    Base class of the constitutive models. Subclasses implement
+    compute_second_piola_kirchhoff_stress and compute_strain_energy_density, and optionally
+    compute_tangent.
+    """
+
+    name = None
+
+    def __init__(self, lambda_, mu):
+        """
+        :param lambda_: The first Lame parameter.
+        :param mu: The shear modulus.
+        """
+        # Python floats do not change the dtype of the arrays they multiply
+        self.lambda_ = float(lambda_)
+        self.mu = float(mu)
+
+    def compute_second_piola_kirchhoff_stress(self, F, E, out=None):
+        """
+        :param F: (..., 2, 2) array of deformation gradients.
+        :param E: (..., 2, 2) array of the Green strains of F.
+        :param out: Optional (..., 2, 2) output array.
+        :return S: (..., 2, 2) array of second Piola-Kirchhoff stresses.
+        """
+        raise NotImplementedError
+
+    def compute_strain_energy_density(self, E):
+        """
+        :param E: (..., 2, 2) array of Green strains.
+        :return psi: (...) array of strain energies per unit reference area.
+        """
+        raise NotImplementedError
+
+    def compute_tangent(self, F, E):
+        """
+        :param F: (..., 2, 2) array of deformation gradients.
+        :param E: (..., 2, 2) array of the Green strains of F.
+        :return tangent: (..., 2, 2, 2, 2) array of the material tangent dS/dE.
+        """
+        raise Exception("The {} model does not provide a tangent".format(self.name))
+
+
+class SaintVenantKirchhoff(ConstitutiveModel):
+    """
+    S = lambda tr(E) I + 2 mu E
+    """
+
+    name = 'saint_venant_kirchhoff'
+
+    def compute_second_piola_kirchhoff_stress(self, F, E, out=None):
+        trace_E = E[..., 0, 0] + E[..., 1, 1]
+        S = np.multiply(E, 2 * self.mu, out=out)
+        S[..., 0, 0] += self.lambda_ * trace_E
+        S[..., 1, 1] += self.lambda_ * trace_E
+        return S
+
+    def compute_strain_energy_density(self, E):
+        trace_E = np.einsum('...ii->...', E)
+        E_squared = np.einsum('...ij,...ij->...', E, E)
+        return (self.lambda_ / 2) * trace_E ** 2 + self.mu * E_squared
+
+    def compute_tangent(self, F, E):
+        identity = np.broadcast_to(IDENTITY, E.shape)
+        tangent = (self.lambda_ * np.einsum('...ij,...kl->...ijkl', identity, identity) +
+                   2 * self.mu * compute_symmetric_identity_product(identity, identity))
+        return tangent
+
+
+class CompressibleNeoHookean(ConstitutiveModel):
+    """
+    Compressible neo-Hookean model (page 163 [Bonet and Wood, 2008], Eq. 6.28)
+    S = mu (I - C^-1) + lambda ln(J) C^-1
+    """
+
+    name = 'compressible_neo_hookean'
+
+    def compute_second_piola_kirchhoff_stress(self, F, E, out=None):
+        C = compute_right_cauchy_green_tensors(E)
+        C_inverse = compute_inverses_2x2(C)
+        log_J = np.log(compute_determinants_2x2(F))
+
+        S = np.multiply(C_inverse, (self.lambda_ * log_J - self.mu)[..., None, None], out=out)
+        S[..., 0, 0] += self.mu
+        S[..., 1, 1] += self.mu
+        return S
+
+    def compute_strain_energy_density(self, E):
+        C = compute_right_cauchy_green_tensors(E)
+        log_J = 0.5 * np.log(compute_determinants_2x2(C))
+        return self.mu / 2 * (np.einsum('...ii->...', C) - 2) - self.mu * log_J + self.lambda_ / 2 * log_J ** 2
+
+    def compute_tangent(self, F, E):
+        C = compute_right_cauchy_green_tensors(E)
+        C_inverse = compute_inverses_2x2(C)
+        log_J = np.log(compute_determinants_2x2(F))
+
+        # Page 174 [Bonet and Wood, 2008], Eq. 6.90 written as dS/dE
+        tangent = (self.lambda_ * np.einsum('...ij,...kl->...ijkl', C_inverse, C_inverse) +
+                   2 * (self.mu - self.lambda_ * log_J)[..., None, None, None, None] *
+                   compute_symmetric_identity_product(C_inverse, C_inverse))
+        return tangent
+
+
+class IncompressibleNeoHookean(ConstitutiveModel):
+    """
+    Nearly incompressible neo-Hookean model (page 169 [Bonet and Wood, 2008], Eq. 6.52)
+    S = mu III_C^(-1/3) (I - I_C C^-1 / 3) + p J C^-1, with the pressure p = kappa (J - 1)
+    and the bulk modulus kappa = lambda + 2 mu / 3.
+    """
+
+    name = 'incompressible_neo_hookean'
+
+    def __init__(self, lambda_, mu):
+        super().__init__(lambda_, mu)
+        self.kappa = self.lambda_ + 2 * self.mu / 3
+
+    def compute_second_piola_kirchhoff_stress(self, F, E, out=None):
+        C = compute_right_cauchy_green_tensors(E)
+        J = compute_determinants_2x2(F)
+        C_inverse = compute_inverses_2x2(C, J ** 2)
+        I_C = C[..., 0, 0] + C[..., 1, 1] + 1
+
+        deviatoric_scale = self.mu * J ** (-2 / 3)
+        pressure = self.kappa * (J - 1)
+
+        S = np.multiply(C_inverse, (pressure * J - deviatoric_scale * I_C / 3)[..., None, None], out=out)
+        S[..., 0, 0] += deviatoric_scale
+        S[..., 1, 1] += deviatoric_scale
+        return S
+
+    def compute_strain_energy_density(self, E):
+        C = compute_right_cauchy_green_tensors(E)
+        J = np.sqrt(compute_determinants_2x2(C))
+        I_C = np.einsum('...ii->...', C) + 1
+        return self.mu / 2 * (J ** (-2 / 3) * I_C - 3) + self.kappa / 2 * (J - 1) ** 2
+
+
+# Registry of the constitutive models by name
+CONSTITUTIVE_MODELS = {
+    SaintVenantKirchhoff.name: SaintVenantKirchhoff,
+    CompressibleNeoHookean.name: CompressibleNeoHookean,
+    IncompressibleNeoHookean.name: IncompressibleNeoHookean,
+}
+
+
+def register_constitutive_model(model_class):
+    """
+    Adds a ConstitutiveModel subclass to the registry, so it can be selected by its name in
+    MaterialProperties.
+    """
+    CONSTITUTIVE_MODELS[model_class.name] = model_class
+    return model_class
+
+
+def get_constitutive_model(name, lambda_, mu):
+    if name not in CONSTITUTIVE_MODELS:
+        raise Exception("Unknown constitutive model: {}. Available models: {}".format(
+            name, ', '.join(sorted(CONSTITUTIVE_MODELS))))
+    return CONSTITUTIVE_MODELS[name](lambda_, mu)
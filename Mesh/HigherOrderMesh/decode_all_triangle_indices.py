@@ -0,0 +1,31 @@
+import numpy as np
+
+from Mesh.HigherOrderMesh.decode_triangle_indices import decode_triangle_indices
+
+
+def decode_all_triangle_indices(encodings, n):
+    """
+    Decodes the global indices of all the triangles.
+
+    The nodes of every triangle are returned in the same local order, given by the returned
+    ijk_indices, so quantities that only depend on the ijk_indices (e.g. shape function values)
+    can be computed once and used for all triangles.
+
+    :param encodings:
+    :param n:
+    :return global_indices, ijk_indices: (number of triangles)xm and mx3 arrays.
+    """
+
+    # The local order of a triangle whose edges all have positive orientation
+    _, ijk_indices = decode_triangle_indices(np.array([0, 0, 0, 0, 0, 1, 0, 1, 0, 1]), n)
+    ijk_keys = ijk_indices @ np.array([(n + 1) ** 2, n + 1, 1])
+    canonical_order = np.argsort(np.argsort(ijk_keys))
+
+    m = (n + 1) * (n + 2) // 2
+    global_indices = np.zeros([len(encodings), m], dtype=np.int64)
+    for e, encoding in enumerate(encodings):
+        global_indices_e, ijk_indices_e = decode_triangle_indices(encoding, n)
+        keys_e = ijk_indices_e @ np.array([(n + 1) ** 2, n + 1, 1])
+        global_indices[e] = global_indices_e[np.argsort(keys_e)[canonical_order]]
+
+    return global_indices, ijk_indices
@@ -41,7 +41,6 @@ def decode_triangle_indices(encoding, n):
             ij_edge_ijk_indices.append((n-l-1, l+1, 0))
         if encoding[5] == -1:
             ij_edge_indices = reversed(ij_edge_indices)
-            ij_edge_ijk_indices = reversed(ij_edge_ijk_indices)
         global_indices.extend(ij_edge_indices)
         ijk_indices.extend(ij_edge_ijk_indices)
 
@@ -53,19 +52,17 @@ def decode_triangle_indices(encoding, n):
             jk_edge_ijk_indices.append((0, n-l-1, l+1))
         if encoding[7] == -1:
             jk_edge_indices = reversed(jk_edge_indices)
-            jk_edge_ijk_indices = reversed(jk_edge_ijk_indices)
         global_indices.extend(jk_edge_indices)
         ijk_indices.extend(jk_edge_ijk_indices)
 
-        # Indices for jk edge
+        # Indices for ki edge
         ki_edge_indices = []
         ki_edge_ijk_indices = []
         for l in range(num_edge_nodes):
             ki_edge_indices.append(encoding[8] + l)
             ki_edge_ijk_indices.append((l+1, 0, n-l-1))
-        if encoding[7] == -1:
+        if encoding[9] == -1:
             ki_edge_indices = reversed(ki_edge_indices)
-            ki_edge_ijk_indices = reversed(ki_edge_ijk_indices)
         global_indices.extend(ki_edge_indices)
         ijk_indices.extend(ki_edge_ijk_indices)
 
@@ -0,0 +1,66 @@
+import os
+
+import imageio
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+
+class AnimationWriter:
+    """
+    Writes an animation one frame at a time, so the frames never have to be held in memory together.
+
+    The container is chosen from the file extension:
+        - .gif is written by streaming the frames to the file. Every frame gets its own adaptive
+          palette (a local color table), like when the whole GIF is written at once.
+        - Other extensions (e.g. .mp4, .webm) are written with imageio's ffmpeg writer, which
+          requires the imageio-ffmpeg package.
+    """
+
+    def __init__(self, file_name, frame_rate):
+        """
+        :param file_name: The file name including the extension.
+        :param frame_rate: The number of frames per second.
+        """
+        self.file_name = file_name
+        self.frame_rate = frame_rate
+        self.number_of_frames = 0
+
+        self.is_gif = os.path.splitext(file_name)[1].lower() == '.gif'
+        if self.is_gif:
+            self.file = open(file_name, 'wb')
+        else:
+            self.writer = imageio.get_writer(file_name, fps=frame_rate)
+
+    def append(self, image):
+        """
+        Appends an RGB (or RGBA) frame to the animation.
+        :param image: HxWx3 (or HxWx4) uint8 array.
+        """
+        image = np.asarray(image)[:, :, 0:3]
+
+        if self.is_gif:
+            frame = Image.fromarray(image).convert('P', palette=Image.Palette.ADAPTIVE)
+            if self.number_of_frames == 0:
+                header, _ = GifImagePlugin.getheader(frame.copy(), info={'loop': 0})
+                for block in header:
+                    self.file.write(block)
+            for block in GifImagePlugin.getdata(frame, duration=1000 / self.frame_rate, include_color_table=True):
+                self.file.write(block)
+        else:
+            self.writer.append_data(image)
+
+        self.number_of_frames += 1
+
+    def close(self):
+        if self.is_gif:
+            # GIF trailer
+            self.file.write(b';')
+            self.file.close()
+        else:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,42 @@
+import functools
+
+import numpy as np
+
+from Mesh.HigherOrderMesh.decode_all_triangle_indices import decode_all_triangle_indices
+from Mesh.HigherOrderMesh.generate_ijk_indices import generate_ijk_indices
+from Simulator.HigherOrderElements.shape_functions import silvester_shape_functions
+
+
+@functools.lru_cache(maxsize=None)
+def compute_interpolation_matrix(element_order, sample_n):
+    """
+    Computes the (number of sample points)xm matrix with the values of all the shape functions of
+    an element at the sample points generate_ijk_indices(sample_n) / sample_n.
+
+    The columns follow the local node order of decode_all_triangle_indices, so the sample points of
+    all elements are given by N @ V[global_indices]. The matrix is cached and must not be modified.
+
+    :param element_order:
+    :param sample_n:
+    :return N:
+    """
+
+    sample_points = generate_ijk_indices(sample_n) / sample_n
+    _, ijk_indices = decode_all_triangle_indices([], element_order)
+
+    N = silvester_shape_functions(ijk_indices, sample_points, element_order)
+    N.setflags(write=False)
+
+    return N
+
+
+def interpolate_element_points(N, V, global_indices):
+    """
+    Maps the sample points of all elements to the mesh given by the vertices V.
+    :param N: The interpolation matrix.
+    :param V: nx2 array of vertices.
+    :param global_indices: (number of elements)xm array of element node indices.
+    :return points: (number of elements * number of sample points)x2 array.
+    """
+
+    return np.einsum('sm,emi->esi', N, V[global_indices]).reshape([-1, 2])
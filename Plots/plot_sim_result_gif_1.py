@@ -1,31 +1,44 @@
-import random
+import math
+import multiprocessing
+import os
+from multiprocessing import shared_memory
 
-import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
-import imageio
-import io
-from PIL import Image
 from tqdm import tqdm
-from Mesh.HigherOrderMesh.decode_triangle_indices import decode_triangle_indices
-from Mesh.HigherOrderMesh.generate_ijk_indices import generate_ijk_indices
-from Simulator.HigherOrderElements.shape_functions import silvester_shape_function
-
-def make_sim_result_gif_1(FEM_V, FEM_encodings, result, num_nodes_x, num_nodes_y, traction, time, time_step_size, file_name, element_order):
-    # number_of_nodes = num_nodes_x * num_nodes_y
+from Mesh.HigherOrderMesh.decode_all_triangle_indices import decode_all_triangle_indices
+from Plots.animation_writer import AnimationWriter
+from Plots.compute_interpolation_matrix import compute_interpolation_matrix, interpolate_element_points
+
+# Read-only data shared by the frame rendering workers. Set by _initialize_frame_worker.
+_frame_worker_state = dict()
+
+
+def _initialize_frame_worker(FEM_V, N, global_indices, shared_memory_name, frames_shape):
+    frames_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _frame_worker_state['frames_memory'] = frames_memory
+    _frame_worker_state['displacements'] = np.ndarray(frames_shape, dtype=np.float64, buffer=frames_memory.buf)
+    _frame_worker_state['FEM_V'] = FEM_V
+    _frame_worker_state['N'] = N
+    _frame_worker_state['global_indices'] = global_indices
+    _frame_worker_state['reference_points'] = interpolate_element_points(N, FEM_V, global_indices)
+
+
+def _render_frames(frame_indices):
+    """
+    Renders the frames with the given indices into the shared displacements.
+    :param frame_indices:
+    :return images: List of RGB images.
+    """
+    FEM_V = _frame_worker_state['FEM_V']
+    N = _frame_worker_state['N']
+    global_indices = _frame_worker_state['global_indices']
+    reference_points = _frame_worker_state['reference_points']
+    displacements = _frame_worker_state['displacements']
 
     images = []
-
-    num_time_steps_per_frame = int(30 * (0.001 / time_step_size))
-    time_rate = 1
-
-
-
-    sample_n = int(max(40 / FEM_encodings.shape[0], 5))
-    sample_points = generate_ijk_indices(sample_n) / sample_n
-
-    for i in tqdm(range(0, len(result.nodal_displacements), num_time_steps_per_frame), desc='Creating GIF'):
+    for i in frame_indices:
         # make a Figure and attach it to a canvas.
         fig = Figure()
         canvas = FigureCanvasAgg(fig)
@@ -33,31 +46,11 @@ def make_sim_result_gif_1(FEM_V, FEM_encodings, result, num_nodes_x, num_nodes_y
         # Do some plotting here
         ax = fig.add_subplot(111)
 
-        deformed_V = FEM_V + result.nodal_displacements[i].reshape((len(FEM_V), 2))
-
-        for i, encoding in enumerate(FEM_encodings):
-            reference_points = []
-            interpolated_points = []
-            global_indices, ijk_indices = decode_triangle_indices(encoding, element_order)
-            for sample_point in sample_points:
-                N_vals = []
-                for i, ijk_index in enumerate(ijk_indices):
-                    N_val = silvester_shape_function(ijk_index, sample_point, element_order)
-                    N_vals.append(N_val)
-                N_vals = np.array(N_vals)
-
-                interpolated_point = N_vals @ deformed_V[global_indices]
-                interpolated_points.append(interpolated_point)
-                interpolated_reference_point = N_vals @ FEM_V[global_indices]
-                reference_points.append(interpolated_reference_point)
-            interpolated_points = np.array(interpolated_points)
-            reference_points = np.array(reference_points)
-            ax.scatter(reference_points[:, 0], reference_points[:, 1],zorder=0)
-            ax.scatter(interpolated_points[:, 0], interpolated_points[:, 1], zorder=10)
-
-        # interpolated_points = np.array(interpolated_points)
-        # reference_points = np.array(reference_points)
+        deformed_V = FEM_V + displacements[i].reshape((len(FEM_V), 2))
 
+        interpolated_points = interpolate_element_points(N, deformed_V, global_indices)
+        ax.scatter(reference_points[:, 0], reference_points[:, 1], zorder=0)
+        ax.scatter(interpolated_points[:, 0], interpolated_points[:, 1], zorder=10)
 
         # ax.legend(handles=[reference, deformed], loc='upper left')
         ax.set_xlabel(r'$X_1$')
@@ -66,20 +59,77 @@ def make_sim_result_gif_1(FEM_V, FEM_encodings, result, num_nodes_x, num_nodes_y
         ax.set_ylabel(r'$X_2$')
         ax.set_title('Showing the deformed cantilever mesh compared with the reference mesh.')
 
-        # Trick to write PNG into memory buffer and read it using PIL
-        with io.BytesIO() as out:
-            fig.savefig(out, format="png")  # Add dpi= to match your figsize
-            pic = Image.open(out)
-            pix = np.array(pic.getdata(), dtype=np.uint8).reshape(pic.size[1], pic.size[0], -1)
-        images.append(pix)
+        # Retrieve the frame directly from the renderer buffer (no PNG encoding/decoding)
+        canvas.draw()
+        images.append(np.asarray(canvas.buffer_rgba())[:, :, 0:3].copy())
+
+    return images
+
+
+def select_frame_time_indices(time_steps, frame_rate, time_rate=1):
+    """
+    Selects the time steps shown in an animation with the given frame rate.
+    :param time_steps: The simulated times.
+    :param frame_rate: The number of frames per second of the animation.
+    :param time_rate: The simulated time shown per second of the animation.
+    :return frame_time_indices:
+    """
+    time_steps = np.asarray(time_steps)
+    frame_times = np.arange(time_steps[0], time_steps[-1] + 1e-12, time_rate / frame_rate)
+    frame_time_indices = np.searchsorted(time_steps, frame_times - 1e-12)
 
+    return np.unique(np.minimum(frame_time_indices, len(time_steps) - 1))
 
-        # # Retrieve a view on the renderer buffer
-        # canvas.draw()
-        # buf = canvas.buffer_rgba()
-        # # convert to a NumPy array
-        # plot_image = np.asarray(buf)
-        # images.append(plot_image)
 
-    # kargs = {'duration': time_step_size*num_time_steps_per_frame}
-    imageio.mimsave(file_name + '.gif', images, duration=time_step_size*num_time_steps_per_frame*time_rate)
+def make_sim_result_gif_1(FEM_V, FEM_encodings, result, num_nodes_x, num_nodes_y, traction, time, time_step_size, file_name, element_order,
+                          num_workers=None, frame_rate=30, file_extension='.gif'):
+    # number_of_nodes = num_nodes_x * num_nodes_y
+
+    time_rate = 1
+
+    sample_n = int(max(40 / FEM_encodings.shape[0], 5))
+    N = compute_interpolation_matrix(element_order, sample_n)
+    global_indices, _ = decode_all_triangle_indices(FEM_encodings, element_order)
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    # Copy the displacements of the frames into shared memory so the workers can read them without copies
+    frame_time_indices = select_frame_time_indices(result.time_steps[0:len(result.nodal_displacements)],
+                                                   frame_rate, time_rate)
+    frames_shape = (len(frame_time_indices), 2 * len(FEM_V))
+    frames_memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(frames_shape)) * 8))
+    try:
+        frame_displacements = np.ndarray(frames_shape, dtype=np.float64, buffer=frames_memory.buf)
+        for j, i in enumerate(frame_time_indices):
+            frame_displacements[j] = result.nodal_displacements[i]
+        del frame_displacements
+
+        # Split the frames into slices. There are more slices than workers to balance the load.
+        slice_size = max(1, math.ceil(len(frame_time_indices) / (4 * num_workers)))
+        frame_slices = [range(j, min(j + slice_size, len(frame_time_indices)))
+                        for j in range(0, len(frame_time_indices), slice_size)]
+
+        initargs = (FEM_V, N, global_indices, frames_memory.name, frames_shape)
+        progress_bar = tqdm(total=len(frame_time_indices), desc='Creating GIF')
+        # The frames are appended to the file as they arrive, so only a few slices are held in memory
+        with AnimationWriter(file_name + file_extension, frame_rate) as writer:
+            if num_workers > 1:
+                with multiprocessing.Pool(num_workers, initializer=_initialize_frame_worker, initargs=initargs) as pool:
+                    # imap returns the slices in order
+                    for slice_images in pool.imap(_render_frames, frame_slices):
+                        for image in slice_images:
+                            writer.append(image)
+                        progress_bar.update(len(slice_images))
+            else:
+                _initialize_frame_worker(*initargs)
+                for frame_slice in frame_slices:
+                    slice_images = _render_frames(frame_slice)
+                    for image in slice_images:
+                        writer.append(image)
+                    progress_bar.update(len(slice_images))
+                _frame_worker_state.clear()
+        progress_bar.close()
+    finally:
+        frames_memory.close()
+        frames_memory.unlink()
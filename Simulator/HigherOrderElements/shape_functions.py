@@ -29,6 +29,54 @@ def silvester_shape_function(ijk_index, xi, n):
     return shape_function
 
 
+def silvester_shape_functions(ijk_indices, xis, n):
+    """
+    Returns the values of all the shape functions given by ijk_indices at many points.
+    :param ijk_indices: mx3 array.
+    :param xis: (number of points)x3 array of barycentric coordinates.
+    :param n:
+    :return shape_functions: (number of points)xm array.
+    """
+
+    xis = np.asarray(xis, dtype=np.float64)
+
+    shape_functions = np.zeros((len(xis), len(ijk_indices)))
+    for i, ijk_index in enumerate(ijk_indices):
+        shape_functions[:, i] = silvester_shape_function(ijk_index, xis.T, n)
+
+    return shape_functions
+
+
+def silvester_shape_function_barycentric_derivatives(ijk_indices, xis, n):
+    """
+    Returns the barycentric derivatives of all the shape functions given by ijk_indices at many
+    points. The derivatives of the products P are computed with the product rule, so there are no
+    divisions by zero at the nodes.
+    :param ijk_indices: mx3 array.
+    :param xis: (number of points)x3 array of barycentric coordinates.
+    :param n:
+    :return dN_dxi: (number of points)xmx3 array.
+    """
+
+    xis = np.asarray(xis, dtype=np.float64)
+
+    dN_dxi = np.zeros((len(xis), len(ijk_indices), 3))
+    for i, ijk_index in enumerate(ijk_indices):
+        Ps = [P(ijk_index[c], xis[:, c], n) * np.ones(len(xis)) for c in range(3)]
+        for c in range(3):
+            z = ijk_index[c]
+            dP = np.zeros(len(xis))
+            for l in range(1, z + 1):
+                term = (n / l) * np.ones(len(xis))
+                for h in range(1, z + 1):
+                    if h != l:
+                        term *= f_i(h, xis[:, c], n)
+                dP += term
+            dN_dxi[:, i, c] = dP * Ps[c - 1] * Ps[c - 2]
+
+    return dN_dxi
+
+
 def dP_dxi(z, xi, n):
     result = 0
     for i in range(2, z + 1):
@@ -138,6 +186,43 @@ def shape_function_spatial_derivative(V_e, triangle_encoding, x, n):
 
     return dN_dx
 
+def shape_function_spatial_derivatives(V_es, ijk_indices, xi, n):
+    """
+    Computes the spatial derivatives of all the shape functions with order n for many triangles at
+    once. The derivatives are evaluated at the same barycentric coordinates xi in every triangle.
+
+    The V_es parameter contains the (x,y) pairs of the vertices of every triangle, ordered like the
+    ijk_indices (see decode_all_triangle_indices).
+
+    :param V_es: (number of triangles)xmx2 array.
+    :param ijk_indices: mx3 array.
+    :param xi:
+    :param n:
+    :return dN_dx: (number of triangles)xmx2 array.
+    """
+
+    m = len(ijk_indices)
+
+    # Barycentric derivatives matrix (the same for all triangles)
+    dN_dxi = np.zeros((m, 3))
+    for i in range(m):
+        for xi_index in range(3):
+            dN_dxi[i, xi_index] = shape_function_barycentric_derivative(ijk_indices[i], xi, xi_index, n)
+
+    # V_mat matrices
+    V_mat = np.ones((len(V_es), 3, m))
+    V_mat[:, 1, :] = V_es[:, :, 0]
+    V_mat[:, 2, :] = V_es[:, :, 1]
+
+    B = V_mat @ dN_dxi
+    BInv = np.linalg.inv(B)
+
+    dxi_dx = BInv[:, :, 1:3]
+
+    dN_dx = dN_dxi @ dxi_dx
+
+    return dN_dx
+
 def binomial(x,y,i,k):
     return (y**k) * (x**(i-k))
 
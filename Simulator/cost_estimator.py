@@ -0,0 +1,233 @@
+# Estimates of the memory use and cost of a simulation, computed from the mesh settings before
+# anything is allocated.
+#
+# The estimates count the large arrays of the simulator (the mass and damping matrices, the arrays at
+# the quadrature points, the kernel temporaries and the history), so they are lower bounds of the
+# memory use of the process, but they are accurate enough to tell whether a configuration fits.
+import math
+import os
+import warnings
+
+import numpy as np
+
+MASS_MATRIX_BACKENDS = ['dense', 'sparse', 'lumped']
+OUTPUT_POLICIES = ['memory', 'stream']
+# The mass matrix backends that give the same results up to round-off
+CONSISTENT_MASS_MATRIX_BACKENDS = ['dense', 'sparse']
+
+# The backends 'auto' stands for when no memory budget is given
+DEFAULT_MASS_MATRIX_BACKEND = 'dense'
+DEFAULT_OUTPUT_POLICY = 'memory'
+
+FLOAT_BYTES = 8
+INDEX_BYTES = 4
+
+# Assumed ratio between the number of non-zeros of the sparse LU factors and of the mass matrix
+SPARSE_FACTOR_FILL = 8
+
+
+def get_physical_memory():
+    """
+    Returns the total physical memory in bytes, or None if it cannot be determined.
+    """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_available_memory():
+    """
+    Returns the physical memory that is currently free in bytes, or None if it cannot be
+    determined.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class CostEstimate:
+    def __init__(self, number_of_nodes_x, number_of_nodes_y, element_order, number_of_time_steps,
+                 chunk_size=256, number_of_chunk_buffers=4, float_bytes=FLOAT_BYTES, output_float_bytes=None,
+                 quadrature_degree=None):
+        """
+        :param number_of_nodes_x:
+        :param number_of_nodes_y:
+        :param element_order:
+        :param number_of_time_steps:
+        :param chunk_size: The number of time steps in a chunk of the streamed output.
+        :param number_of_chunk_buffers: The number of chunks the result writer holds in memory when
+            the output is streamed.
+        :param float_bytes: The size of the floats of the internal force kernel and the state.
+        :param output_float_bytes: The size of the floats of the stored history. Defaults to
+            float_bytes.
+        :param quadrature_degree: The quadrature degree of the internal forces. Defaults to
+            element_order + 1.
+        """
+        self.number_of_time_steps = number_of_time_steps
+        self.float_bytes = float_bytes
+        self.output_float_bytes = output_float_bytes if output_float_bytes is not None else float_bytes
+        self.chunk_size = chunk_size
+        self.number_of_chunk_buffers = number_of_chunk_buffers
+
+        # The cantilever is a grid of squares split into two triangles, and every order adds nodes on
+        # the edges and inside the elements, so the FEM nodes form a finer grid
+        self.number_of_elements = 2 * (number_of_nodes_x - 1) * (number_of_nodes_y - 1)
+        self.number_of_nodes = ((element_order * (number_of_nodes_x - 1) + 1) *
+                                (element_order * (number_of_nodes_y - 1) + 1))
+        self.number_of_dofs = 2 * self.number_of_nodes
+        self.nodes_per_element = (element_order + 1) * (element_order + 2) // 2
+
+        # Approximate number of points of a quadrature rule of the degree of the internal forces
+        degree = quadrature_degree if quadrature_degree is not None else element_order + 1
+        self.number_of_quadrature_points = math.ceil((degree + 1) * (degree + 2) / 6) + 1
+
+        # The element matrices only couple the x and the y dofs among themselves
+        self.mass_matrix_non_zeros = min(self.number_of_elements * 2 * self.nodes_per_element ** 2,
+                                         self.number_of_dofs ** 2)
+
+    def get_memory_bytes(self, mass_matrix_backend='dense', output_policy='memory'):
+        """
+        Returns the estimated memory use of the large arrays of the simulation in bytes.
+        :param mass_matrix_backend: 'dense', 'sparse' or 'lumped'.
+        :param output_policy: 'memory' or 'stream'.
+        :return memory: Dictionary from the name of every group of arrays to its size in bytes.
+        """
+        n = self.number_of_dofs
+        e = self.number_of_elements
+        m = self.nodes_per_element
+        q = self.number_of_quadrature_points
+
+        memory = dict()
+
+        # Element mass (or damping) matrices before they are assembled
+        memory['element_matrices'] = e * (2 * m) ** 2 * FLOAT_BYTES
+
+        # Mass, inverse mass and damping matrices, and the temporary matrices while they are built
+        if mass_matrix_backend == 'dense':
+            memory['mass_matrices'] = 4 * n ** 2 * FLOAT_BYTES
+        elif mass_matrix_backend == 'sparse':
+            csr_bytes = self.mass_matrix_non_zeros * (FLOAT_BYTES + INDEX_BYTES) + (n + 1) * INDEX_BYTES
+            memory['mass_matrices'] = (3 + SPARSE_FACTOR_FILL) * csr_bytes
+        elif mass_matrix_backend == 'lumped':
+            memory['mass_matrices'] = 3 * n * (FLOAT_BYTES + INDEX_BYTES)
+        else:
+            raise Exception("Unknown mass matrix backend: {}".format(mass_matrix_backend))
+
+        # Shape function derivatives, strains, stresses and det(F) at the quadrature points, and the
+        # temporaries of the internal force kernel (F, P and the element forces)
+        memory['quadrature_fields'] = e * q * (2 * m + 4 + 4 + 1) * self.float_bytes
+        memory['kernel_temporaries'] = (2 * e * q * 4 + e * 2 * m + 2 * n) * self.float_bytes
+
+        # Displacements, velocities, accelerations and damping forces, the strains, and the time
+        # of every stored time step.
+        frame_bytes = (4 * n + e * q * 4) * self.output_float_bytes + FLOAT_BYTES
+        if output_policy == 'memory':
+            memory['history'] = (self.number_of_time_steps + 1) * frame_bytes
+        elif output_policy == 'stream':
+            memory['history'] = (min(self.chunk_size, self.number_of_time_steps + 1) * frame_bytes *
+                                 self.number_of_chunk_buffers +
+                                 (self.number_of_time_steps + 1) * FLOAT_BYTES)
+        else:
+            raise Exception("Unknown output policy: {}".format(output_policy))
+
+        return memory
+
+    def get_peak_memory_bytes(self, mass_matrix_backend='dense', output_policy='memory'):
+        return sum(self.get_memory_bytes(mass_matrix_backend, output_policy).values())
+
+    def get_flops_per_step(self, mass_matrix_backend='dense'):
+        """
+        Returns the estimated number of floating point operations of one time step.
+        """
+        n = self.number_of_dofs
+        e = self.number_of_elements
+        m = self.nodes_per_element
+        q = self.number_of_quadrature_points
+
+        # F, E, S, det(F), P = F S and the integration against the shape function derivatives
+        internal_forces = e * q * (8 * m + 48 + 8 * m)
+
+        if mass_matrix_backend == 'dense':
+            damping_and_mass_solve = 2 * 2 * n ** 2
+        elif mass_matrix_backend == 'sparse':
+            damping_and_mass_solve = 2 * self.mass_matrix_non_zeros * (1 + 2 * SPARSE_FACTOR_FILL)
+        else:
+            damping_and_mass_solve = 2 * n
+
+        update = 10 * n
+
+        return internal_forces + damping_and_mass_solve + update
+
+    def report(self, mass_matrix_backend='dense', output_policy='memory'):
+        memory = self.get_memory_bytes(mass_matrix_backend, output_policy)
+        lines = ["Estimated cost ({} mass matrix, {} output): {} nodes, {} elements, {} time steps".format(
+            mass_matrix_backend, output_policy, self.number_of_nodes, self.number_of_elements,
+            self.number_of_time_steps)]
+        for name, size in memory.items():
+            lines.append("  {:<20} {:>12.2f} MB".format(name, size / 1024 ** 2))
+        lines.append("  {:<20} {:>12.2f} MB".format('peak', sum(memory.values()) / 1024 ** 2))
+        flops = self.get_flops_per_step(mass_matrix_backend)
+        lines.append("  {:<20} {:>12.3e} flop per step, {:.3e} flop in total".format(
+            'cost', flops, flops * self.number_of_time_steps))
+
+        return '\n'.join(lines)
+
+
+def select_backends(cost_estimate, mass_matrix_backend='auto', output_policy='auto', memory_budget_bytes=None):
+    """
+    Selects the mass matrix backend and the output policy of a simulation.
+
+    Without a memory budget 'auto' is the dense mass matrix with the output kept in memory, so the
+    backends (and the results) do not depend on the memory that happens to be free. The backends
+    must then fit in the total physical memory. With a memory budget 'auto' selects the first
+    backends that fit in it: the dense mass matrix, then the sparse one, keeping the output in
+    memory if it fits and streaming it to disk otherwise. The lumped mass matrix changes the
+    results, so it is only selected if neither consistent mass matrix fits, with a warning.
+
+    The memory that is currently free changes from run to run, so it does not affect the selection.
+    A warning is given if the selected backends need more than that.
+
+    :param cost_estimate:
+    :param mass_matrix_backend: 'auto', 'dense', 'sparse' or 'lumped'.
+    :param output_policy: 'auto', 'memory' or 'stream'.
+    :param memory_budget_bytes: The memory the simulation may use, or None. Without a budget the
+        backends are checked against the total physical memory.
+    :return mass_matrix_backend, output_policy:
+    """
+    if memory_budget_bytes is None:
+        mass_matrix_backends = [DEFAULT_MASS_MATRIX_BACKEND if mass_matrix_backend == 'auto' else mass_matrix_backend]
+        output_policies = [DEFAULT_OUTPUT_POLICY if output_policy == 'auto' else output_policy]
+        memory_budget_bytes = get_physical_memory()
+        if memory_budget_bytes is None:
+            memory_budget_bytes = np.inf
+    else:
+        mass_matrix_backends = MASS_MATRIX_BACKENDS if mass_matrix_backend == 'auto' else [mass_matrix_backend]
+        output_policies = OUTPUT_POLICIES if output_policy == 'auto' else [output_policy]
+
+    for backend in mass_matrix_backends:
+        for policy in output_policies:
+            if cost_estimate.get_peak_memory_bytes(backend, policy) <= memory_budget_bytes:
+                if mass_matrix_backend == 'auto' and backend not in CONSISTENT_MASS_MATRIX_BACKENDS:
+                    warnings.warn("The consistent mass matrices do not fit in the memory budget of {:.2f} MB, "
+                                  "the {} mass matrix is used, which changes the results".format(
+                                      memory_budget_bytes / 1024 ** 2, backend))
+                check_available_memory(cost_estimate.get_peak_memory_bytes(backend, policy))
+                return backend, policy
+
+    raise MemoryError("The simulation does not fit in the memory budget of {:.2f} MB. Select another "
+                      "mass_matrix_backend or output_policy, or pass a memory_budget_bytes to select them "
+                      "automatically.\n{}".format(
+                          memory_budget_bytes / 1024 ** 2,
+                          cost_estimate.report(mass_matrix_backends[-1], output_policies[-1])))
+
+
+def check_available_memory(peak_memory_bytes):
+    """
+    Warns if the estimated peak memory is more than the physical memory that is currently free.
+    """
+    available_memory = get_available_memory()
+    if available_memory is not None and peak_memory_bytes > available_memory:
+        warnings.warn("The simulation needs an estimated {:.2f} MB, but only {:.2f} MB of memory is free, "
+                      "it may swap".format(peak_memory_bytes / 1024 ** 2, available_memory / 1024 ** 2))
@@ -6,20 +6,21 @@ from Simulator.triangle_shape_functions import triangle_shape_function_i_helper,
     triangle_shape_function_j_helper, triangle_shape_function_k_helper
 
 
-def compute_shape_function_volume(points, face):
+def compute_shape_function_volume(points, face, degree=10):
     """
     Compute the integral of the shape function value for node i.
     :param points: Is a nx2 numpy array containing the x and y coordinates of the nodes.
     :param face: Is a 3x1 numpy array containing the indices of the nodes of the triangle.
+    :param degree: The degree of the quadrature scheme.
     :return:
     """
 
     # Compute matrix using quadpy (quadpy is a quadrature package)
     triangle = points[face]
 
-    # get a "good" scheme of degree 10. (Even 2 should be enough since be use linear elements
-    # and we multiply them to get a second order polynomial)
-    scheme = quadpy.t2.get_good_scheme(10)
+    # get a "good" scheme of the degree (10 by default, even 2 should be enough since be use linear
+    # elements and we multiply them to get a second order polynomial)
+    scheme = quadpy.t2.get_good_scheme(degree)
 
     def N_i(x):
         return triangle_shape_function_i_helper(points, face, x)
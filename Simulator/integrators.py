@@ -0,0 +1,243 @@
+# Explicit time integrators of the equations of motion M a = f - C v - k(x).
+#
+# An integrator advances the positions and velocities by one time step. It gets the accelerations
+# from Simulator.compute_accelerations, which evaluates the internal forces, so the cost of a step is
+# about force_evaluations_per_step internal force evaluations. stability_limit is the largest stable
+# omega_max * time_step of the undamped equations, where omega_max is the highest natural frequency
+# of the mesh (see Simulator.estimate_max_frequency). stability_limit / force_evaluations_per_step is
+# therefore the stable time advanced per force evaluation, relative to 1 / omega_max.
+#
+# The external forces are given as a function of time, which the integrators evaluate at the time of
+# every force evaluation, so time-dependent loads (see load_curves.py) keep the order of accuracy.
+#
+# The velocities of some integrators are at the half steps (staggered_velocities), which the energy
+# accumulator has to know to compute the kinetic energy and the damping work consistently. The
+# tracked total energy of semi-implicit Euler is conserved up to round-off, and the drift of the
+# others shrinks with the order of the method (2 for central difference and velocity Verlet, 3 for
+# Bogacki-Shampine) for all mass matrix backends, see Tests/test_energy_drift.py.
+#
+# The Dirichlet dofs have zero accelerations and velocities, so they keep their positions.
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+
+class TimeIntegrator:
+    """
+    Base class of the integrators. Subclasses implement step.
+    """
+
+    name = None
+    force_evaluations_per_step = 1
+    stability_limit = 2.0
+    # True if the returned velocities are at the half steps, e.g. v_n+1/2 instead of v_n+1
+    staggered_velocities = False
+
+    def step(self, simulator, time, x_n, v_n, Minv, C, external_forces):
+        """
+        Takes one step of size simulator.time_step.
+        :param simulator: The Simulator, which computes the accelerations.
+        :param time: The time at the start of the step.
+        :param x_n: The positions at the start of the step.
+        :param v_n: The velocities at the start of the step.
+        :param Minv: The inverse mass matrix (or an operator applying it).
+        :param C: The damping matrix.
+        :param external_forces: Function returning the external forces at a time.
+        :return x_n_1, v_n_1, a_n_1, k, E, damping_term: The positions, velocities and accelerations
+            after the step, the internal and damping forces at the start of the step and the Green
+            strains at the last evaluation.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Forgets the state kept from the previous steps, called at the start of a simulation.
+        """
+        pass
+
+    def get_stable_time_step(self, max_frequency):
+        """
+        :param max_frequency: The highest natural (angular) frequency of the mesh.
+        :return time_step: The largest stable time step of the undamped equations.
+        """
+        return self.stability_limit / max_frequency
+
+    def get_configuration(self):
+        return self.name
+
+
+class SemiImplicitEuler(TimeIntegrator):
+    """
+    v_n+1 = v_n + dt a(x_n, v_n), x_n+1 = x_n + dt v_n+1. Symplectic and first order accurate.
+    """
+
+    name = 'semi_implicit_euler'
+    # x_n+1 - x_n = dt v_n+1, so the velocities are those of the half step in between
+    staggered_velocities = True
+
+    def step(self, simulator, time, x_n, v_n, Minv, C, external_forces):
+        a_n, k, E, damping_term = simulator.compute_accelerations(x_n, v_n, Minv, C, external_forces(time))
+        with simulator.profiler.timer('update'):
+            v_n_1 = v_n + simulator.time_step * a_n
+            x_n_1 = x_n + simulator.time_step * v_n_1
+
+        return x_n_1, v_n_1, a_n, k, E, damping_term
+
+
+class CentralDifference(TimeIntegrator):
+    """
+    The explicit central difference method with velocities at the half steps:
+    v_n+1/2 = v_n-1/2 + dt a(x_n, v_n-1/2), x_n+1 = x_n + dt v_n+1/2, started with
+    v_1/2 = v_0 + dt/2 a_0. Second order accurate. The velocities it returns are the half step
+    velocities v_n+1/2, the damping forces use the velocities half a step behind.
+    """
+
+    name = 'central_difference'
+    staggered_velocities = True
+
+    def __init__(self):
+        self.half_step_velocities = None
+
+    def reset(self):
+        self.half_step_velocities = None
+
+    def step(self, simulator, time, x_n, v_n, Minv, C, external_forces):
+        a_n, k, E, damping_term = simulator.compute_accelerations(x_n, v_n, Minv, C, external_forces(time))
+        with simulator.profiler.timer('update'):
+            # v_n is a half step velocity unless it is the first step
+            time_step = simulator.time_step if v_n is self.half_step_velocities else simulator.time_step / 2
+            v_n_1 = v_n + time_step * a_n
+            x_n_1 = x_n + simulator.time_step * v_n_1
+        self.half_step_velocities = v_n_1
+
+        return x_n_1, v_n_1, a_n, k, E, damping_term
+
+
+class VelocityVerlet(TimeIntegrator):
+    """
+    x_n+1 = x_n + dt v_n + dt^2/2 a_n, v_n+1 = v_n + dt/2 (a_n + a_n+1). Symplectic and second order
+    accurate. The accelerations at the end of a step are reused at the start of the next, and the
+    damping forces of a_n+1 use the predicted velocities v_n + dt a_n.
+    """
+
+    name = 'velocity_verlet'
+
+    def __init__(self):
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def step(self, simulator, time, x_n, v_n, Minv, C, external_forces):
+        time_step = simulator.time_step
+        if self.state is not None and self.state[0] is x_n and self.state[1] is v_n:
+            a_n, k, damping_term = self.state[2:]
+        else:
+            a_n, k, _, damping_term = simulator.compute_accelerations(x_n, v_n, Minv, C, external_forces(time))
+
+        with simulator.profiler.timer('update'):
+            x_n_1 = x_n + time_step * v_n + (time_step ** 2 / 2) * a_n
+            v_predicted = v_n + time_step * a_n
+        a_n_1, k_n_1, E, damping_term_n_1 = simulator.compute_accelerations(x_n_1, v_predicted, Minv, C,
+                                                                           external_forces(time + time_step))
+        with simulator.profiler.timer('update'):
+            v_n_1 = v_n + (time_step / 2) * (a_n + a_n_1)
+        self.state = (x_n_1, v_n_1, a_n_1, k_n_1, damping_term_n_1)
+
+        return x_n_1, v_n_1, a_n_1, k, E, damping_term
+
+
+class BogackiShampine(TimeIntegrator):
+    """
+    The embedded Runge-Kutta 3(2) pair of Bogacki and Shampine applied to y = (x, v), y' = (v, a).
+    The step is third order accurate, and the difference to the embedded second order solution is
+    an estimate of its error. The last stage is evaluated at the end of the step and reused as the
+    first stage of the next (first same as last), so a step costs three force evaluations.
+
+    The estimated error of every step, relative to the largest displacement and velocity, is appended
+    to error_estimates.
+    """
+
+    name = 'bogacki_shampine'
+    force_evaluations_per_step = 3
+    # The stability region of third order Runge-Kutta methods crosses the imaginary axis at sqrt(3)
+    stability_limit = np.sqrt(3)
+
+    A = [[], [1 / 2], [0, 3 / 4], [2 / 9, 1 / 3, 4 / 9]]
+    # The times of the stages relative to the time step
+    STAGE_TIMES = [0, 1 / 2, 3 / 4, 1]
+    # Weights of the third order solution minus the second order solution
+    ERROR_WEIGHTS = [2 / 9 - 7 / 24, 1 / 3 - 1 / 4, 4 / 9 - 1 / 3, -1 / 8]
+
+    def __init__(self):
+        self.state = None
+        self.error_estimates = []
+
+    def reset(self):
+        self.state = None
+        self.error_estimates = []
+
+    def step(self, simulator, time, x_n, v_n, Minv, C, external_forces):
+        time_step = simulator.time_step
+        if self.state is not None and self.state[0] is x_n and self.state[1] is v_n:
+            a_n, k, damping_term = self.state[2:]
+        else:
+            a_n, k, _, damping_term = simulator.compute_accelerations(x_n, v_n, Minv, C, external_forces(time))
+
+        # Stage derivatives of the positions (velocities) and of the velocities (accelerations)
+        stage_velocities = [v_n]
+        stage_accelerations = [a_n]
+        for weights, c in zip(self.A[1:], self.STAGE_TIMES[1:]):
+            with simulator.profiler.timer('update'):
+                x = x_n + time_step * sum(w * v for w, v in zip(weights, stage_velocities) if w != 0)
+                v = v_n + time_step * sum(w * a for w, a in zip(weights, stage_accelerations) if w != 0)
+            a, k_stage, E, damping_stage = simulator.compute_accelerations(x, v, Minv, C,
+                                                                           external_forces(time + c * time_step))
+            stage_velocities.append(v)
+            stage_accelerations.append(a)
+
+        # The last stage is the third order solution at the end of the step
+        x_n_1, v_n_1, a_n_1 = x, v, a
+        self.state = (x_n_1, v_n_1, a_n_1, k_stage, damping_stage)
+
+        with simulator.profiler.timer('error_estimate'):
+            x_error = time_step * sum(w * v for w, v in zip(self.ERROR_WEIGHTS, stage_velocities))
+            v_error = time_step * sum(w * a for w, a in zip(self.ERROR_WEIGHTS, stage_accelerations))
+            x_scale = np.max(np.abs(x_n_1 - simulator.FEM_V.reshape(-1)))
+            v_scale = np.max(np.abs(v_n_1))
+            self.error_estimates.append(max(np.max(np.abs(x_error)) / x_scale if x_scale > 0 else 0.0,
+                                            np.max(np.abs(v_error)) / v_scale if v_scale > 0 else 0.0))
+
+        return x_n_1, v_n_1, a_n_1, k, E, damping_term
+
+
+INTEGRATORS = {integrator.name: integrator for integrator in
+               [SemiImplicitEuler, CentralDifference, VelocityVerlet, BogackiShampine]}
+
+
+def get_integrator(integrator):
+    """
+    Returns a TimeIntegrator given by its name, or the integrator itself.
+    """
+    if isinstance(integrator, TimeIntegrator):
+        return integrator
+    if integrator not in INTEGRATORS:
+        raise Exception("Unknown integrator: {}. Available integrators: {}".format(
+            integrator, ', '.join(INTEGRATORS)))
+    return INTEGRATORS[integrator]()
+
+
+def estimate_max_frequency(K, M, free_dofs):
+    """
+    Computes the highest natural (angular) frequency of the free dofs, the square root of the
+    largest eigenvalue of K_ff x = lambda M_ff x.
+    :param K: The (linear) stiffness matrix.
+    :param M: The mass matrix.
+    :param free_dofs: The dofs without Dirichlet boundary conditions.
+    :return max_frequency:
+    """
+    K_free = sparse.csr_matrix(K)[free_dofs][:, free_dofs]
+    M_free = sparse.csr_matrix(M)[free_dofs][:, free_dofs]
+    eigenvalues = sparse_linalg.eigsh(K_free, k=1, M=M_free.tocsc(), which='LA', return_eigenvectors=False)
+
+    return float(np.sqrt(eigenvalues[0]))
@@ -0,0 +1,72 @@
+import numpy as np
+
+from Simulator.profiler import DISABLED_PROFILER
+
+
+def compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, constitutive_model, number_of_dofs,
+                            Es=None, Ss=None, Js=None, profiler=None):
+    """
+    Computes the assembled internal force vector of all elements.
+
+    The Green strain E, the second Piola-Kirchhoff stress S and det(F) at every quadrature point are
+    computed on the way, and are written into Es, Ss and Js when these are given.
+
+    :param u: The (2n)x1 displacement vector. The forces are computed in its precision.
+    :param element_dofs: (number of elements)x(2m) array of the global dof indices of every element.
+    :param dN_dX: (number of elements)x(number of quadrature points)xmx2 array with the spatial
+        derivatives of the shape functions in the reference configuration.
+    :param quadrature_weights: (number of elements)x(number of quadrature points) array of the
+        quadrature weights multiplied by the element areas.
+    :param constitutive_model: The ConstitutiveModel giving the second Piola-Kirchhoff stress.
+    :param number_of_dofs:
+    :param Es: Optional (number of elements)x(number of quadrature points)x2x2 output array.
+    :param Ss: Optional (number of elements)x(number of quadrature points)x2x2 output array.
+    :param Js: Optional (number of elements)x(number of quadrature points) output array.
+    :param profiler: Optional PhaseProfiler that times the parts of the kernel.
+    :return k: The (2n)x1 internal force vector.
+    """
+
+    number_of_elements, number_of_quadrature_points, m, _ = dN_dX.shape
+    shape = (number_of_elements, number_of_quadrature_points, 2, 2)
+    if Es is None:
+        Es = np.empty(shape, dtype=u.dtype)
+    if Ss is None:
+        Ss = np.empty(shape, dtype=u.dtype)
+    if Js is None:
+        Js = np.empty(shape[0:2], dtype=u.dtype)
+    if profiler is None:
+        profiler = DISABLED_PROFILER
+
+    # Element displacements
+    with profiler.timer('gather'):
+        u_e = u[element_dofs].reshape((number_of_elements, m, 2))
+
+    with profiler.timer('deformation_gradient'):
+        # Deformation gradients F = I + sum_j u_j dN_j^T
+        F = np.einsum('emi,eqmj->eqij', u_e, dN_dX)
+        F[..., 0, 0] += 1
+        F[..., 1, 1] += 1
+
+    with profiler.timer('constitutive_update'):
+        # Green strain E = (F^T F - I) / 2
+        np.matmul(np.swapaxes(F, -1, -2), F, out=Es)
+        Es[..., 0, 0] -= 1
+        Es[..., 1, 1] -= 1
+        Es *= 0.5
+
+        constitutive_model.compute_second_piola_kirchhoff_stress(F, Es, out=Ss)
+
+        np.subtract(F[..., 0, 0] * F[..., 1, 1], F[..., 0, 1] * F[..., 1, 0], out=Js)
+
+    with profiler.timer('quadrature'):
+        # First Piola-Kirchhoff stress P = F S integrated against the shape function derivatives
+        P = F @ Ss
+        k_e = np.einsum('eqij,eqmj,eq->emi', P, dN_dX, quadrature_weights)
+
+    # Assemble the internal force vector. bincount always sums in float64.
+    with profiler.timer('assembly'):
+        k = np.bincount(element_dofs.ravel(), weights=k_e.ravel(), minlength=number_of_dofs)
+        k = k.astype(u.dtype, copy=False)
+    profiler.count('elements_evaluated', number_of_elements)
+
+    return k
@@ -0,0 +1,206 @@
+# Time-dependent scaling of the external loads.
+#
+# A load curve maps the time to a factor that multiplies a load. The body and traction forces are
+# linear in the gravity and the traction, so the simulator computes the forces of unit loads once
+# and ExternalLoads combines them with the factors of the curves in every step, which costs a few
+# vector operations instead of integrating the loads again.
+import numpy as np
+
+
+class LoadCurve:
+    """
+    Base class of the load curves. Subclasses implement evaluate and get_configuration.
+    """
+
+    name = None
+
+    def evaluate(self, time):
+        """
+        :param time: A time or an array of times.
+        :return factor: The factor of the load at the time(s).
+        """
+        raise NotImplementedError
+
+    def get_configuration(self):
+        """
+        Returns the parameters of the curve as a JSON serializable dictionary.
+        """
+        raise NotImplementedError
+
+    def __call__(self, time):
+        return self.evaluate(time)
+
+
+class ConstantLoad(LoadCurve):
+    name = 'constant'
+
+    def __init__(self, value=1.0):
+        self.value = value
+
+    def evaluate(self, time):
+        return self.value * np.ones_like(time, dtype=np.float64)
+
+    def get_configuration(self):
+        return {'type': self.name, 'value': float(self.value)}
+
+
+class TabulatedLoad(LoadCurve):
+    """
+    Linear interpolation between tabulated values. Before the first and after the last time the
+    first and the last value are used.
+    """
+
+    name = 'tabulated'
+
+    def __init__(self, times, values):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.times.shape != self.values.shape or np.any(np.diff(self.times) < 0):
+            raise Exception("The times of a tabulated load must be increasing and match the values")
+
+    def evaluate(self, time):
+        return np.interp(time, self.times, self.values)
+
+    def get_configuration(self):
+        return {'type': self.name, 'times': self.times.tolist(), 'values': self.values.tolist()}
+
+
+class HarmonicLoad(LoadCurve):
+    """
+    offset + amplitude sin(2 pi frequency t + phase)
+    """
+
+    name = 'harmonic'
+
+    def __init__(self, amplitude=1.0, frequency=1.0, phase=0.0, offset=0.0):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.phase = phase
+        self.offset = offset
+
+    def evaluate(self, time):
+        return self.offset + self.amplitude * np.sin(2 * np.pi * self.frequency * np.asarray(time) + self.phase)
+
+    def get_configuration(self):
+        return {'type': self.name, 'amplitude': float(self.amplitude), 'frequency': float(self.frequency),
+                'phase': float(self.phase), 'offset': float(self.offset)}
+
+
+class RampLoad(LoadCurve):
+    """
+    Goes linearly from start_value at start_time to end_value at end_time and stays constant
+    outside of this interval.
+    """
+
+    name = 'ramp'
+
+    def __init__(self, end_time, start_time=0.0, start_value=0.0, end_value=1.0):
+        if end_time <= start_time:
+            raise Exception("The end time of a ramp must be after its start time")
+        self.start_time = start_time
+        self.end_time = end_time
+        self.start_value = start_value
+        self.end_value = end_value
+
+    def evaluate(self, time):
+        return np.interp(time, [self.start_time, self.end_time], [self.start_value, self.end_value])
+
+    def get_configuration(self):
+        return {'type': self.name, 'start_time': float(self.start_time), 'end_time': float(self.end_time),
+                'start_value': float(self.start_value), 'end_value': float(self.end_value)}
+
+
+class ImpulseLoad(LoadCurve):
+    """
+    magnitude during [start_time, start_time + duration) and 0 otherwise. Use a duration of at least
+    one time step, otherwise the impulse may fall between two steps.
+    """
+
+    name = 'impulse'
+
+    def __init__(self, start_time, duration, magnitude=1.0):
+        self.start_time = start_time
+        self.duration = duration
+        self.magnitude = magnitude
+
+    def evaluate(self, time):
+        time = np.asarray(time)
+        return np.where((time >= self.start_time) & (time < self.start_time + self.duration), self.magnitude, 0.0)
+
+    def get_configuration(self):
+        return {'type': self.name, 'start_time': float(self.start_time), 'duration': float(self.duration),
+                'magnitude': float(self.magnitude)}
+
+
+def get_component_curves(curve):
+    """
+    Returns the curves of the x and y components of a load: a single LoadCurve scales both
+    components, a pair of curves scales them separately and None keeps the load constant.
+    """
+    if curve is None:
+        curve = ConstantLoad()
+    if isinstance(curve, LoadCurve):
+        return [curve, curve]
+    if len(curve) != 2:
+        raise Exception("A load needs one curve, or one curve for each of the x and y components")
+    return [component_curve if component_curve is not None else ConstantLoad() for component_curve in curve]
+
+
+def get_curve_configuration(curve):
+    """
+    Returns the JSON serializable configuration of a load curve argument of the Simulator.
+    """
+    if curve is None:
+        return None
+    if isinstance(curve, LoadCurve):
+        return curve.get_configuration()
+    if isinstance(curve, dict):
+        return {str(segment): get_curve_configuration(c) for segment, c in curve.items()}
+    return [get_curve_configuration(c) for c in curve]
+
+
+class ExternalLoads:
+    """
+    The external forces f(t) = sum_c g_c s_c(t) b_c + sum_s sum_c t_c s_sc(t) t_sc, with the unit body
+    forces b_c, the unit traction forces t_sc of segment s, the gravity g, the traction t and the
+    factors s of the load curves.
+    """
+
+    def __init__(self, unit_body_forces, unit_traction_forces, gravity, traction_force, gravity_curve=None,
+                 traction_curve=None):
+        """
+        :param unit_body_forces: (2n)x2 array, see Simulator.compute_unit_body_forces.
+        :param unit_traction_forces: Sparse (2n)x(2 number of segments) matrix, see
+            Simulator.compute_unit_traction_forces.
+        :param gravity:
+        :param traction_force:
+        :param gravity_curve: A LoadCurve, a pair of curves for the x and y components, or None for a
+            constant gravity.
+        :param traction_curve: Like gravity_curve, or a dictionary from the index of a segment of the
+            traction edge to such an entry. The segments not in the dictionary are constant.
+        """
+        self.unit_body_forces = unit_body_forces
+        self.unit_traction_forces = unit_traction_forces
+        self.gravity = np.asarray(gravity, dtype=np.float64)
+        self.traction_force = np.asarray(traction_force, dtype=np.float64)
+        self.number_of_segments = unit_traction_forces.shape[1] // 2
+
+        self.gravity_curves = get_component_curves(gravity_curve)
+        if isinstance(traction_curve, dict):
+            self.traction_curves = [curve for segment in range(self.number_of_segments)
+                                    for curve in get_component_curves(traction_curve.get(segment))]
+        else:
+            self.traction_curves = get_component_curves(traction_curve) * self.number_of_segments
+
+    def evaluate(self, time):
+        """
+        :param time:
+        :return f: The (2n)x1 external force vector at the time.
+        """
+        gravity_factors = np.array([curve(time) for curve in self.gravity_curves])
+        traction_factors = np.array([curve(time) for curve in self.traction_curves])
+
+        f = self.unit_body_forces @ (self.gravity * gravity_factors)
+        f += self.unit_traction_forces @ (np.tile(self.traction_force, self.number_of_segments) * traction_factors)
+
+        return f
@@ -0,0 +1,160 @@
+# Fused element kernels compiled with Numba.
+#
+# Numba is optional. If it cannot be imported NUMBA_AVAILABLE is False and the simulator uses the
+# NumPy kernels. The kernels loop over the elements and quadrature points and keep the 2x2 matrices
+# F, E, S and P in scalars, so no temporary arrays are created, and the element forces are added to
+# the global force vector in the same loop. They are compiled on the first call and cached on disk
+# (cache=True), so the compilation only happens once per machine. The scalars are float64, so in
+# float32 precision only the stored strains, stresses and forces are rounded to float32.
+import numpy as np
+
+from Materials.constitutive_models import SaintVenantKirchhoff, CompressibleNeoHookean, IncompressibleNeoHookean
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+# The constitutive models the kernel implements, by the identifier used in the kernel
+NUMBA_CONSTITUTIVE_MODELS = {
+    SaintVenantKirchhoff: 0,
+    CompressibleNeoHookean: 1,
+    IncompressibleNeoHookean: 2,
+}
+
+
+def supports_constitutive_model(constitutive_model):
+    return type(constitutive_model) in NUMBA_CONSTITUTIVE_MODELS
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, model, lambda_, mu, kappa,
+                                 k, Es, Ss, Js):
+        number_of_elements, number_of_quadrature_points, m, _ = dN_dX.shape
+        k[:] = 0
+        for e in range(number_of_elements):
+            for q in range(number_of_quadrature_points):
+                # Deformation gradient F = I + sum_j u_j dN_j^T
+                F00 = 1.0
+                F01 = 0.0
+                F10 = 0.0
+                F11 = 1.0
+                for a in range(m):
+                    u_x = u[element_dofs[e, 2 * a]]
+                    u_y = u[element_dofs[e, 2 * a + 1]]
+                    F00 += u_x * dN_dX[e, q, a, 0]
+                    F01 += u_x * dN_dX[e, q, a, 1]
+                    F10 += u_y * dN_dX[e, q, a, 0]
+                    F11 += u_y * dN_dX[e, q, a, 1]
+
+                # Green strain E = (F^T F - I) / 2
+                E00 = 0.5 * (F00 * F00 + F10 * F10 - 1.0)
+                E01 = 0.5 * (F00 * F01 + F10 * F11)
+                E11 = 0.5 * (F01 * F01 + F11 * F11 - 1.0)
+                J = F00 * F11 - F01 * F10
+
+                # Second Piola-Kirchhoff stress, see Materials/constitutive_models.py
+                if model == 0:
+                    trace_E = E00 + E11
+                    S00 = 2.0 * mu * E00 + lambda_ * trace_E
+                    S01 = 2.0 * mu * E01
+                    S11 = 2.0 * mu * E11 + lambda_ * trace_E
+                else:
+                    C00 = 2.0 * E00 + 1.0
+                    C01 = 2.0 * E01
+                    C11 = 2.0 * E11 + 1.0
+                    if model == 1:
+                        determinant_C = C00 * C11 - C01 * C01
+                        scale = lambda_ * np.log(J) - mu
+                        diagonal = mu
+                    else:
+                        determinant_C = J * J
+                        deviatoric_scale = mu * J ** (-2.0 / 3.0)
+                        scale = kappa * (J - 1.0) * J - deviatoric_scale * (C00 + C11 + 1.0) / 3.0
+                        diagonal = deviatoric_scale
+                    S00 = scale * C11 / determinant_C + diagonal
+                    S01 = -scale * C01 / determinant_C
+                    S11 = scale * C00 / determinant_C + diagonal
+
+                Es[e, q, 0, 0] = E00
+                Es[e, q, 0, 1] = E01
+                Es[e, q, 1, 0] = E01
+                Es[e, q, 1, 1] = E11
+                Ss[e, q, 0, 0] = S00
+                Ss[e, q, 0, 1] = S01
+                Ss[e, q, 1, 0] = S01
+                Ss[e, q, 1, 1] = S11
+                Js[e, q] = J
+
+                # First Piola-Kirchhoff stress P = F S integrated against the shape function
+                # derivatives and added to the force vector
+                w = quadrature_weights[e, q]
+                P00 = F00 * S00 + F01 * S01
+                P01 = F00 * S01 + F01 * S11
+                P10 = F10 * S00 + F11 * S01
+                P11 = F10 * S01 + F11 * S11
+                for a in range(m):
+                    dN_x = dN_dX[e, q, a, 0]
+                    dN_y = dN_dX[e, q, a, 1]
+                    k[element_dofs[e, 2 * a]] += w * (P00 * dN_x + P01 * dN_y)
+                    k[element_dofs[e, 2 * a + 1]] += w * (P10 * dN_x + P11 * dN_y)
+
+    @numba.njit(cache=True)
+    def _lumped_mass_update(f, k, v, damping_diagonal, inverse_mass_diagonal, damping_term, a):
+        for i in range(len(f)):
+            damping_term[i] = damping_diagonal[i] * v[i]
+            a[i] = (f[i] - damping_term[i] - k[i]) * inverse_mass_diagonal[i]
+
+    @numba.njit(cache=True)
+    def _scatter_add(indices, values, out):
+        for i in range(len(indices)):
+            out[indices[i]] += values[i]
+
+
+def compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, constitutive_model, number_of_dofs,
+                            Es=None, Ss=None, Js=None, profiler=None):
+    """
+    Numba version of Simulator.internal_force_kernel.compute_internal_forces, with the same
+    arguments. The constitutive model must be one of NUMBA_CONSTITUTIVE_MODELS.
+    """
+    number_of_elements, number_of_quadrature_points, m, _ = dN_dX.shape
+    shape = (number_of_elements, number_of_quadrature_points, 2, 2)
+    if Es is None:
+        Es = np.empty(shape, dtype=u.dtype)
+    if Ss is None:
+        Ss = np.empty(shape, dtype=u.dtype)
+    if Js is None:
+        Js = np.empty(shape[0:2], dtype=u.dtype)
+
+    k = np.empty(number_of_dofs, dtype=u.dtype)
+    kappa = getattr(constitutive_model, 'kappa', 0.0)
+    _compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, NUMBA_CONSTITUTIVE_MODELS[type(constitutive_model)],
+                             constitutive_model.lambda_, constitutive_model.mu, kappa, k, Es, Ss, Js)
+    if profiler is not None:
+        profiler.count('elements_evaluated', number_of_elements)
+
+    return k
+
+
+def lumped_mass_update(f, k, v, damping_diagonal, inverse_mass_diagonal):
+    """
+    Computes the damping forces and the accelerations a = M^-1 (f - C v - k) for a lumped (diagonal)
+    mass and damping matrix in one pass.
+    :return damping_term, a:
+    """
+    damping_term = np.empty_like(v)
+    a = np.empty_like(v)
+    _lumped_mass_update(f, k, v, damping_diagonal, inverse_mass_diagonal, damping_term, a)
+    return damping_term, a
+
+
+def scatter_add(indices, values, size):
+    """
+    Numba version of np.bincount(indices, weights=values, minlength=size) in the dtype of values.
+    """
+    out = np.zeros(size, dtype=values.dtype)
+    _scatter_add(indices.ravel(), values.ravel(), out)
+    return out
@@ -0,0 +1,209 @@
+# Domain-decomposed evaluation of the internal forces in persistent worker processes.
+#
+# The elements are split into subdomains of equal size along the length of the cantilever. Every
+# worker gets the precomputed geometry of its subdomain once, when it is started. In every step the
+# displacements are written to shared memory and the workers are signalled with a small message, so
+# no arrays are pickled per step. A worker writes the forces on the dofs only its subdomain touches
+# directly into the shared force vector, and its contributions to the dofs on the subdomain interfaces
+# into its own section of a shared interface buffer, which the main process reduces.
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from Simulator.internal_force_kernel import compute_internal_forces
+
+
+def _attach_array(name, shape, dtype, shared_memories):
+    memory = shared_memory.SharedMemory(name=name)
+    shared_memories.append(memory)
+    return np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _force_worker(connection, shared_arrays, elements, element_dofs, dN_dX, quadrature_weights,
+                  constitutive_model, owned_dofs, interface_dofs, interface_offset):
+    shared_memories = []
+    try:
+        u = _attach_array(*shared_arrays['u'], shared_memories)
+        k = _attach_array(*shared_arrays['k'], shared_memories)
+        interface_forces = _attach_array(*shared_arrays['interface_forces'], shared_memories)
+        Es = _attach_array(*shared_arrays['Es'], shared_memories)
+        Ss = _attach_array(*shared_arrays['Ss'], shared_memories)
+        Js = _attach_array(*shared_arrays['Js'], shared_memories)
+
+        # Number the dofs of the subdomain locally
+        subdomain_dofs = np.unique(element_dofs)
+        local_element_dofs = np.searchsorted(subdomain_dofs, element_dofs)
+        local_owned_dofs = np.searchsorted(subdomain_dofs, owned_dofs)
+        local_interface_dofs = np.searchsorted(subdomain_dofs, interface_dofs)
+        interface_slice = slice(interface_offset, interface_offset + len(interface_dofs))
+
+        local_Es = np.zeros((len(elements),) + Es.shape[1:], dtype=Es.dtype)
+        local_Ss = np.zeros((len(elements),) + Ss.shape[1:], dtype=Ss.dtype)
+        local_Js = np.ones((len(elements),) + Js.shape[1:], dtype=Js.dtype)
+
+        connection.send('ready')
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            try:
+                local_k = compute_internal_forces(u[subdomain_dofs], local_element_dofs, dN_dX, quadrature_weights,
+                                                  constitutive_model, len(subdomain_dofs),
+                                                  Es=local_Es, Ss=local_Ss, Js=local_Js)
+                k[owned_dofs] = local_k[local_owned_dofs]
+                interface_forces[interface_slice] = local_k[local_interface_dofs]
+                Es[elements] = local_Es
+                Ss[elements] = local_Ss
+                Js[elements] = local_Js
+                connection.send('done')
+            except Exception:
+                connection.send(traceback.format_exc())
+    finally:
+        for memory in shared_memories:
+            memory.close()
+
+
+def partition_elements(element_centroids, number_of_subdomains):
+    """
+    Splits the elements into subdomains of (almost) equal size along the longest axis of the mesh.
+    :param element_centroids: (number of elements)x2 array.
+    :param number_of_subdomains:
+    :return subdomains: List of arrays of element indices.
+    """
+    extent = element_centroids.max(axis=0) - element_centroids.min(axis=0)
+    axis = int(np.argmax(extent))
+    order = np.lexsort((element_centroids[:, 1 - axis], element_centroids[:, axis]))
+
+    return [np.sort(subdomain) for subdomain in np.array_split(order, number_of_subdomains) if len(subdomain) > 0]
+
+
+class ParallelInternalForces:
+    """
+    Persistent worker processes that evaluate the internal forces of their subdomains. Use it as a
+    context manager or call close() to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, element_dofs, dN_dX, element_quadrature_weights, constitutive_model, number_of_dofs,
+                 element_centroids, number_of_workers, dtype=np.float64):
+        """
+        :param element_dofs: (number of elements)x(2m) array of the global dofs of every element.
+        :param dN_dX: See compute_internal_forces.
+        :param element_quadrature_weights: See compute_internal_forces.
+        :param constitutive_model:
+        :param number_of_dofs:
+        :param element_centroids: (number of elements)x2 array used to partition the elements.
+        :param number_of_workers:
+        :param dtype: The precision the forces are computed in.
+        """
+        self.number_of_dofs = number_of_dofs
+        self.dtype = np.dtype(dtype)
+        self.shared_arrays = dict()
+        self.shared_memories = []
+        self.workers = []
+        self.connections = []
+
+        subdomains = partition_elements(element_centroids, number_of_workers)
+
+        # Dofs touched by more than one subdomain are interface dofs
+        subdomain_dofs = [np.unique(element_dofs[subdomain]) for subdomain in subdomains]
+        dof_subdomain_counts = np.bincount(np.concatenate(subdomain_dofs), minlength=number_of_dofs)
+        is_interface_dof = dof_subdomain_counts > 1
+        self.owned_dofs = [dofs[~is_interface_dof[dofs]] for dofs in subdomain_dofs]
+        self.interface_dofs = [dofs[is_interface_dof[dofs]] for dofs in subdomain_dofs]
+        self.all_interface_dofs = np.concatenate(self.interface_dofs)
+        self.number_of_interface_dofs = len(self.all_interface_dofs)
+
+        number_of_elements, number_of_quadrature_points = element_quadrature_weights.shape
+        quadrature_shape = (number_of_elements, number_of_quadrature_points)
+        self.u = self._create_array('u', (number_of_dofs,))
+        self.k = self._create_array('k', (number_of_dofs,))
+        self.interface_forces = self._create_array('interface_forces', (max(1, self.number_of_interface_dofs),))
+        self.Es = self._create_array('Es', quadrature_shape + (2, 2))
+        self.Ss = self._create_array('Ss', quadrature_shape + (2, 2))
+        self.Js = self._create_array('Js', quadrature_shape)
+        self.Js[:] = 1
+
+        try:
+            interface_offset = 0
+            for w, subdomain in enumerate(subdomains):
+                parent_connection, child_connection = multiprocessing.Pipe()
+                worker = multiprocessing.Process(
+                    target=_force_worker, daemon=True,
+                    args=(child_connection, self.shared_arrays, subdomain, element_dofs[subdomain],
+                          dN_dX[subdomain].astype(self.dtype, copy=False),
+                          element_quadrature_weights[subdomain].astype(self.dtype, copy=False), constitutive_model,
+                          self.owned_dofs[w], self.interface_dofs[w], interface_offset))
+                worker.start()
+                self.workers.append(worker)
+                self.connections.append(parent_connection)
+                interface_offset += len(self.interface_dofs[w])
+
+            self._wait('ready')
+        except BaseException:
+            self.close()
+            raise
+
+    def _create_array(self, name, shape):
+        memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * self.dtype.itemsize))
+        self.shared_memories.append(memory)
+        self.shared_arrays[name] = (memory.name, shape, self.dtype.str)
+
+        array = np.ndarray(shape, dtype=self.dtype, buffer=memory.buf)
+        array[:] = 0
+        return array
+
+    def _wait(self, expected_message):
+        errors = []
+        for connection in self.connections:
+            message = connection.recv()
+            if message != expected_message:
+                errors.append(message)
+        if errors:
+            raise Exception("Internal force worker failed:\n{}".format('\n'.join(errors)))
+
+    def compute(self, u):
+        """
+        Computes the internal force vector of the displacements u. The strains, stresses and det(F)
+        at the quadrature points are written into self.Es, self.Ss and self.Js.
+        :param u: The (2n)x1 displacement vector.
+        :return k: The (2n)x1 internal force vector.
+        """
+        self.u[:] = u
+        for connection in self.connections:
+            connection.send('step')
+        self._wait('done')
+
+        # Reduce the contributions of the subdomains at the interface dofs
+        k = self.k.copy()
+        k += np.bincount(self.all_interface_dofs, weights=self.interface_forces[0:self.number_of_interface_dofs],
+                         minlength=self.number_of_dofs).astype(self.dtype, copy=False)
+
+        return k
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.connections = []
+        self.workers = []
+
+        # The arrays must be released before the shared memory is closed
+        self.u = self.k = self.interface_forces = self.Es = self.Ss = self.Js = None
+        for memory in self.shared_memories:
+            memory.close()
+            memory.unlink()
+        self.shared_memories = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,208 @@
+# Point location and field sampling on the FEM mesh.
+#
+# The points are material points given in reference coordinates, e.g. the position of a strain gauge
+# or a displacement sensor on the undeformed cantilever. Their deformed position is X + u(X).
+import numpy as np
+
+from Mesh.HigherOrderMesh.decode_all_triangle_indices import decode_all_triangle_indices
+from Simulator.HigherOrderElements.shape_functions import silvester_shape_functions, \
+    silvester_shape_function_barycentric_derivatives
+
+
+class PointLocator:
+    """
+    Finds the elements and barycentric coordinates of points with a uniform grid over the reference
+    elements and the cached inverse affine maps of the elements, so many points are located with a
+    few batched operations.
+    """
+
+    def __init__(self, FEM_V, FEM_encoding, element_order, cells_per_element=1.0, tolerance=1e-10):
+        """
+        :param FEM_V: (N, 2) array of reference node positions.
+        :param FEM_encoding: The encodings of the elements.
+        :param element_order:
+        :param cells_per_element: The approximate number of grid cells per element.
+        :param tolerance: Points whose barycentric coordinates are above -tolerance are inside.
+        """
+        self.FEM_V = np.asarray(FEM_V, dtype=np.float64)
+        self.element_order = element_order
+        self.tolerance = tolerance
+
+        self.element_global_indices, self.element_ijk_indices = decode_all_triangle_indices(FEM_encoding,
+                                                                                             element_order)
+        self.number_of_elements = len(self.element_global_indices)
+
+        # The corner nodes of every element in the order of the barycentric coordinates
+        corners = [int(np.where(self.element_ijk_indices[:, c] == element_order)[0][0]) for c in range(3)]
+        corner_vertices = self.FEM_V[self.element_global_indices[:, corners]]
+
+        # Inverse affine maps: (xi_1, xi_2) = T^-1 (x - V_k) (see cartesian_to_barycentric)
+        T = np.stack([corner_vertices[:, 0] - corner_vertices[:, 2],
+                      corner_vertices[:, 1] - corner_vertices[:, 2]], axis=-1)
+        self.inverse_affine_maps = np.linalg.inv(T)
+        self.affine_origins = corner_vertices[:, 2]
+
+        # Derivatives of the barycentric coordinates with respect to x, for the spatial derivatives
+        self.barycentric_gradients = np.concatenate(
+            [self.inverse_affine_maps, -self.inverse_affine_maps.sum(axis=1, keepdims=True)], axis=1)
+
+        # Uniform grid of cells. Every cell lists the elements whose bounding boxes overlap it.
+        lower = corner_vertices.min(axis=1)
+        upper = corner_vertices.max(axis=1)
+        self.grid_origin = lower.min(axis=0)
+        extent = np.maximum(upper.max(axis=0) - self.grid_origin, 1e-12)
+        cell_size = np.sqrt(extent.prod() / max(1.0, cells_per_element * self.number_of_elements))
+        self.grid_shape = np.maximum(1, np.ceil(extent / cell_size)).astype(np.int64)
+        self.cell_size = extent / self.grid_shape
+
+        lower_cells = self.get_cell_coordinates(lower - tolerance)
+        upper_cells = self.get_cell_coordinates(upper + tolerance)
+        cell_elements = [[] for _ in range(int(self.grid_shape.prod()))]
+        for e in range(self.number_of_elements):
+            for cx in range(lower_cells[e, 0], upper_cells[e, 0] + 1):
+                for cy in range(lower_cells[e, 1], upper_cells[e, 1] + 1):
+                    cell_elements[cx * self.grid_shape[1] + cy].append(e)
+
+        # Padded (number of cells)x(max elements per cell) array, -1 marks padding
+        max_cell_elements = max(1, max(len(elements) for elements in cell_elements))
+        self.cell_elements = -np.ones((len(cell_elements), max_cell_elements), dtype=np.int64)
+        for cell, elements in enumerate(cell_elements):
+            self.cell_elements[cell, 0:len(elements)] = elements
+
+    def get_cell_coordinates(self, points):
+        cells = np.floor((points - self.grid_origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.grid_shape - 1)
+
+    def compute_barycentric_coordinates(self, points, element_indices):
+        """
+        :param points: (..., 2) array.
+        :param element_indices: (...) array.
+        :return xis: (..., 3) array.
+        """
+        xi_12 = np.einsum('...ij,...j->...i', self.inverse_affine_maps[element_indices],
+                          points - self.affine_origins[element_indices])
+        return np.concatenate([xi_12, 1 - xi_12.sum(axis=-1, keepdims=True)], axis=-1)
+
+    def locate(self, points):
+        """
+        Finds the element containing every point.
+        :param points: (number of points)x2 array of reference positions.
+        :return element_indices, xis: The element of every point (-1 for points outside the mesh)
+            and the (number of points)x3 barycentric coordinates of the points in their elements.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+
+        cells = self.get_cell_coordinates(points)
+        candidates = self.cell_elements[cells[:, 0] * self.grid_shape[1] + cells[:, 1]]
+
+        xis = self.compute_barycentric_coordinates(points[:, None, :], np.maximum(candidates, 0))
+        # Points outside of the grid are clipped to a boundary cell, and are not inside its elements
+        inside = (candidates >= 0) & np.all(xis >= -self.tolerance, axis=-1)
+
+        first_inside = np.argmax(inside, axis=1)
+        found = inside[np.arange(len(points)), first_inside]
+        element_indices = np.where(found, candidates[np.arange(len(points)), first_inside], -1)
+
+        return element_indices, xis[np.arange(len(points)), first_inside]
+
+    def create_probe(self, points):
+        """
+        Returns a FieldProbe that samples fields at the points.
+        :param points: (number of points)x2 array of reference positions.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        element_indices, xis = self.locate(points)
+        return FieldProbe(self, points, element_indices, xis)
+
+
+class FieldProbe:
+    """
+    Samples nodal fields at fixed material points. The shape function values and derivatives at the
+    points are computed once, so a sample is a gather and a small product, cheap enough to be taken
+    every time step.
+    """
+
+    def __init__(self, point_locator, points, element_indices, xis):
+        self.points = points
+        self.element_indices = element_indices
+        self.inside = element_indices >= 0
+
+        elements = np.maximum(element_indices, 0)
+        self.node_indices = point_locator.element_global_indices[elements]
+
+        # Shape function values and spatial derivatives at the points
+        self.N = silvester_shape_functions(point_locator.element_ijk_indices, xis, point_locator.element_order)
+        dN_dxi = silvester_shape_function_barycentric_derivatives(point_locator.element_ijk_indices, xis,
+                                                                  point_locator.element_order)
+        self.dN_dX = dN_dxi @ point_locator.barycentric_gradients[elements]
+
+    def sample(self, nodal_field):
+        """
+        Interpolates a nodal field at the points.
+        :param nodal_field: (..., N, c) array of a field with c components per node.
+        :return values: (..., number of points, c) array. Points outside the mesh are NaN.
+        """
+        nodal_field = np.asarray(nodal_field, dtype=np.float64)
+
+        values = np.einsum('pm,...pmc->...pc', self.N, nodal_field[..., self.node_indices, :])
+        values[..., ~self.inside, :] = np.nan
+
+        return values
+
+    def sample_displacements(self, displacements):
+        """
+        :param displacements: (2N,) or (T, 2N) array.
+        :return displacements: (number of points, 2) or (T, number of points, 2) array.
+        """
+        displacements = np.asarray(displacements, dtype=np.float64)
+        return self.sample(displacements.reshape(displacements.shape[:-1] + (-1, 2)))
+
+    def sample_deformation_gradients(self, displacements):
+        """
+        :param displacements: (2N,) or (T, 2N) array.
+        :return F: (..., number of points, 2, 2) array.
+        """
+        displacements = np.asarray(displacements, dtype=np.float64)
+        nodal_displacements = displacements.reshape(displacements.shape[:-1] + (-1, 2))
+
+        F = np.einsum('...pmi,pmj->...pij', nodal_displacements[..., self.node_indices, :], self.dN_dX)
+        F[..., 0, 0] += 1
+        F[..., 1, 1] += 1
+        F[..., ~self.inside, :, :] = np.nan
+
+        return F
+
+    def sample_green_strains(self, displacements):
+        """
+        Returns the Green strains E = (F^T F - I) / 2 at the points, e.g. for virtual strain gauges.
+        :param displacements: (2N,) or (T, 2N) array.
+        :return E: (..., number of points, 2, 2) array.
+        """
+        F = self.sample_deformation_gradients(displacements)
+        E = 0.5 * (np.swapaxes(F, -1, -2) @ F)
+        E[..., 0, 0] -= 0.5
+        E[..., 1, 1] -= 0.5
+
+        return E
+
+    def sample_displacements_at_times(self, result, times):
+        """
+        Interpolates the displacements at the points linearly between the stored time steps.
+        :param result: A Result or LazyResult.
+        :param times: The times to sample.
+        :return displacements: (number of times, number of points, 2) array.
+        """
+        time_steps = np.asarray(result.time_steps[0:len(result.nodal_displacements)], dtype=np.float64)
+        times = np.clip(np.atleast_1d(np.asarray(times, dtype=np.float64)), time_steps[0], time_steps[-1])
+
+        upper = np.clip(np.searchsorted(time_steps, times), 1, len(time_steps) - 1)
+        lower = upper - 1
+        weights = (times - time_steps[lower]) / (time_steps[upper] - time_steps[lower])
+
+        # Only the time steps around the sampled times are read
+        needed = np.unique(np.concatenate([lower, upper]))
+        samples = self.sample_displacements(np.asarray(result.nodal_displacements[needed]))
+        lower_samples = samples[np.searchsorted(needed, lower)]
+        upper_samples = samples[np.searchsorted(needed, upper)]
+
+        return lower_samples + weights[:, None, None] * (upper_samples - lower_samples)
@@ -0,0 +1,122 @@
+import contextlib
+import time
+
+# Returned by PhaseProfiler.timer when profiling is disabled, so a disabled timer costs a method call
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _PhaseTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        path = ';'.join(self.profiler.stack)
+        self.profiler.stack.pop()
+        timing = self.profiler.timings.get(path)
+        if timing is None:
+            self.profiler.timings[path] = [seconds, 1]
+        else:
+            timing[0] += seconds
+            timing[1] += 1
+
+
+class PhaseProfiler:
+    """
+    Named, nested timers and counters for the phases of the simulator.
+
+    Timers are used as context managers, and nested timers are recorded under the path of all the
+    enclosing timers, e.g. 'simulate;step;internal_forces'. When the profiler is disabled the timers
+    and counters do nothing.
+    """
+
+    def __init__(self, enabled=False, element_sample_size=0):
+        """
+        :param enabled:
+        :param element_sample_size: The approximate number of elements whose individual cost is
+            sampled in the per-element loops (0 disables the sampling).
+        """
+        self.enabled = enabled
+        self.element_sample_size = element_sample_size if enabled else 0
+
+        self.stack = []
+        self.timings = dict()
+        self.counters = dict()
+        self.element_samples = dict()
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, name)
+
+    def count(self, name, increment=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def should_sample_element(self, element_index, number_of_elements):
+        if self.element_sample_size <= 0:
+            return False
+        stride = max(1, number_of_elements // self.element_sample_size)
+        return element_index % stride == 0
+
+    def sample_element(self, name, element_index, seconds):
+        self.element_samples.setdefault(name, []).append((element_index, seconds))
+
+    def get_self_times(self):
+        """
+        Returns the time spent in every timer path excluding the time spent in nested timers.
+        """
+        self_times = {path: timing[0] for path, timing in self.timings.items()}
+        for path, timing in self.timings.items():
+            parent = path.rpartition(';')[0]
+            if parent in self_times:
+                self_times[parent] -= timing[0]
+        return self_times
+
+    def report(self):
+        """
+        Returns a summary of the timers, counters and element samples.
+        """
+        lines = ["{:<60} {:>12} {:>10} {:>12} {:>8}".format('Phase', 'Total (s)', 'Calls', 'Mean (ms)', '%')]
+
+        root_total = sum(timing[0] for path, timing in self.timings.items() if ';' not in path)
+        for path in sorted(self.timings):
+            total, calls = self.timings[path]
+            depth = path.count(';')
+            name = '  ' * depth + path.rpartition(';')[2]
+            percentage = 100 * total / root_total if root_total > 0 else 0
+            lines.append("{:<60} {:>12.6f} {:>10} {:>12.6f} {:>8.2f}".format(
+                name, total, calls, 1000 * total / calls, percentage))
+
+        if self.counters:
+            lines.append("Counters:")
+            for name in sorted(self.counters):
+                lines.append("  {:<58} {:>12}".format(name, self.counters[name]))
+
+        for name, samples in sorted(self.element_samples.items()):
+            seconds = [sample[1] for sample in samples]
+            slowest_element, slowest_seconds = max(samples, key=lambda sample: sample[1])
+            lines.append("Element cost samples for {} ({} elements): mean {:.6f} ms, max {:.6f} ms (element {})".format(
+                name, len(samples), 1000 * sum(seconds) / len(seconds), 1000 * slowest_seconds, slowest_element))
+
+        return '\n'.join(lines)
+
+    def export_folded_stacks(self, file_name):
+        """
+        Writes the timings in the folded stack format read by flame graph tools (e.g. flamegraph.pl,
+        speedscope, inferno): one line per timer path with its self time in microseconds.
+        """
+        with open(file_name, 'w') as f:
+            for path, seconds in sorted(self.get_self_times().items()):
+                f.write("{} {}\n".format(path, max(0, int(round(seconds * 1e6)))))
+
+
+# Used by functions that take an optional profiler when none is given
+DISABLED_PROFILER = PhaseProfiler()
@@ -0,0 +1,109 @@
+# Quadrature degrees of the integrals of the simulator and the hourglass stabilization of reduced
+# integration.
+#
+# Every integral has its own quadrature degree, which can be set with the quadrature_degrees
+# argument of the Simulator. With reduced integration the internal forces are evaluated with a rule
+# of lower degree, which has fewer points. Such a rule does not see some deformation modes of the
+# elements (hourglass modes), which then have no stiffness. They are stabilized with the linear
+# stiffness the reduced rule misses: the difference between the small-strain stiffness matrices of
+# the element integrated exactly and with the reduced rule, scaled by the hourglass coefficient.
+#
+# For quadratic elements and the one point rule the difference is positive semi-definite, and with a
+# coefficient of 1 the small-strain stiffness is that of exact integration. The reduced rules of
+# higher orders overestimate the stiffness of some modes, which makes the difference indefinite. Its
+# negative part is dropped, because it is linear and does not rotate with the element, which makes
+# the simulation unstable at large deformations.
+import numpy as np
+import quadpy
+from scipy import sparse
+
+QUADRATURE_INTEGRALS = ['internal_force', 'mass', 'body_force', 'traction', 'shape_function_volume']
+
+
+def get_default_quadrature_degrees(element_order, reduced_integration=False):
+    """
+    Returns the quadrature degree of every integral. The mass matrix integrates products of two
+    shape functions and the traction forces are integrated along the edges with Gauss-Legendre rules.
+    """
+    return {
+        'internal_force': max(1, element_order - 1) if reduced_integration else element_order + 1,
+        'mass': 2 * element_order + 1,
+        'body_force': element_order + 1,
+        'traction': 2 * element_order + 1,
+        'shape_function_volume': 10,
+    }
+
+
+def get_quadrature_degrees(element_order, quadrature_degrees=None, reduced_integration=False):
+    """
+    Returns the default quadrature degrees updated with the given ones.
+    :param element_order:
+    :param quadrature_degrees: Dictionary from some of QUADRATURE_INTEGRALS to their degree, or None.
+    :param reduced_integration:
+    """
+    degrees = get_default_quadrature_degrees(element_order, reduced_integration)
+    for name, degree in (quadrature_degrees or dict()).items():
+        if name not in QUADRATURE_INTEGRALS:
+            raise Exception("Unknown integral: {}. Available integrals: {}".format(
+                name, ', '.join(QUADRATURE_INTEGRALS)))
+        if int(degree) < 1:
+            raise Exception("The quadrature degree of the {} must be at least 1".format(name))
+        degrees[name] = int(degree)
+
+    return degrees
+
+
+def get_exact_stiffness_degree(element_order):
+    # The strains of elements of order p are polynomials of degree p - 1
+    return max(1, 2 * (element_order - 1))
+
+
+def get_triangle_scheme(degree):
+    return quadpy.t2.get_good_scheme(degree)
+
+
+def get_line_scheme(degree):
+    # An n point Gauss-Legendre rule integrates polynomials of degree 2n - 1 exactly
+    return quadpy.c1.gauss_legendre(degree // 2 + 1)
+
+
+def compute_linear_stiffness_matrices(dN_dX, quadrature_weights, lambda_, mu):
+    """
+    Computes the small-strain stiffness matrices K_e = sum_q w_q B_q^T D B_q of all elements.
+    :param dN_dX: (number of elements)x(number of quadrature points)xmx2 array.
+    :param quadrature_weights: (number of elements)x(number of quadrature points) array.
+    :param lambda_:
+    :param mu:
+    :return K: (number of elements)x(2m)x(2m) array with the dofs ordered x0, y0, x1, y1, ...
+    """
+    number_of_elements, _, m, _ = dN_dX.shape
+    # K[e, a, i, b, k] = sum_q w (lambda dN_a,i dN_b,k + mu dN_a,k dN_b,i + mu delta_ik dN_a,j dN_b,j)
+    K = lambda_ * np.einsum('eqai,eqbk,eq->eaibk', dN_dX, dN_dX, quadrature_weights)
+    K += mu * np.einsum('eqak,eqbi,eq->eaibk', dN_dX, dN_dX, quadrature_weights)
+    laplacian = mu * np.einsum('eqaj,eqbj,eq->eab', dN_dX, dN_dX, quadrature_weights)
+    for i in range(2):
+        K[:, :, i, :, i] += laplacian
+
+    return K.reshape((number_of_elements, 2 * m, 2 * m))
+
+
+def compute_hourglass_matrix(element_dofs, exact_dN_dX, exact_quadrature_weights, reduced_dN_dX,
+                             reduced_quadrature_weights, lambda_, mu, hourglass_coefficient, number_of_dofs):
+    """
+    Assembles the hourglass stiffness matrix, the positive semi-definite part of
+    hourglass_coefficient (K_exact - K_reduced) of every element, where K_exact and K_reduced are the
+    small-strain stiffness matrices integrated with the exact and the reduced rule.
+    :return K_hourglass: Sparse (number of dofs)x(number of dofs) matrix.
+    """
+    K_difference = (compute_linear_stiffness_matrices(exact_dN_dX, exact_quadrature_weights, lambda_, mu) -
+                    compute_linear_stiffness_matrices(reduced_dN_dX, reduced_quadrature_weights, lambda_, mu))
+    eigenvalues, eigenvectors = np.linalg.eigh(K_difference)
+    K_hourglass = np.einsum('eij,ej,ekj->eik', eigenvectors, np.maximum(eigenvalues, 0), eigenvectors)
+    K_hourglass *= hourglass_coefficient
+
+    rows = np.repeat(element_dofs[:, :, None], element_dofs.shape[1], axis=2)
+    columns = np.repeat(element_dofs[:, None, :], element_dofs.shape[1], axis=1)
+    matrix = sparse.coo_matrix((K_hourglass.ravel(), (rows.ravel(), columns.ravel())),
+                               shape=(number_of_dofs, number_of_dofs))
+
+    return matrix.tocsr()
@@ -2,15 +2,136 @@
 # Contains the following data:
 # - List of time steps
 # - List of nodal displacements
+# - The kinetic, potential, strain and damping energy series (if tracked)
+#
+# Every time-dependent field is one contiguous array with a row per time step. The simulator
+# allocates the arrays for all time steps before it starts and writes every time step into them in
+# place, so no list of arrays has to be copied into an array at the end. The fields are views of the
+# rows that have been written.
+import numpy as np
+
+
 class Result:
-    def __init__(self, time_steps, nodal_displacements, nodal_velocities, nodal_accelerations, Es, Ms, damping_force, assembled_gravity_force):
-        self.time_steps = time_steps
-        self.nodal_accelerations = nodal_accelerations
-        self.nodal_velocities = nodal_velocities
-        self.nodal_displacements = nodal_displacements
-        self.Es = Es
-        self.Ms = Ms
-        self.damping_forces = damping_force
+    __slots__ = ['number_of_time_steps', '_time_steps', '_nodal_displacements', '_nodal_velocities',
+                 '_nodal_accelerations', '_Es', '_damping_forces', 'mass_matrix', 'assembled_gravity_force',
+                 'energies', 'aborted', 'settled']
+
+    def __init__(self, time_steps, nodal_displacements, nodal_velocities, nodal_accelerations, Es, mass_matrix,
+                 damping_forces, assembled_gravity_force, energies=None, aborted=False, settled=False):
+        """
+        :param time_steps: (T,) array.
+        :param nodal_displacements: (T, 2N) array.
+        :param nodal_velocities: (T, 2N) array.
+        :param nodal_accelerations: (T, 2N) array.
+        :param Es: (T, number of elements, number of quadrature points, 2, 2) array of Green strains.
+        :param mass_matrix: The mass matrix, which is the same in every time step.
+        :param damping_forces: (T, 2N) array.
+        :param assembled_gravity_force:
+        :param energies: The kinetic, potential, strain and damping energy series, or None.
+        :param aborted: True if the simulation was stopped early because the energy drift exceeded
+            the tolerance or it was interrupted.
+        :param settled: True if the simulation was stopped early because the cantilever settled.
+        """
+        self._time_steps = np.asarray(time_steps, dtype=np.float64)
+        self._nodal_displacements = np.asarray(nodal_displacements)
+        self._nodal_velocities = np.asarray(nodal_velocities)
+        self._nodal_accelerations = np.asarray(nodal_accelerations)
+        self._Es = np.asarray(Es)
+        self._damping_forces = np.asarray(damping_forces)
+        self.number_of_time_steps = len(self._time_steps)
+        self.mass_matrix = mass_matrix
         self.assembled_gravity_force = assembled_gravity_force
+        self.energies = energies
+        self.aborted = aborted
+        self.settled = settled
+
+    @classmethod
+    def allocate(cls, capacity, number_of_dofs, quadrature_shape, dtype, mass_matrix, assembled_gravity_force):
+        """
+        Returns an empty Result with room for capacity time steps, filled with append.
+        :param capacity: The number of time steps.
+        :param number_of_dofs:
+        :param quadrature_shape: The (number of elements, number of quadrature points) of the strains.
+        :param dtype: The dtype of the fields.
+        :param mass_matrix:
+        :param assembled_gravity_force:
+        """
+        state_shape = (capacity, number_of_dofs)
+        strain_shape = (capacity,) + tuple(quadrature_shape) + (2, 2)
+        result = cls(np.zeros(capacity), np.zeros(state_shape, dtype=dtype), np.zeros(state_shape, dtype=dtype),
+                     np.zeros(state_shape, dtype=dtype), np.zeros(strain_shape, dtype=dtype), mass_matrix,
+                     np.zeros(state_shape, dtype=dtype), assembled_gravity_force)
+        result.number_of_time_steps = 0
+        return result
+
+    def append(self, time, nodal_displacements, nodal_velocities, nodal_accelerations, E, damping_force):
+        """
+        Writes the next time step into the preallocated arrays.
+        """
+        i = self.number_of_time_steps
+        if i == len(self._time_steps):
+            raise Exception("The result is full: it was allocated for {} time steps".format(i))
+
+        self._time_steps[i] = time
+        self._nodal_displacements[i] = nodal_displacements
+        self._nodal_velocities[i] = nodal_velocities
+        self._nodal_accelerations[i] = nodal_accelerations
+        self._Es[i] = E
+        self._damping_forces[i] = damping_force
+        # Counted last, so an interrupted append leaves no partial time step
+        self.number_of_time_steps = i + 1
+
+    def truncate(self, number_of_time_steps):
+        """
+        Drops the time steps after the first number_of_time_steps, without copying.
+        """
+        self.number_of_time_steps = min(self.number_of_time_steps, number_of_time_steps)
+        if self.energies is not None:
+            self.energies = tuple(series[0:self.number_of_time_steps] for series in self.energies)
+
+    def slice(self, start=None, stop=None, step=None):
+        """
+        Returns a Result with the time steps [start:stop:step], whose fields are views of the fields
+        of this result.
+        """
+        index = slice(start, stop, step)
+        energies = tuple(series[index] for series in self.energies) if self.energies is not None else None
+        return Result(self.time_steps[index], self.nodal_displacements[index], self.nodal_velocities[index],
+                      self.nodal_accelerations[index], self.Es[index], self.mass_matrix, self.damping_forces[index],
+                      self.assembled_gravity_force, energies, self.aborted, self.settled)
+
+    def __len__(self):
+        return self.number_of_time_steps
+
+    @property
+    def time_steps(self):
+        return self._time_steps[0:self.number_of_time_steps]
+
+    @property
+    def nodal_displacements(self):
+        return self._nodal_displacements[0:self.number_of_time_steps]
+
+    @property
+    def displacements(self):
+        return self.nodal_displacements
+
+    @property
+    def nodal_velocities(self):
+        return self._nodal_velocities[0:self.number_of_time_steps]
+
+    @property
+    def nodal_accelerations(self):
+        return self._nodal_accelerations[0:self.number_of_time_steps]
+
+    @property
+    def Es(self):
+        return self._Es[0:self.number_of_time_steps]
 
+    @property
+    def damping_forces(self):
+        return self._damping_forces[0:self.number_of_time_steps]
 
+    @property
+    def Ms(self):
+        # The mass matrix is the same in every time step so it is only stored once
+        return [self.mass_matrix] * self.number_of_time_steps
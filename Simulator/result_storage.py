@@ -0,0 +1,388 @@
+# Storage of simulation results on disk.
+#
+# A result is stored as a directory containing:
+# - header.json: The simulation configuration and the shape, dtype and chunking of every field.
+# - mesh.npz: The FEM mesh, the time steps, the mass matrix and the other small arrays.
+# - One directory per time-dependent field (e.g. nodal_displacements) containing the field in chunks
+#   of chunk_size time steps. Every chunk is a .npy file, so it can be memory mapped and only the
+#   bytes that are indexed are read, or a compressed .npz file that is read whole.
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from Simulator.result import Result
+
+RESULT_FORMAT_VERSION = 1
+
+# The time-dependent fields of a Result that are stored in chunks
+CHUNKED_FIELDS = ['nodal_displacements', 'nodal_velocities', 'nodal_accelerations', 'Es', 'damping_forces']
+
+
+# Number of compressed chunks ChunkedArray keeps in memory
+COMPRESSED_CHUNK_CACHE_SIZE = 8
+
+
+def get_chunk_file_name(field_directory, chunk_index, chunk_format='npy'):
+    return os.path.join(field_directory, 'chunk_{:06d}.{}'.format(chunk_index, chunk_format))
+
+
+class ChunkedArray:
+    """
+    Read-only array stored in chunks along the first (time) axis.
+
+    Indexing the first axis with an integer or a slice only opens (memory maps) the chunks that
+    contain the indexed time steps, e.g. result.nodal_displacements[t0:t1:stride].
+    """
+
+    def __init__(self, field_directory, shape, dtype, chunk_size, chunk_format='npy'):
+        self.field_directory = field_directory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.chunk_format = chunk_format
+        self.ndim = len(self.shape)
+        self._chunks = dict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_chunk(self, chunk_index):
+        if chunk_index not in self._chunks:
+            file_name = get_chunk_file_name(self.field_directory, chunk_index, self.chunk_format)
+            if self.chunk_format == 'npz':
+                # Compressed chunks cannot be memory mapped, so only the last few are kept
+                if len(self._chunks) >= COMPRESSED_CHUNK_CACHE_SIZE:
+                    del self._chunks[next(iter(self._chunks))]
+                with np.load(file_name) as chunk_file:
+                    self._chunks[chunk_index] = chunk_file['chunk']
+            else:
+                self._chunks[chunk_index] = np.load(file_name, mmap_mode='r')
+        return self._chunks[chunk_index]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        time_key, other_keys = key[0], key[1:]
+
+        if isinstance(time_key, (int, np.integer)):
+            t = int(time_key)
+            if t < 0:
+                t += len(self)
+            if not 0 <= t < len(self):
+                raise IndexError("Time index {} is out of bounds for {} time steps".format(time_key, len(self)))
+            return np.array(self.get_chunk(t // self.chunk_size)[(t % self.chunk_size,) + other_keys])
+
+        if isinstance(time_key, slice):
+            time_indices = np.arange(*time_key.indices(len(self)))
+        else:
+            time_indices = np.arange(len(self))[time_key]
+
+        # Read the requested time steps chunk by chunk
+        array = None
+        chunk_indices = time_indices // self.chunk_size
+        for chunk_index in np.unique(chunk_indices):
+            mask = chunk_indices == chunk_index
+            rows = self.get_chunk(chunk_index)[(time_indices[mask] - chunk_index * self.chunk_size,) + other_keys]
+            if array is None:
+                array = np.zeros((len(time_indices),) + rows.shape[1:], dtype=self.dtype)
+            array[mask] = rows
+        if array is None:
+            return np.zeros((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + other_keys]
+
+        return array
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+
+class ResultWriter:
+    """
+    Writes a result to disk one time step at a time. Only the current chunk of every field is held
+    in memory.
+    """
+
+    def __init__(self, path, simulator, chunk_size=256, compress=False):
+        """
+        :param path:
+        :param simulator: The simulator that produces the result.
+        :param chunk_size: The number of time steps in every chunk.
+        :param compress: If True the chunks are written as compressed .npz files.
+        """
+        self.path = path
+        self.simulator = simulator
+        self.chunk_size = chunk_size
+        self.chunk_format = 'npz' if compress else 'npy'
+
+        self.number_of_time_steps = 0
+        self.number_of_full_chunks = 0
+        self.fields = dict()
+        self.chunk_buffers = dict()
+
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, **frames):
+        """
+        Appends one time step of every field, e.g. writer.append(nodal_displacements=u_n, ...).
+        All fields must be given for every time step.
+        """
+        row = self.number_of_time_steps % self.chunk_size
+        if not self.fields:
+            for name, frame in frames.items():
+                frame = np.asarray(frame)
+                self.fields[name] = {'shape': list(frame.shape), 'dtype': frame.dtype.str}
+                os.makedirs(os.path.join(self.path, name), exist_ok=True)
+            self.chunk_buffers = self.allocate_chunk_buffers()
+
+        for name, frame in frames.items():
+            self.chunk_buffers[name][row] = frame
+
+        self.number_of_time_steps += 1
+        if row == self.chunk_size - 1:
+            self.flush()
+
+    def allocate_chunk_buffers(self):
+        return {name: np.zeros([self.chunk_size] + field['shape'], dtype=np.dtype(field['dtype']))
+                for name, field in self.fields.items()}
+
+    def write_chunk(self, chunk_index, chunk_buffers, rows):
+        for name, buffer in chunk_buffers.items():
+            file_name = get_chunk_file_name(os.path.join(self.path, name), chunk_index, self.chunk_format)
+            if self.chunk_format == 'npz':
+                np.savez_compressed(file_name, chunk=buffer[0:rows])
+            else:
+                np.save(file_name, buffer[0:rows])
+
+    def flush(self):
+        """
+        Writes the rows of the current chunks that have not been written yet.
+        """
+        rows = self.number_of_time_steps - self.chunk_size * self.number_of_full_chunks
+        if rows <= 0:
+            return
+        self.write_chunk(self.number_of_full_chunks, self.chunk_buffers, rows)
+        if rows == self.chunk_size:
+            self.number_of_full_chunks += 1
+
+    def close(self, time_steps, aborted=False, settled=False, **arrays):
+        """
+        Writes the remaining rows, the header and the small arrays (mesh, time steps, ...).
+        :param time_steps: The time of every appended time step.
+        :param aborted: True if the simulation was aborted.
+        :param settled: True if the simulation stopped because it reached a steady state.
+        :param arrays: Additional arrays stored in mesh.npz, e.g. mass_matrix.
+        """
+        self.flush()
+
+        # If the simulation was interrupted between appending a time step and its time, the time
+        # step is left out
+        number_of_time_steps = min(self.number_of_time_steps, len(time_steps))
+        header = {
+            'format_version': RESULT_FORMAT_VERSION,
+            'configuration': self.simulator.get_configuration(),
+            'number_of_time_steps': number_of_time_steps,
+            'chunk_size': self.chunk_size,
+            'chunk_format': self.chunk_format,
+            'aborted': bool(aborted),
+            'settled': bool(settled),
+            'fields': {name: {'shape': [number_of_time_steps] + field['shape'], 'dtype': field['dtype']}
+                       for name, field in self.fields.items()},
+        }
+
+        arrays = {name: array for name, array in arrays.items() if array is not None}
+        # Sparse matrices (e.g. a sparse or lumped mass matrix) are stored as their CSR arrays
+        for name in [name for name, array in arrays.items() if sparse.issparse(array)]:
+            matrix = sparse.csr_matrix(arrays.pop(name))
+            arrays[name + '_data'] = matrix.data
+            arrays[name + '_indices'] = matrix.indices
+            arrays[name + '_indptr'] = matrix.indptr
+            arrays[name + '_shape'] = np.array(matrix.shape)
+        np.savez(os.path.join(self.path, 'mesh.npz'),
+                 FEM_V=self.simulator.FEM_V,
+                 FEM_encoding=self.simulator.FEM_encoding,
+                 time_steps=np.asarray(time_steps[0:number_of_time_steps], dtype=np.float64),
+                 **arrays)
+
+        with open(os.path.join(self.path, 'header.json'), 'w') as f:
+            json.dump(header, f, indent=2)
+
+
+class BackgroundResultWriter(ResultWriter):
+    """
+    ResultWriter that compresses and writes the chunks in a background thread, so the simulation
+    loop does not wait for the disk.
+
+    Full chunks are handed to the writer thread through a bounded queue and a small pool of chunk
+    buffers is reused. When the disk is slower than the simulation the queue fills up and append
+    blocks until a chunk has been written (back-pressure), so the memory use stays bounded.
+    """
+
+    def __init__(self, path, simulator, chunk_size=256, compress=True, queue_size=2):
+        """
+        :param queue_size: The number of full chunks that may wait to be written.
+        """
+        super().__init__(path, simulator, chunk_size, compress)
+        self.queue_size = queue_size
+        self.chunk_queue = queue.Queue(maxsize=queue_size)
+        # One set of buffers is filled, queue_size sets wait and one set is being written
+        self.free_chunk_buffers = queue.Queue()
+        self.error = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._write_chunks, name='BackgroundResultWriter', daemon=True)
+        self.thread.start()
+
+    def allocate_chunk_buffers(self):
+        for _ in range(self.queue_size + 1):
+            self.free_chunk_buffers.put(super().allocate_chunk_buffers())
+        return super().allocate_chunk_buffers()
+
+    def _write_chunks(self):
+        while True:
+            item = self.chunk_queue.get()
+            if item is None:
+                self.chunk_queue.task_done()
+                break
+            chunk_index, chunk_buffers, rows = item
+            try:
+                # After an error the remaining chunks are dropped, the error is raised by append or close
+                if self.error is None:
+                    self.write_chunk(chunk_index, chunk_buffers, rows)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.free_chunk_buffers.put(chunk_buffers)
+                self.chunk_queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise Exception("Writing the result to {} failed".format(self.path)) from self.error
+
+    def append(self, **frames):
+        self._raise_error()
+        super().append(**frames)
+
+    def flush(self):
+        """
+        Hands the full chunk to the writer thread. Partial chunks are only written by close.
+        """
+        rows = self.number_of_time_steps - self.chunk_size * self.number_of_full_chunks
+        if rows == self.chunk_size:
+            self._submit_chunk(rows)
+
+    def _submit_chunk(self, rows):
+        self.chunk_queue.put((self.number_of_full_chunks, self.chunk_buffers, rows))
+        self.number_of_full_chunks += 1
+        self.chunk_buffers = self.free_chunk_buffers.get()
+
+    def wait(self):
+        """
+        Waits until all the chunks handed to the writer thread are written.
+        """
+        self.chunk_queue.join()
+        self._raise_error()
+
+    def close(self, time_steps, aborted=False, settled=False, **arrays):
+        if not self.closed:
+            self.closed = True
+            rows = self.number_of_time_steps - self.chunk_size * self.number_of_full_chunks
+            if rows > 0:
+                self._submit_chunk(rows)
+                # The last chunk is partial, so later time steps must not be appended
+                self.number_of_full_chunks = self.number_of_time_steps // self.chunk_size
+            self.chunk_queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+        super().close(time_steps, aborted, settled, **arrays)
+
+
+class LazyResult:
+    """
+    A result loaded with load_result. The time-dependent fields are ChunkedArrays that are read
+    lazily, the remaining attributes match Result.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, 'header.json'), 'r') as f:
+            self.header = json.load(f)
+        if self.header['format_version'] != RESULT_FORMAT_VERSION:
+            raise Exception("Unsupported result format version: {}".format(self.header['format_version']))
+
+        self.configuration = self.header['configuration']
+        self.element_order = self.configuration['element_order']
+
+        with np.load(os.path.join(path, 'mesh.npz')) as mesh:
+            self.FEM_V = mesh['FEM_V']
+            self.FEM_encoding = mesh['FEM_encoding']
+            self.time_steps = mesh['time_steps']
+            self.mass_matrix = mesh['mass_matrix'] if 'mass_matrix' in mesh else None
+            if 'mass_matrix_data' in mesh:
+                self.mass_matrix = sparse.csr_matrix((mesh['mass_matrix_data'], mesh['mass_matrix_indices'],
+                                                      mesh['mass_matrix_indptr']), shape=tuple(mesh['mass_matrix_shape']))
+            self.assembled_gravity_force = mesh['assembled_gravity_force'] if 'assembled_gravity_force' in mesh else None
+            self.energies = tuple(mesh['energies']) if 'energies' in mesh else None
+
+        for name, field in self.header['fields'].items():
+            setattr(self, name, ChunkedArray(os.path.join(path, name), field['shape'], field['dtype'],
+                                             self.header['chunk_size'], self.header.get('chunk_format', 'npy')))
+
+        self.aborted = self.header.get('aborted', False)
+        self.settled = self.header.get('settled', False)
+
+    @property
+    def displacements(self):
+        return self.nodal_displacements
+
+    @property
+    def Ms(self):
+        # The mass matrix is the same in every time step so it is only stored once
+        return [self.mass_matrix] * len(self.time_steps)
+
+    def to_result(self):
+        """
+        Reads all the fields and returns them as a Result in memory, which no longer depends on the
+        files.
+        """
+        return Result(self.time_steps, *(np.asarray(getattr(self, name)) for name in
+                                         ['nodal_displacements', 'nodal_velocities', 'nodal_accelerations', 'Es']),
+                      self.mass_matrix, np.asarray(self.damping_forces), self.assembled_gravity_force, self.energies,
+                      self.aborted, self.settled)
+
+
+def save_result(path, result, simulator, chunk_size=256):
+    """
+    Saves a Result to the directory path.
+    :param path:
+    :param result:
+    :param simulator: The simulator that produced the result.
+    :param chunk_size: The number of time steps in every chunk.
+    """
+
+    writer = ResultWriter(path, simulator, chunk_size)
+    number_of_time_steps = len(result.time_steps)
+    for i in range(number_of_time_steps):
+        writer.append(**{name: getattr(result, name)[i] for name in CHUNKED_FIELDS})
+
+    energies = np.array(result.energies) if result.energies is not None else None
+    writer.close(result.time_steps, aborted=result.aborted, settled=result.settled, mass_matrix=result.mass_matrix,
+                 assembled_gravity_force=result.assembled_gravity_force, energies=energies)
+
+
+def load_result(path):
+    """
+    Opens a result saved with save_result. Nothing but the header and the mesh is read until the
+    fields are indexed.
+    :param path:
+    :return result:
+    """
+
+    return LazyResult(path)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from Simulator.result_storage import load_result, save_result
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Increase when a change to the simulator changes its results, so old cache entries are not reused
+SIMULATOR_CODE_VERSION = 4
+
+# Readers of a cache entry hold a shared lock on this file in the entry
+READER_LOCK_FILE_NAME = 'readers.lock'
+
+
+class _CacheLock:
+    """
+    Exclusive lock on the cache directory that is held while the index is read or modified. The lock
+    is a file lock, so it also works between the processes of a parameter sweep.
+    """
+
+    def __init__(self, lock_file_name):
+        self.lock_file_name = lock_file_name
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.lock_file_name, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+def acquire_reader_lock(entry_path):
+    """
+    Takes a shared lock on the reader lock file of a cache entry, which keeps the entry from being
+    evicted until the returned file is closed (or garbage collected). Returns None if shared locks
+    are not supported (Windows).
+    """
+    if fcntl is None:
+        return None
+    reader_lock_file = open(os.path.join(entry_path, READER_LOCK_FILE_NAME), 'a+')
+    fcntl.flock(reader_lock_file.fileno(), fcntl.LOCK_SH)
+    return reader_lock_file
+
+
+def try_remove_entry(entry_path):
+    """
+    Removes a cache entry unless it is being read, and returns True if it was removed.
+    """
+    if fcntl is None:
+        shutil.rmtree(entry_path, ignore_errors=True)
+        return True
+    try:
+        reader_lock_file = open(os.path.join(entry_path, READER_LOCK_FILE_NAME), 'a+')
+    except FileNotFoundError:
+        # The entry was already removed
+        return True
+    with reader_lock_file:
+        try:
+            fcntl.flock(reader_lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        shutil.rmtree(entry_path, ignore_errors=True)
+    return True
+
+
+def get_directory_size(path):
+    size = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(directory, file_name))
+    return size
+
+
+class SimulationCache:
+    """
+    Cache of simulation results addressed by a hash of the full simulator configuration, the
+    simulate() arguments and SIMULATOR_CODE_VERSION.
+
+    The results are stored with save_result in the cache directory. An index (index.json) records
+    the size and last access time of every entry, and the least recently used entries are evicted
+    when the total size exceeds max_size_bytes. Aborted simulations are not cached.
+
+    A cached result is read lazily, so its entry must not be removed while it is used. The result
+    holds a shared lock on the reader lock file of the entry (as reader_lock), and entries that are
+    locked are skipped by the eviction. File locks are per process and released when the result is
+    garbage collected. Without shared file locks (Windows) the result is read whole instead.
+    """
+
+    def __init__(self, cache_directory='simulation_cache', max_size_bytes=10 * 1024 ** 3):
+        self.cache_directory = cache_directory
+        self.max_size_bytes = max_size_bytes
+        self.index_file_name = os.path.join(cache_directory, 'index.json')
+
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def get_key(self, simulator, **simulate_kwargs):
+        configuration = {
+            'code_version': SIMULATOR_CODE_VERSION,
+            'configuration': simulator.get_configuration(),
+            'simulate_kwargs': simulate_kwargs,
+        }
+        normalized_configuration = json.dumps(configuration, sort_keys=True, separators=(',', ':'))
+
+        return hashlib.sha256(normalized_configuration.encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.cache_directory, key)
+
+    def _lock(self):
+        return _CacheLock(os.path.join(self.cache_directory, 'index.lock'))
+
+    def _read_index(self):
+        if not os.path.exists(self.index_file_name):
+            return dict()
+        with open(self.index_file_name, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        # Write to a temporary file and rename it, so the index is never partially written
+        temporary_file_name = self.index_file_name + '.' + uuid.uuid4().hex
+        with open(temporary_file_name, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(temporary_file_name, self.index_file_name)
+
+    def load(self, key):
+        """
+        Returns the cached result for the key, or None if there is no such entry. The result is a
+        LazyResult that keeps the entry from being evicted while it exists.
+        """
+        with self._lock():
+            entry_path = self.get_entry_path(key)
+            if not os.path.exists(os.path.join(entry_path, 'header.json')):
+                return None
+
+            index = self._read_index()
+            if key not in index:
+                index[key] = {'size_bytes': get_directory_size(entry_path)}
+            index[key]['last_access'] = time.time()
+            self._write_index(index)
+
+            reader_lock = acquire_reader_lock(entry_path)
+            if reader_lock is None:
+                return load_result(entry_path).to_result()
+            result = load_result(entry_path)
+            result.reader_lock = reader_lock
+            return result
+
+    def store(self, key, result, simulator):
+        """
+        Stores a result in the cache and evicts the least recently used entries if the cache is
+        larger than max_size_bytes.
+        """
+        # The result is written outside the lock to a temporary directory and then renamed
+        temporary_path = os.path.join(self.cache_directory, 'tmp_' + uuid.uuid4().hex)
+        try:
+            save_result(temporary_path, result, simulator)
+        except BaseException:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        size_bytes = get_directory_size(temporary_path)
+
+        with self._lock():
+            entry_path = self.get_entry_path(key)
+            if os.path.exists(entry_path):
+                # Another process stored the same result while this one was writing it
+                shutil.rmtree(temporary_path)
+            else:
+                os.rename(temporary_path, entry_path)
+
+            index = self._read_index()
+            index[key] = {'size_bytes': size_bytes, 'last_access': time.time()}
+            self._evict(index, keep_key=key)
+            self._write_index(index)
+
+    def _evict(self, index, keep_key=None):
+        total_size = sum(entry['size_bytes'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k].get('last_access', 0)):
+            if total_size <= self.max_size_bytes:
+                break
+            if key == keep_key:
+                continue
+            # Entries that are being read are kept, the cache can then stay above its size for a while
+            if not try_remove_entry(self.get_entry_path(key)):
+                continue
+            total_size -= index[key]['size_bytes']
+            del index[key]
+
+    def simulate(self, simulator, **simulate_kwargs):
+        """
+        Returns the cached result of simulator.simulate(**simulate_kwargs), running and caching the
+        simulation if it is not in the cache. A simulation aborted because of the energy drift is
+        returned but not cached, because it is not the result of the full configuration.
+        """
+        key = self.get_key(simulator, **simulate_kwargs)
+
+        result = self.load(key)
+        if result is None:
+            result = simulator.simulate(**simulate_kwargs)
+            if not result.aborted:
+                self.store(key, result, simulator)
+
+        return result
@@ -1,7 +1,12 @@
 # Simulator class
 # Containts the main loop of the simulator called simulate
+import tempfile
+from functools import cached_property
+import time
+
 import numpy as np
-import quadpy
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
 from scipy.spatial import Delaunay
 from tqdm import tqdm
 
@@ -11,22 +16,147 @@ from Mesh.Cantilever.area_computations import compute_triangle_element_area, \
     compute_all_element_areas
 from Mesh.Cantilever.generate_2d_cantilever_delaunay import generate_2d_cantilever_delaunay
 from Mesh.Cantilever.generate_2d_cantilever_kennys import generate_2d_cantilever_kennys
+from Mesh.HigherOrderMesh.decode_all_triangle_indices import decode_all_triangle_indices
 from Mesh.HigherOrderMesh.decode_triangle_indices import decode_triangle_indices
 from Mesh.HigherOrderMesh.generate_FEM_mesh import generate_FEM_mesh
+from EnergyComputations.energy_accumulator import EnergyAccumulator
+from Materials.constitutive_models import get_constitutive_model
 from Simulator.HigherOrderElements.shape_functions import silvester_shape_function, \
     shape_function_spatial_derivative, vandermonde_shape_function, vandermonde_spatial_derivative, \
-    vandermonde_shape_function_1D
+    vandermonde_shape_function_1D, shape_function_spatial_derivatives
 from Simulator.cartesian_to_barycentric import cartesian_to_barycentric
+from Simulator.cost_estimator import CostEstimate, select_backends
 from Simulator.integral_computations import compute_shape_function_volume
+from Simulator.integrators import get_integrator, estimate_max_frequency
+from Simulator.internal_force_kernel import compute_internal_forces
+from Simulator import numba_kernels
+from Simulator.load_curves import ExternalLoads, get_curve_configuration
+from Simulator.parallel_internal_forces import ParallelInternalForces
+from Simulator.point_locator import PointLocator
+from Simulator.quadrature import get_quadrature_degrees, get_exact_stiffness_degree, get_triangle_scheme, \
+    get_line_scheme, compute_hourglass_matrix, compute_linear_stiffness_matrices
+from Simulator.profiler import PhaseProfiler
 from Simulator.result import Result
+from Simulator.static_condensation import CondensedMassSolver
+from Simulator.steady_state_detector import SteadyStateDetector
+from Simulator.result_storage import BackgroundResultWriter, load_result
 from Simulator.triangle_shape_functions import triangle_shape_function_i_helper, \
     triangle_shape_function_j_helper, triangle_shape_function_k_helper
 
 
+PRECISIONS = ['float64', 'float32']
+KERNEL_BACKENDS = ['auto', 'numpy', 'numba']
+
+
 class Simulator:
     def __init__(self, number_of_time_steps, time_step, material_properties,
                  length, height, number_of_nodes_x, number_of_nodes_y, traction_force, gravity,
-                 element_order=1):
+                 element_order=1, profile=False, profile_element_sample_size=0,
+                 mass_matrix_backend='auto', output_policy='auto', memory_budget_bytes=None,
+                 static_condensation=False, number_of_force_workers=1, precision='float64',
+                 float64_accumulation=True, output_precision=None, gravity_curve=None, traction_curve=None,
+                 kernel_backend='auto', quadrature_degrees=None, reduced_integration=False, hourglass_coefficient=1.0,
+                 integrator='semi_implicit_euler'):
+        """
+        :param mass_matrix_backend: 'dense', 'sparse' or 'lumped' mass and damping matrices, or
+            'auto' to select the first of them that fits in the memory budget (dense if there is no
+            budget). See select_backends.
+        :param output_policy: 'memory' to keep the history in memory, 'stream' to write it to disk
+            while simulating, or 'auto' to stream it only if it does not fit in the memory budget
+            (memory if there is no budget).
+        :param memory_budget_bytes: The memory the simulation may use. Without a budget the backends
+            are checked against the total physical memory. A MemoryError is raised if the
+            selected backends do not fit, and a warning is given if they need more than the
+            memory that is currently free.
+        :param static_condensation: If True the element-interior dofs (orders >= 3) are condensed
+            out of the mass matrix before it is factorized. The mass and damping matrices of all the
+            dofs are still needed (for the damping forces, the energies and the result), but they are
+            then stored as sparse matrices, also with the dense backend, whose dense inverse is
+            replaced by that of the condensed matrix.
+        :param number_of_force_workers: If larger than 1 the internal forces are evaluated by this
+            many worker processes, each owning a subdomain of the elements, while simulating.
+        :param precision: 'float64' or 'float32', the precision of the internal force kernel and the
+            state update.
+        :param float64_accumulation: If True the mass solve and the energies are computed in float64
+            when the precision is float32.
+        :param output_precision: 'float64' or 'float32', the precision the history is stored in.
+            Defaults to the precision.
+        :param gravity_curve: A LoadCurve that scales the gravity over time, a pair of curves for its x
+            and y components, or None for a constant gravity.
+        :param traction_curve: Like gravity_curve for the traction, or a dictionary from the index of
+            a segment (element edge) of the traction edge to such an entry.
+        :param kernel_backend: 'numpy', 'numba' for the fused kernels of Simulator/numba_kernels.py, or
+            'auto' to use Numba if it is installed and supports the constitutive model.
+        :param quadrature_degrees: Dictionary from the name of an integral ('internal_force', 'mass',
+            'body_force', 'traction' or 'shape_function_volume') to its quadrature degree. See
+            Simulator/quadrature.py for the defaults.
+        :param reduced_integration: If True the internal forces are integrated with a rule of lower
+            degree (element_order - 1) and the hourglass modes are stabilized.
+        :param hourglass_coefficient: The scale of the hourglass stabilization. For quadratic elements
+            1 restores the small-strain stiffness of exact integration.
+        :param integrator: The name of a TimeIntegrator in Simulator/integrators.py
+            ('semi_implicit_euler', 'central_difference', 'velocity_verlet' or 'bogacki_shampine') or a
+            TimeIntegrator.
+        """
+        for name in [precision, output_precision]:
+            if name is not None and name not in PRECISIONS:
+                raise Exception("Unknown precision: {}. Available precisions: {}".format(
+                    name, ', '.join(PRECISIONS)))
+        self.dtype = np.dtype(precision)
+        self.float64_accumulation = float64_accumulation
+        # The mass matrix and its inverse are kept in the precision of the mass solve
+        self.solve_dtype = np.dtype(np.float64) if float64_accumulation else self.dtype
+        self.output_dtype = np.dtype(output_precision) if output_precision is not None else self.dtype
+        self.quadrature_degrees = get_quadrature_degrees(element_order, quadrature_degrees, reduced_integration)
+        self.reduced_integration = reduced_integration
+        self.hourglass_coefficient = hourglass_coefficient
+        self.integrator = get_integrator(integrator)
+
+        # Timers and counters of the phases of the simulator (they do nothing unless profile is True)
+        self.profiler = PhaseProfiler(profile, profile_element_sample_size)
+        with self.profiler.timer('init'):
+            # Check that the simulation fits in memory before anything is allocated
+            with self.profiler.timer('cost_estimate'):
+                self.cost_estimate = CostEstimate(number_of_nodes_x, number_of_nodes_y, element_order,
+                                                  number_of_time_steps, float_bytes=self.dtype.itemsize,
+                                                  output_float_bytes=self.output_dtype.itemsize,
+                                                  quadrature_degree=self.quadrature_degrees['internal_force'])
+                self.mass_matrix_backend, self.output_policy = select_backends(
+                    self.cost_estimate, mass_matrix_backend, output_policy, memory_budget_bytes)
+
+            self._initialize(number_of_time_steps, time_step, material_properties, length, height,
+                             number_of_nodes_x, number_of_nodes_y, traction_force, gravity, element_order)
+
+        self.static_condensation = static_condensation
+        self.gravity_curve = gravity_curve
+        self.traction_curve = traction_curve
+        self.number_of_force_workers = number_of_force_workers
+        self.force_evaluator = None
+        self.kernel_backend = self.select_kernel_backend(kernel_backend)
+        # The diagonals of the lumped damping matrix and inverse mass matrix used by the Numba update
+        self.lumped_diagonals = None
+
+        print("Simulator initialized")
+
+    def select_kernel_backend(self, kernel_backend):
+        if kernel_backend not in KERNEL_BACKENDS:
+            raise Exception("Unknown kernel backend: {}. Available backends: {}".format(
+                kernel_backend, ', '.join(KERNEL_BACKENDS)))
+
+        supported = numba_kernels.supports_constitutive_model(self.constitutive_model)
+        if kernel_backend == 'auto':
+            return 'numba' if numba_kernels.NUMBA_AVAILABLE and supported else 'numpy'
+        if kernel_backend == 'numba':
+            if not numba_kernels.NUMBA_AVAILABLE:
+                raise Exception("The numba kernel backend needs Numba, which is not installed")
+            if not supported:
+                raise Exception("The numba kernel backend does not support the {} model".format(
+                    self.constitutive_model.name))
+        return kernel_backend
+
+    def _initialize(self, number_of_time_steps, time_step, material_properties,
+                    length, height, number_of_nodes_x, number_of_nodes_y, traction_force, gravity,
+                    element_order):
         # Simulation settings
         self.number_of_time_steps = number_of_time_steps
         self.time_step = time_step
@@ -48,6 +178,8 @@ class Simulator:
                 self.material_properties.youngs_modulus /
                 (2 * (1+self.material_properties.poisson_ratio))
         )
+        self.constitutive_model = get_constitutive_model(
+            getattr(self.material_properties, 'constitutive_model', 'saint_venant_kirchhoff'), self.lambda_, self.mu)
 
         # Cantilever settings
         self.length = length
@@ -62,61 +194,234 @@ class Simulator:
         # Initialize the cantilever mesh
         # points, faces = generate_2d_cantilever_delaunay(self.length, self.height,
         #                                              self.number_of_nodes_x, self.number_of_nodes_y)
-        points, faces = generate_2d_cantilever_kennys(self.length, self.height,
-                                                        self.number_of_nodes_x, self.number_of_nodes_y)
-        self.mesh_points = points.astype(np.float64)
-        self.mesh_faces = faces
-        self.all_A_e = compute_all_element_areas(self.mesh_points, self.mesh_faces)
-
-        # All volume under shape functions
-        self.all_V_e = np.array([compute_shape_function_volume(self.mesh_points, face) for face in self.mesh_faces], dtype=np.float64)
-
+        with self.profiler.timer('mesh_generation'):
+            points, faces = generate_2d_cantilever_kennys(self.length, self.height,
+                                                            self.number_of_nodes_x, self.number_of_nodes_y)
+            self.mesh_points = points.astype(np.float64)
+            self.mesh_faces = faces
+        with self.profiler.timer('element_areas'):
+            self.all_A_e = compute_all_element_areas(self.mesh_points, self.mesh_faces)
 
         # FEM mesh vertices, ijk_index for every V in FEM_V, global indice encoding for every V in FEM_V
-        self.FEM_V, self.FEM_encoding = generate_FEM_mesh(self.mesh_points, self.mesh_faces, self.element_order)
+        with self.profiler.timer('generate_FEM_mesh'):
+            self.FEM_V, self.FEM_encoding = generate_FEM_mesh(self.mesh_points, self.mesh_faces, self.element_order)
         self.total_number_of_nodes = len(self.FEM_V)
+        self.profiler.count('elements', len(self.mesh_faces))
+        self.profiler.count('nodes', self.total_number_of_nodes)
 
-        # Boundary node indices
+        # Nodes closer than this to the ends of the cantilever are on the boundaries
         self.boundary_len = 0.0001
-        self.dirichlet_boundary_indices_x = []
-        for i, vertex in enumerate(self.FEM_V):
-            if vertex[0] < 0 - (self.length / 2) + self.boundary_len:
-                self.dirichlet_boundary_indices_x.append(2*i)
-
-        self.dirichlet_boundary_indices_x = np.array(self.dirichlet_boundary_indices_x, dtype=np.int32)
-        self.dirichlet_boundary_indices_y = self.dirichlet_boundary_indices_x + 1
-        self.boundary_indices = np.append(self.dirichlet_boundary_indices_x,
-                                     self.dirichlet_boundary_indices_y)
-
-        def check_if_traction_node(vertex):
-            if vertex[0] > 0 + (self.length / 2) - self.boundary_len:
-                return True
-            else:
-                return False
 
-        # list of (encoding_index, edge_index). Edge index: 0 for ij, 1 for jk, 2 for ki
-        self.traction_encodings = []
-        for i, encoding in enumerate(self.FEM_encoding):
-            global_indices, ijk_indices = decode_triangle_indices(encoding, self.element_order)
+    # The data derived from the mesh is computed when it is first used and then cached, so a
+    # Simulator that is only used for its mesh (e.g. to plot a cached result) does not compute it.
 
-            is_i_traction_node = check_if_traction_node(self.FEM_V[global_indices[0]])
-            is_j_traction_node = check_if_traction_node(self.FEM_V[global_indices[1]])
-            is_k_traction_node = check_if_traction_node(self.FEM_V[global_indices[2]])
-
-            # Check ij-edge
-            if is_i_traction_node and is_j_traction_node:
-                self.traction_encodings.append((i, 0))
-
-            # Check jk-edge
-            if is_j_traction_node and is_k_traction_node:
-                self.traction_encodings.append((i, 1))
-            # Check ki-edge
-            if is_k_traction_node and is_i_traction_node:
-                self.traction_encodings.append((i, 2))
+    @cached_property
+    def all_V_e(self):
+        # All volume under shape functions
+        with self.profiler.timer('shape_function_volumes'):
+            return np.array([compute_shape_function_volume(self.mesh_points, face,
+                                                           self.quadrature_degrees['shape_function_volume'])
+                             for face in self.mesh_faces], dtype=np.float64)
+
+    @cached_property
+    def dirichlet_boundary_indices_x(self):
+        # The x dofs of the nodes at the clamped end
+        with self.profiler.timer('boundary_indices'):
+            is_boundary_node = self.FEM_V[:, 0] < 0 - (self.length / 2) + self.boundary_len
+            return (2 * np.flatnonzero(is_boundary_node)).astype(np.int32)
+
+    @cached_property
+    def dirichlet_boundary_indices_y(self):
+        return self.dirichlet_boundary_indices_x + 1
+
+    @cached_property
+    def boundary_indices(self):
+        return np.append(self.dirichlet_boundary_indices_x, self.dirichlet_boundary_indices_y)
+
+    @cached_property
+    def free_dofs(self):
+        # The dofs without Dirichlet boundary conditions
+        return np.setdiff1d(np.arange(2 * self.total_number_of_nodes), self.boundary_indices)
+
+    @cached_property
+    def traction_encodings(self):
+        """
+        List of (encoding_index, edge_index) of the element edges at the free end. Edge index: 0 for
+        ij, 1 for jk, 2 for ki.
+        """
+        with self.profiler.timer('traction_encodings'):
+            # The corner nodes are the first three entries of the encodings
+            corners = np.asarray(self.FEM_encoding)[:, 0:3]
+            is_traction_node = self.FEM_V[corners, 0] > 0 + (self.length / 2) - self.boundary_len
+            is_traction_edge = is_traction_node & np.roll(is_traction_node, -1, axis=1)
+            return [(int(i), int(edge)) for i, edge in np.argwhere(is_traction_edge)]
+
+    @cached_property
+    def _element_decoding(self):
+        # Element node indices (same local node order for all elements)
+        with self.profiler.timer('element_decoding'):
+            return decode_all_triangle_indices(self.FEM_encoding, self.element_order)
+
+    @property
+    def element_global_indices(self):
+        return self._element_decoding[0]
+
+    @property
+    def element_ijk_indices(self):
+        return self._element_decoding[1]
+
+    @cached_property
+    def element_dofs(self):
+        return np.stack([self.element_global_indices * 2, self.element_global_indices * 2 + 1],
+                        axis=-1).reshape([len(self.mesh_faces), -1])
+
+    @cached_property
+    def quadrature_scheme(self):
+        # The quadrature scheme of the internal forces
+        return get_triangle_scheme(self.quadrature_degrees['internal_force'])
+
+    @property
+    def quadrature_points(self):
+        return self.quadrature_scheme.points
+
+    @property
+    def quadrature_weights(self):
+        return self.quadrature_scheme.weights
+
+    @cached_property
+    def _quadrature_geometry(self):
+        # The geometry is computed in float64 and rounded to the precision of the kernel
+        with self.profiler.timer('quadrature_geometry'):
+            element_quadrature_weights, dN_dX = self.compute_quadrature_geometry(self.quadrature_scheme)
+            return element_quadrature_weights.astype(self.dtype, copy=False), dN_dX.astype(self.dtype, copy=False)
+
+    @property
+    def element_quadrature_weights(self):
+        return self._quadrature_geometry[0]
+
+    @property
+    def dN_dX(self):
+        return self._quadrature_geometry[1]
+
+    @cached_property
+    def hourglass_matrix(self):
+        if not self.reduced_integration or self.hourglass_coefficient <= 0:
+            return None
+        with self.profiler.timer('hourglass_matrix'):
+            weights, dN_dX = self.compute_quadrature_geometry(self.quadrature_scheme)
+            exact_weights, exact_dN_dX = self.compute_quadrature_geometry(
+                get_triangle_scheme(get_exact_stiffness_degree(self.element_order)))
+            return compute_hourglass_matrix(self.element_dofs, exact_dN_dX, exact_weights, dN_dX, weights,
+                                            self.lambda_, self.mu, self.hourglass_coefficient,
+                                            2 * self.total_number_of_nodes).astype(self.dtype)
+
+    # Fields at the quadrature points, written by compute_stiffness_matrix
+
+    @property
+    def quadrature_shape(self):
+        return len(self.mesh_faces), len(self.quadrature_weights)
+
+    @cached_property
+    def quadrature_green_strains(self):
+        return np.zeros(self.quadrature_shape + (2, 2), dtype=self.dtype)
+
+    @cached_property
+    def quadrature_second_piola_kirchhoff_stresses(self):
+        return np.zeros(self.quadrature_shape + (2, 2), dtype=self.dtype)
+
+    @cached_property
+    def quadrature_deformation_gradient_determinants(self):
+        return np.ones(self.quadrature_shape, dtype=self.dtype)
+
+    def compute_quadrature_geometry(self, scheme):
+        """
+        Computes the quadrature weights multiplied by the element areas and the spatial derivatives
+        of the shape functions at the points of a triangle quadrature scheme in every element.
+        :return element_quadrature_weights, dN_dX:
+        """
+        element_quadrature_weights = np.outer(self.all_A_e, scheme.weights)
+        V_es = self.FEM_V[self.element_global_indices]
+        dN_dX = np.stack([shape_function_spatial_derivatives(V_es, self.element_ijk_indices, scheme.points[:, q],
+                                                             self.element_order)
+                          for q in range(len(scheme.weights))], axis=1)
 
-        print("Simulator initialized")
+        return element_quadrature_weights, dN_dX
 
-    def simulate(self):
+    def get_configuration(self):
+        """
+        Returns all the settings that determine the result of the simulation as a JSON serializable
+        dictionary.
+        """
+        return {
+            'number_of_time_steps': int(self.number_of_time_steps),
+            'time_step': float(self.time_step),
+            'gravity': [float(g) for g in self.gravity],
+            'material_properties': {name: value if isinstance(value, str) else float(value)
+                                    for name, value in vars(self.material_properties).items()},
+            'length': float(self.length),
+            'height': float(self.height),
+            'number_of_nodes_x': int(self.number_of_nodes_x),
+            'number_of_nodes_y': int(self.number_of_nodes_y),
+            'traction_force': [float(t) for t in self.traction_force],
+            'element_order': int(self.element_order),
+            'mass_matrix_backend': self.mass_matrix_backend,
+            'static_condensation': bool(self.static_condensation),
+            'quadrature_degrees': dict(self.quadrature_degrees),
+            'reduced_integration': bool(self.reduced_integration),
+            'hourglass_coefficient': float(self.hourglass_coefficient),
+            'precision': self.dtype.name,
+            'float64_accumulation': bool(self.float64_accumulation),
+            'output_precision': self.output_dtype.name,
+            'gravity_curve': get_curve_configuration(self.gravity_curve),
+            'traction_curve': get_curve_configuration(self.traction_curve),
+            'mesh_generator': 'generate_2d_cantilever_kennys',
+            'integrator': self.integrator.get_configuration(),
+        }
+
+    def simulate(self, track_energy=False, energy_drift_tolerance=None, output_path=None,
+                 steady_state_tolerance=None, steady_state_hold_steps=100):
+        """
+        Runs the simulation. See _simulate.
+        """
+        if self.number_of_force_workers > 1:
+            with self.profiler.timer('start_force_workers'):
+                element_centroids = self.FEM_V[self.element_global_indices].mean(axis=1)
+                self.force_evaluator = ParallelInternalForces(self.element_dofs, self.dN_dX,
+                                                              self.element_quadrature_weights,
+                                                              self.constitutive_model,
+                                                              2 * self.total_number_of_nodes,
+                                                              element_centroids, self.number_of_force_workers,
+                                                              self.dtype)
+        try:
+            return self._simulate(track_energy, energy_drift_tolerance, output_path, steady_state_tolerance,
+                                  steady_state_hold_steps)
+        finally:
+            if self.force_evaluator is not None:
+                self.force_evaluator.close()
+                self.force_evaluator = None
+
+    def _simulate(self, track_energy=False, energy_drift_tolerance=None, output_path=None,
+                  steady_state_tolerance=None, steady_state_hold_steps=100):
+        """
+        Runs the simulation.
+
+        :param track_energy: If True the energies are tracked during the simulation and stored in
+            the result.
+        :param energy_drift_tolerance: If set, the simulation is aborted when the relative total
+            energy drift exceeds this value. Implies track_energy.
+        :param output_path: The directory the result is written to when the output is streamed.
+            Defaults to a new temporary directory.
+        :param steady_state_tolerance: If set, the simulation stops when the cantilever has settled:
+            when the residual force and the velocity norm relative to their scales are below this
+            value, and the relative kinetic energy below its square, for steady_state_hold_steps
+            consecutive steps. The result is then marked as settled.
+        :param steady_state_hold_steps:
+        :return result: A Result, or a LazyResult reading the streamed output.
+
+        A KeyboardInterrupt is raised again after the output is closed, with the time steps simulated
+        so far attached as its partial_result (marked as aborted). The partial_result is None if the
+        streamed output could not be closed.
+        """
         # Initialize variables
         time = 0.0
 
@@ -126,113 +431,306 @@ class Simulator:
         print("  Time to simulate: {}".format(self.time_step * self.number_of_time_steps))
         print("  Time step: {}".format(self.time_step))
         print("  Number of time steps: {}".format(self.number_of_time_steps))
+        print("  Integrator: {}".format(self.integrator.name))
+        print("  Mass matrix: {}, output: {}, kernels: {}".format(self.mass_matrix_backend, self.output_policy,
+                                                                  self.kernel_backend))
+        print("  Estimated peak memory: {:.2f} MB".format(
+            self.cost_estimate.get_peak_memory_bytes(self.mass_matrix_backend, self.output_policy) / 1024 ** 2))
         print("----------------------------------------------------")
 
+        profiler = self.profiler
+
         # Precompute some variables
-        M = self.compute_mass_matrix()
-        # M[M < 0] = 0
-        Minv = np.linalg.inv(M)
-        C = self.compute_damping_matrix()
-        f_t = self.compute_traction_forces()
-        f_g = self.compute_body_forces(include_gravity=True)
-        f = - f_t - f_g
+        with profiler.timer('precompute'):
+            with profiler.timer('mass_matrix'):
+                all_M_e = self.compute_element_mass_matrices().astype(self.solve_dtype, copy=False)
+                M = self.assemble_mass_type_matrix(all_M_e)
+            # M[M < 0] = 0
+            with profiler.timer('mass_matrix_inverse'):
+                Minv = self.compute_inverse_mass_matrix(M, all_M_e)
+            with profiler.timer('damping_matrix'):
+                C = self.compute_damping_matrix().astype(self.dtype, copy=False)
+            if self.kernel_backend == 'numba' and self.mass_matrix_backend == 'lumped' and sparse.issparse(Minv):
+                self.lumped_diagonals = (C.diagonal(), Minv.diagonal())
+            else:
+                self.lumped_diagonals = None
+            # The forces of unit loads, combined with the factors of the load curves in every step
+            with profiler.timer('traction_forces'):
+                unit_traction_forces = self.compute_unit_traction_forces()
+            with profiler.timer('body_forces'):
+                unit_body_forces = self.compute_unit_body_forces()
+            external_loads = ExternalLoads(unit_body_forces, unit_traction_forces, self.gravity, self.traction_force,
+                                           self.gravity_curve, self.traction_curve)
+            f_g = -(unit_body_forces @ self.gravity)
+            f = external_loads.evaluate(time)
+            # The energies use the external forces in the precision of the accumulation
+            f_external = f.astype(self.solve_dtype, copy=False)
+            f = f.astype(self.dtype, copy=False)
+            time_dependent_loads = self.gravity_curve is not None or self.traction_curve is not None
+
+        def external_forces(t):
+            # The forces at the start of the step are evaluated in the main loop
+            if t == time or not time_dependent_loads:
+                return f
+            with profiler.timer('external_loads'):
+                return external_loads.evaluate(t).astype(self.dtype, copy=False)
 
         # Add boundary conditions
         # f[self.dirichlet_boundary_indices_x] = 0
         # f[self.dirichlet_boundary_indices_y] = 0
 
-        u_n = np.zeros(self.total_number_of_nodes * 2, dtype=np.float64)
-        v_n = np.zeros(self.total_number_of_nodes * 2, dtype=np.float64)
-        a_n = np.zeros(self.total_number_of_nodes * 2, dtype=np.float64)
+        u_n = np.zeros(self.total_number_of_nodes * 2, dtype=self.dtype)
+        v_n = np.zeros(self.total_number_of_nodes * 2, dtype=self.dtype)
+        a_n = np.zeros(self.total_number_of_nodes * 2, dtype=self.dtype)
         # a_n[np.arange(1, self.total_number_of_nodes * 2, 2)] = self.gravity[1]
-        X_0 = self.FEM_V.reshape([self.total_number_of_nodes * 2])
+        X_0 = self.FEM_V.reshape([self.total_number_of_nodes * 2]).astype(self.dtype)
         x_n = X_0
 
-        times = [0]
-        displacements = [u_n]
-        velocities = [v_n]
-        accelerations = [a_n]
-        Es = [np.zeros([len(self.mesh_faces), 2,2], dtype=np.float64)]
-        Ms = [M]
-        damping_forces = [C@v_n]
+        # The history is written into a Result preallocated for all time steps, or compressed and
+        # written to disk by a background thread when it is streamed. Both store it in the output
+        # precision.
+        writer = None
+        result = None
+        times = []
+        if self.output_policy == 'stream':
+            if output_path is None:
+                output_path = tempfile.mkdtemp(prefix='simulation_result_')
+            print("Streaming the result to {}".format(output_path))
+            writer = BackgroundResultWriter(output_path, self)
+        else:
+            result = Result.allocate(self.number_of_time_steps + 1, 2 * self.total_number_of_nodes,
+                                     self.quadrature_green_strains.shape[0:2], self.output_dtype, M, f_g)
+
+        def record_time_step(time, u, v, a, E, damping_force):
+            if writer is not None:
+                writer.append(nodal_displacements=u.astype(self.output_dtype, copy=False),
+                              nodal_velocities=v.astype(self.output_dtype, copy=False),
+                              nodal_accelerations=a.astype(self.output_dtype, copy=False),
+                              Es=E.astype(self.output_dtype, copy=False),
+                              damping_forces=damping_force.astype(self.output_dtype, copy=False))
+                times.append(time)
+            else:
+                result.append(time, u, v, a, E, damping_force)
+                times.append(time)
+
+        record_time_step(time, u_n, v_n, a_n, np.zeros_like(self.quadrature_green_strains), C@v_n)
+
+        energy_accumulator = None
+        if track_energy or energy_drift_tolerance is not None:
+            energy_accumulator = EnergyAccumulator(M, f_external, self.number_of_time_steps, energy_drift_tolerance,
+                                                   staggered_velocities=self.integrator.staggered_velocities)
+        steady_state_detector = None
+        if steady_state_tolerance is not None:
+            steady_state_detector = SteadyStateDetector(M, f_external, self.free_dofs, steady_state_tolerance,
+                                                        steady_state_tolerance ** 2, steady_state_tolerance,
+                                                        steady_state_hold_steps)
+        aborted = False
+        settled = False
+        self.integrator.reset()
+
+        # Main loop. On an error or an interruption the time steps simulated so far are written out
+        # and the exception is raised again.
+        try:
+            for i in tqdm(range(self.number_of_time_steps), desc="Running simulation"):
+                if time_dependent_loads:
+                    with profiler.timer('external_loads'):
+                        f_external = external_loads.evaluate(time).astype(self.solve_dtype, copy=False)
+                        f = f_external.astype(self.dtype, copy=False)
+
+                with profiler.timer('step'):
+                    x_n_1, v_n_1, a_n_1, k, E, damping_term = self.step(time, x_n, v_n, Minv, C, external_forces)
+                profiler.count('steps')
+
+                if energy_accumulator is not None:
+                    with profiler.timer('energy'):
+                        aborted = energy_accumulator.record(x_n, u_n, v_n, v_n_1, k, damping_term,
+                                                            f_external if time_dependent_loads else None)
+                # New displacements
+                u_n = x_n_1 - X_0
+
+                # New velocities
+                v_n = v_n_1
+
+                # New positions
+                x_n = x_n_1
+
+
+                # Update time
+                time += self.time_step
+                with profiler.timer('history'):
+                    record_time_step(time, u_n, v_n, a_n_1, E, damping_term)
+
+                if aborted:
+                    print("Simulation aborted at time {}: relative energy drift {} exceeds tolerance {}".format(
+                        time, energy_accumulator.drift, energy_drift_tolerance))
+                    break
+
+                if steady_state_detector is not None:
+                    with profiler.timer('steady_state'):
+                        settled = steady_state_detector.record(v_n, a_n_1, f_external if time_dependent_loads else None)
+                    if settled:
+                        print("Simulation settled at time {}".format(time))
+                        break
+
+                # Print time
+                # print(f"i: {i}. Time: {time}")
+        except BaseException as exception:
+            # Write out what was simulated before the error or the interruption. A failure to do so
+            # must not replace the original exception, which is always re-raised.
+            written = False
+            if writer is not None:
+                try:
+                    writer.close(times, aborted=True, mass_matrix=M, assembled_gravity_force=f_g)
+                    written = True
+                except BaseException as close_exception:
+                    print("Could not write the simulated time steps to {}: {!r}".format(output_path,
+                                                                                        close_exception))
+            if isinstance(exception, KeyboardInterrupt):
+                print("Simulation interrupted at time {}".format(times[-1]))
+                # The time steps simulated so far, for a caller that wants to keep them (None if they
+                # could not be written)
+                if writer is not None:
+                    exception.partial_result = None
+                    if written:
+                        try:
+                            exception.partial_result = load_result(output_path)
+                        except Exception as load_exception:
+                            print("Could not read the simulated time steps from {}: {!r}".format(
+                                output_path, load_exception))
+                else:
+                    result.truncate(len(times))
+                    result.aborted = True
+                    exception.partial_result = result
+            raise
+
+        energies = None
+        if energy_accumulator is not None:
+            # The energies are recorded at the start of every step, the last time step is recorded here
+            with profiler.timer('energy'):
+                if time_dependent_loads:
+                    f_external = external_loads.evaluate(time).astype(self.solve_dtype, copy=False)
+                    f = f_external.astype(self.dtype, copy=False)
+                a_n, k, _, damping_term = self.compute_accelerations(x_n, v_n, Minv, C, f)
+                energy_accumulator.record(x_n, u_n, v_n, v_n + self.time_step * a_n, k, damping_term,
+                                          f_external if time_dependent_loads else None)
+            energies = energy_accumulator.get_energy_series()
+
+        if writer is not None:
+            writer.close(times, aborted=aborted, settled=settled, mass_matrix=M, assembled_gravity_force=f_g,
+                         energies=np.array(energies) if energies is not None else None)
+            return load_result(output_path)
+
+        # The unused rows of an aborted simulation are left allocated
+        result.truncate(len(times))
+        result.energies = energies
+        result.aborted = aborted
+        result.settled = settled
+        return result
+
+    def step(self, time, x_n, v_n, Minv, C, external_forces):
+        """
+        Takes one step of the integrator from the positions x_n and velocities v_n at the time.
+        :param time:
+        :param x_n:
+        :param v_n:
+        :param Minv: The inverse mass matrix (or an operator applying it).
+        :param C: The damping matrix.
+        :param external_forces: Function returning the external forces at a time.
+        :return x_n_1, v_n_1, a_n_1, k, E, damping_term: See TimeIntegrator.step.
+        """
+        return self.integrator.step(self, time, x_n, v_n, Minv, C, external_forces)
 
+    def compute_accelerations(self, x, v, Minv, C, f):
+        """
+        Solves M a = f - C v - k(x) for the accelerations. The accelerations of the Dirichlet dofs
+        are zero.
+        :param x: The positions.
+        :param v: The velocities.
+        :param Minv: The inverse mass matrix (or an operator applying it).
+        :param C: The damping matrix.
+        :param f: The external forces.
+        :return a, k, E, damping_term: The accelerations, the internal forces, the Green strains at
+            the quadrature points and the damping forces.
+        """
+        profiler = self.profiler
+        with profiler.timer('internal_forces'):
+            k, E = self.compute_stiffness_matrix(x)
+
+        if self.lumped_diagonals is not None:
+            # The damping forces and the accelerations in one pass
+            with profiler.timer('mass_solve'):
+                damping_term, a = numba_kernels.lumped_mass_update(f, k, v, *self.lumped_diagonals)
+        else:
+            with profiler.timer('damping'):
+                damping_term = C @ v
+            forces = f - damping_term - k
+            with profiler.timer('mass_solve'):
+                a = (Minv @ forces.astype(self.solve_dtype, copy=False)).astype(self.dtype, copy=False)
+        a[self.boundary_indices] = 0
 
-        # Main loop
-        for i in tqdm(range(self.number_of_time_steps), desc="Running simulation"):
-            time_step_size = np.min([self.time_step, self.number_of_time_steps*self.time_step - time])
-            # Compute stiffness matrix
-            k, E = self.compute_stiffness_matrix(x_n)
-            # k[self.boundary_indices] = 0
+        return a, k, E, damping_term
 
-            # Do simulation step
-            damping_term = np.dot(C, v_n)
+    def estimate_max_frequency(self):
+        """
+        Computes the highest natural frequency of the small-strain (linear) equations of motion,
+        which limits the stable time step of the explicit integrators.
+        """
+        K_e = compute_linear_stiffness_matrices(self.dN_dX.astype(np.float64),
+                                                self.element_quadrature_weights.astype(np.float64), self.lambda_, self.mu)
+        rows = np.repeat(self.element_dofs[:, :, None], self.element_dofs.shape[1], axis=2)
+        columns = np.repeat(self.element_dofs[:, None, :], self.element_dofs.shape[1], axis=1)
+        K = sparse.coo_matrix((K_e.ravel(), (rows.ravel(), columns.ravel())),
+                              shape=(2 * self.total_number_of_nodes, 2 * self.total_number_of_nodes)).tocsr()
+        if self.hourglass_matrix is not None:
+            K = K + self.hourglass_matrix
+
+        return estimate_max_frequency(K, self.compute_mass_matrix(), self.free_dofs)
+
+    def estimate_stable_time_step(self):
+        """
+        Returns the largest stable time step of the integrator for the undamped small-strain
+        equations of motion. Nonlinear deformations and damping can lower it.
+        """
+        return self.integrator.get_stable_time_step(self.estimate_max_frequency())
 
-            # # Remove all forces after 1 sec.
-            # if (i * self.time_step > 1):
-            #     f = f * 0
+    def create_probe(self, points):
+        """
+        Returns a FieldProbe that samples the displacements and strains at material points given in
+        reference coordinates. The point locator is built on the first call.
+        :param points: (number of points)x2 array.
+        """
+        if getattr(self, 'point_locator', None) is None:
+            self.point_locator = PointLocator(self.FEM_V, self.FEM_encoding, self.element_order)
+        return self.point_locator.create_probe(points)
 
-            forces = f - damping_term - k
-            # forces[self.boundary_indices] = 0
-            # forces[np.abs(forces) < 1e-30] = 0
-
-            # def fun(x_vec):
-            #     x_next = x_vec[0:len(x_n)]
-            #     v_next = x_vec[len(x_n):len(x_n)*2]
-            #
-            #     # k, _ = self.compute_stiffness_matrix(x_next)
-            #
-            #     x_res = x_next - x_n - time_step_size * v_next
-            #
-            #     v_res = (M + time_step_size * C)@v_next - M@v_n - time_step_size*forces + time_step_size* k *(x_next - X_0)
-            #     result = np.append(x_res, v_res)
-            #
-            #     return result
-            #
-            # input_guess = np.append(x_n, v_n)
-            # sol = optimize.root(fun, input_guess, method='hybr')
-            # x_n_1 = sol.x[0:len(x_n)]
-            # x_n_1[self.boundary_indices] = X_0[self.boundary_indices]
-            # v_n_1 = sol.x[len(x_n):len(x_n)*2]
-            # # v_n_1 = (x_n_1 - x_n) / time_step_size
-            # v_n_1[self.boundary_indices] = 0
-            # v_n_1[np.abs(v_n_1) < 1e-10] = 0
-            #
-            # a_n_1 = (v_n_1 - v_n) / time_step_size
-
-
-            a_n_1 = np.dot(Minv,  forces)
-            v_n_1 = v_n + self.time_step * a_n_1 + 1e-10
-            v_n_1[self.dirichlet_boundary_indices_x] = 0
-            v_n_1[self.dirichlet_boundary_indices_y] = 0
-            v_n_1[np.abs(v_n_1) < 1e-10] = 0
-
-            x_n_1 = x_n + self.time_step * v_n_1
-
-            # New displacements
-            u_n = x_n_1 - X_0
-
-            # New velocities
-            v_n = v_n_1
-
-            # New positions
-            x_n = x_n_1
-
-
-            # Update time
-            time += self.time_step
-            times.append(time)
-            displacements.append(u_n)
-            velocities.append(v_n)
-            accelerations.append(a_n_1)
-            Es.append(E)
-            Ms.append(M)
-            damping_forces.append(damping_term)
-
-
-            # Print time
-            # print(f"i: {i}. Time: {time}")
-
-        return Result(times, np.array(displacements), velocities, accelerations, Es, Ms, damping_forces, f_g)
+    def sample_element_cost(self, name, compute_element_term, face_index):
+        """
+        Returns compute_element_term(face_index), and records its run time when the element is one of
+        the elements sampled by the profiler.
+        """
+        if not self.profiler.should_sample_element(face_index, len(self.mesh_faces)):
+            return compute_element_term(face_index)
+
+        start = time.perf_counter()
+        element_term = compute_element_term(face_index)
+        self.profiler.sample_element(name, face_index, time.perf_counter() - start)
+
+        return element_term
+
+    def profile_report(self):
+        """
+        Returns a summary of the time spent in every phase of the simulator. The simulator must be
+        created with profile=True.
+        """
+        if not self.profiler.enabled:
+            return "Profiling is disabled. Create the simulator with profile=True."
+        return self.profiler.report()
+
+    def export_profile(self, file_name):
+        """
+        Writes the profile in the folded stack format read by flame graph tools.
+        """
+        self.profiler.export_folded_stacks(file_name)
 
     def compute_integral_N_squared(self, triangle_encoding):
         # Compute matrix using quadpy (quadpy is a quadrature package)
@@ -249,7 +747,7 @@ class Simulator:
         # Corner vertices of triangle
         triangle = self.mesh_points[[i,j,k]]
 
-        scheme = quadpy.t2.get_good_scheme(self.element_order*2+1)
+        scheme = get_triangle_scheme(self.quadrature_degrees['mass'])
 
         # N is 2xm so the "square" matrix given by the outer product with itself is 2m x 2m
         integral_N_square = np.zeros((m*2, m*2))
@@ -290,18 +788,20 @@ class Simulator:
         return integral_N_square
 
     def compute_mass_matrix(self):
+        # Assemble the mass matrix
+        return self.assemble_mass_type_matrix(self.compute_element_mass_matrices())
+
+    def compute_element_mass_matrices(self):
         def compute_element_mass_matrix(face_index):
             triangle_encoding = self.FEM_encoding[face_index]
             integral_N_square = self.compute_integral_N_squared(triangle_encoding)
             return integral_N_square * self.material_properties.density
 
         # Compute all element mass matrices
-        all_M_e = np.array([compute_element_mass_matrix(i) for i in range(len(self.mesh_faces))], dtype=np.float64)
+        all_M_e = np.array([self.sample_element_cost('mass_matrix', compute_element_mass_matrix, i)
+                            for i in range(len(self.mesh_faces))], dtype=np.float64)
 
-        # Assemble the mass matrix
-        M = self.assemble_square_matrix(all_M_e)
-
-        return M
+        return all_M_e
 
 
     def compute_damping_matrix(self):
@@ -314,155 +814,145 @@ class Simulator:
         all_C_e = np.array([compute_element_damping_matrix(i) for i in range(len(self.mesh_faces))], dtype=np.float64)
 
         # Assemble the mass matrix
-        C = self.assemble_square_matrix(all_C_e)
+        C = self.assemble_mass_type_matrix(all_C_e)
 
 
         return C * self.material_properties.damping_coefficient
 
     def compute_stiffness_matrix(self, x_n):
-        m = int((self.element_order + 1) * (self.element_order + 2) / 2)
-        def compute_element_stiffness_matrix(face_index):
-            triangle_encoding = self.FEM_encoding[face_index]
+        """
+        Computes the internal force vector at the positions x_n.
+
+        The Green strain, the second Piola-Kirchhoff stress and det(F) at every quadrature point are
+        written into self.quadrature_green_strains, self.quadrature_second_piola_kirchhoff_stresses
+        and self.quadrature_deformation_gradient_determinants. These arrays are overwritten by the
+        next call.
+
+        :param x_n:
+        :return k, E: The internal force vector and the Green strains at the quadrature points.
+        """
+        u_n = np.subtract(x_n, self.FEM_V.reshape([self.total_number_of_nodes * 2]), dtype=x_n.dtype)
+
+        if self.force_evaluator is not None:
+            k = self.force_evaluator.compute(u_n)
+            np.copyto(self.quadrature_green_strains, self.force_evaluator.Es)
+            np.copyto(self.quadrature_second_piola_kirchhoff_stresses, self.force_evaluator.Ss)
+            np.copyto(self.quadrature_deformation_gradient_determinants, self.force_evaluator.Js)
+        else:
+            kernel = numba_kernels.compute_internal_forces if self.kernel_backend == 'numba' else compute_internal_forces
+            k = kernel(u_n, self.element_dofs, self.dN_dX, self.element_quadrature_weights, self.constitutive_model,
+                       2 * self.total_number_of_nodes, Es=self.quadrature_green_strains,
+                       Ss=self.quadrature_second_piola_kirchhoff_stresses,
+                       Js=self.quadrature_deformation_gradient_determinants, profiler=self.profiler)
+        if self.hourglass_matrix is not None:
+            with self.profiler.timer('hourglass_forces'):
+                k += self.hourglass_matrix @ u_n
+        self.profiler.count('internal_force_evaluations')
+
+        return k, self.quadrature_green_strains
+
+    def compute_inverse_mass_matrix(self, M, all_M_e=None):
+        """
+        Returns the inverse of the mass matrix for the dense backend, and an operator that solves
+        with the mass matrix (Minv @ f) for the sparse and lumped backends and for static
+        condensation.
+
+        The accelerations of the Dirichlet dofs are zero, so only the free dofs are solved for:
+        a_f = M_ff^-1 f_f and a_c = 0. Solving with the full mass matrix and then zeroing a_c would
+        not satisfy M_ff a_f = f_f for a consistent mass matrix, and the energy would drift.
+        :param M: The assembled mass matrix.
+        :param all_M_e: The element mass matrices, needed for static condensation.
+        """
+        free_dofs = self.free_dofs
+        if self.uses_static_condensation():
+            number_of_internal_nodes = (self.element_order - 1) * (self.element_order - 2) // 2
+            if all_M_e is None:
+                all_M_e = self.compute_element_mass_matrices()
+            # The internal nodes follow the corner nodes in the element matrices
+            interior_local_dofs = np.arange(6, 6 + 2 * number_of_internal_nodes)
+            return CondensedMassSolver(all_M_e, self.get_element_matrix_dofs(), interior_local_dofs,
+                                       2 * self.total_number_of_nodes, self.mass_matrix_backend,
+                                       constrained_dofs=self.boundary_indices)
+
+        if self.mass_matrix_backend == 'dense':
+            Minv = np.zeros_like(M)
+            Minv[np.ix_(free_dofs, free_dofs)] = np.linalg.inv(M[np.ix_(free_dofs, free_dofs)])
+            return Minv
+        if self.mass_matrix_backend == 'lumped':
+            inverse_diagonal = 1 / M.diagonal()
+            inverse_diagonal[self.boundary_indices] = 0
+            return sparse.diags(inverse_diagonal).tocsr()
+
+        factorization = sparse_linalg.splu(sparse.csr_matrix(M)[free_dofs][:, free_dofs].tocsc())
+
+        def solve(f):
+            a = np.zeros(f.shape, dtype=np.result_type(f, M.dtype))
+            a[free_dofs] = factorization.solve(f[free_dofs])
+            return a
+
+        return sparse_linalg.LinearOperator(M.shape, matvec=solve, dtype=M.dtype)
+
+    def uses_static_condensation(self):
+        # Only elements of order >= 3 have interior nodes, and a lumped mass matrix is diagonal already
+        number_of_internal_nodes = (self.element_order - 1) * (self.element_order - 2) // 2
+        return self.static_condensation and number_of_internal_nodes > 0 and self.mass_matrix_backend != 'lumped'
+
+    def assemble_mass_type_matrix(self, all_M_e):
+        """
+        Assembles element mass (or damping) matrices into a dense, sparse or lumped (diagonal sparse)
+        matrix depending on the mass matrix backend. With static condensation only the condensed
+        matrix is solved with, so the matrix is sparse for the dense backend as well.
+        """
+        if self.mass_matrix_backend == 'dense' and not self.uses_static_condensation():
+            return self.assemble_square_matrix(all_M_e)
+        if self.mass_matrix_backend in ['dense', 'sparse']:
+            return self.assemble_sparse_matrix(all_M_e)
+        if self.mass_matrix_backend == 'lumped':
+            return self.assemble_lumped_matrix(all_M_e)
+        raise Exception("Unknown mass matrix backend: {}".format(self.mass_matrix_backend))
+
+    def get_element_matrix_dofs(self):
+        """
+        Returns the global dof indices of the rows of the element matrices, in the local node order
+        of decode_triangle_indices.
+        """
+        element_matrix_dofs = []
+        for triangle_encoding in self.FEM_encoding:
             global_indices, ijk_indices = decode_triangle_indices(triangle_encoding, self.element_order)
-            triangle = self.FEM_V[global_indices[0:3]]
-
-            # Reference vertices (non-deformed vertices)
-            V_e = self.FEM_V[global_indices]
-            v_e = []
-            for i in range(m):
-                x = x_n[global_indices[i]*2]
-                y = x_n[global_indices[i]*2+1]
-                v_e.append(np.array([x,y]))
-            v_e = np.array(v_e)
-
-
-            I = np.eye(2, dtype=np.float64)
-            # C = np.dot(np.transpose(F), F)
-            # E = (C - I) / 2.0
-            #
-            # # Compute S
-            # S_v = self.lambda_ * np.trace(E) * I + 2 * self.mu * E # Saint Venant–Kirchhoff model
-            #
-            # # Compressible neo-hookean model (page 163 [Bonet and Wood,2008], Eq. 6.28)
-            # J = np.linalg.det(F)
-            # S_comp_neo = self.mu * (np.eye(2) - np.linalg.inv(C)) + self.lambda_ * np.log(J) * np.linalg.inv(C)
-            #
-            # # Incompressible neo-hookean model (page 169 [Bonet and Wood,2008], Eq. 6.52)
-            # I_C = np.trace(C)
-            # III_C = np.linalg.det(C)
-            # III_C2 = J ** 2
-            # k = 10**3
-            # p = k * (J - 1)
-            # S_incomp_neo = self.mu * III_C ** (-1/3) * (np.eye(2) - (1/3) * I_C * np.linalg.inv(C)) * p * J * np.linalg.inv(C)
-            #
-            # S = S_v
-
-
-
-
-            scheme = quadpy.t2.get_good_scheme(self.element_order+1)
-            quad_points = scheme.points
-            quad_weights = scheme.weights
-
-            A_e = self.all_A_e[face_index]
-
-            u_e = (v_e - V_e)
-
-            k_e = np.zeros(2*m)
-            E = np.zeros((2,2))
-            F = np.zeros((2,2))
-            for i in range(m):
-                def f(x):
-                    # dN = vandermonde_spatial_derivative(V_e, x, self.element_order).T
-                    dN = shape_function_spatial_derivative(V_e, triangle_encoding,x, self.element_order)
-
-                    # F = np.zeros((2,2))
-                    # for j in range(m):
-                    #     F_j = np.array([
-                    #         [dN[j,0]*v_e[j,0], dN[j,1]*v_e[j,0]],
-                    #         [dN[j,0]*v_e[j,1], dN[j,1]*v_e[j,1]]
-                    #     ])
-                    #     F += F_j
-
-                    F = np.eye(2)
-                    for j in range(m):
-                        F_j = np.array([
-                            [dN[j,0]*u_e[j,0], dN[j,1]*u_e[j,0]],
-                            [dN[j,0]*u_e[j,1], dN[j,1]*u_e[j,1]]
-                        ])
-                        F += F_j
-
-                    C = np.dot(np.transpose(F), F)
-                    E = (C - I) / 2.0
-                    S = self.lambda_ * np.trace(E) * I + 2 * self.mu * E
-
-                    # J = np.linalg.det(F)
-                    # S = self.mu * (np.eye(2) - np.linalg.inv(C)) + self.lambda_ * np.log(
-                    #     J) * np.linalg.inv(C)
-
-                    # dN = shape_function_spatial_derivative(V_e, triangle_encoding, x,
-                    #                                    self.element_order)
-                    # dN1 = vandermonde_spatial_derivative(V_e, x, self.element_order).T
-                    # assert (np.allclose(dN, dN1))
-                    P = F @ S
-                    result = (P @ dN[i])
-
-                    return result
-
-                val = 0
-                for j in range(len(quad_points[0])):
-                    point_bary = quad_points[:,j]
-                    point = triangle[0] * point_bary[0] + \
-                            triangle[1] * point_bary[1] + \
-                            triangle[2] * point_bary[2]
-                    f_val = f(point)
-                    val += f_val * quad_weights[j]
-
-                val *= A_e
-
-                # val_x = scheme.integrate(f_x, triangle)
-                # val_y = scheme.integrate(f_y, triangle)
-
-                k_e[2*i] = val[0]
-                k_e[2*i+1] = val[1]
-
-            return k_e, E, F
-
-        # Computes all element stiffness matrices
-        all_k_e_matrices = np.zeros([len(self.mesh_faces), 2*m], dtype=np.float64)
-        all_Es = np.zeros([len(self.mesh_faces), 2, 2])
-        all_Fs = np.zeros([len(self.mesh_faces), 2, 2])
-        for i in range(len(self.mesh_faces)):
-            k_e, E, F = compute_element_stiffness_matrix(i)
-            all_k_e_matrices[i] = k_e
-            all_Es[i] = E
-            all_Fs[i] = F
-
-        # Assemble the stiffness matrix
-        k = np.zeros([2 * self.total_number_of_nodes], dtype=np.float64)
-        for i in range(len(all_k_e_matrices)):
-            triangle_encoding = self.FEM_encoding[i]
+            element_matrix_dofs.append(np.stack([global_indices * 2, global_indices * 2 + 1], axis=-1).reshape(-1))
 
-            global_indices, ijk_indices = decode_triangle_indices(triangle_encoding,
-                                                                  self.element_order)
-            global_indices_list = []
-            for j in range(len(global_indices)):
-                global_indices_list.append(global_indices[j] * 2)
-                global_indices_list.append(global_indices[j] * 2 + 1)
-            global_indices_list = np.array(global_indices_list)
+        return np.array(element_matrix_dofs, dtype=np.int64)
+
+    def assemble_sparse_matrix(self, all_M_e):
+        element_matrix_dofs = self.get_element_matrix_dofs()
+        rows = np.repeat(element_matrix_dofs[:, :, None], element_matrix_dofs.shape[1], axis=2)
+        columns = np.repeat(element_matrix_dofs[:, None, :], element_matrix_dofs.shape[1], axis=1)
 
-            k[global_indices_list] += all_k_e_matrices[i]
+        # Duplicate entries are summed
+        matrix = sparse.coo_matrix((all_M_e.ravel(), (rows.ravel(), columns.ravel())),
+                                   shape=(2 * self.total_number_of_nodes, 2 * self.total_number_of_nodes))
 
+        return matrix.tocsr()
 
-        # print("F: {}".format(all_Fs[0]))
-        # print("CE: {}".format(all_Es[0]))
-        # print("F: {}".format(all_Fs[1]))
-        # print("CE: {}".format(all_Es[1]))
-        # print('-------------------------------------')
-        # if not np.isclose(np.sum(k), 0, atol=1e-5):
-        #     print('here')
-        # assert(np.isclose(np.sum(k), 0, atol=1e-5))
-        return k, all_Es
+    def assemble_lumped_matrix(self, all_M_e):
+        """
+        Lumps the element matrices by scaling their diagonals to the total element mass (HRZ
+        lumping), which keeps all the lumped masses positive for higher-order elements, and assembles
+        them into a diagonal matrix.
+        """
+        element_matrix_dofs = self.get_element_matrix_dofs()
+        diagonals = np.diagonal(all_M_e, axis1=1, axis2=2).copy()
+        for direction in range(2):
+            total_mass = all_M_e[:, direction::2, direction::2].sum(axis=(1, 2))
+            diagonals[:, direction::2] *= (total_mass / diagonals[:, direction::2].sum(axis=1))[:, None]
+
+        if self.kernel_backend == 'numba':
+            diagonal = numba_kernels.scatter_add(element_matrix_dofs, diagonals, 2 * self.total_number_of_nodes)
+        else:
+            diagonal = np.bincount(element_matrix_dofs.ravel(), weights=diagonals.ravel(),
+                                   minlength=2 * self.total_number_of_nodes)
+
+        return sparse.diags(diagonal).tocsr()
 
     def assemble_square_matrix(self, all_M_e):
         matrix = np.zeros([2 * self.total_number_of_nodes, 2 * self.total_number_of_nodes], dtype=np.float64)
@@ -485,61 +975,67 @@ class Simulator:
     def compute_body_forces(self, include_gravity=True):
         f_b = np.zeros([2 * self.total_number_of_nodes])
 
-        # Number of nodes in the element
-        m = int((self.element_order + 1) * (self.element_order + 2) / 2)
-
         # Add gravity force to all nodes
         if include_gravity:
-            scheme = quadpy.t2.get_good_scheme(self.element_order + 1)
+            f_b -= self.compute_unit_body_forces() @ self.gravity
 
-            def compute_element_gravity_term(face_index):
-                triangle = self.mesh_points[self.mesh_faces[face_index]]
+        return f_b
 
-                triangle_encoding = self.FEM_encoding[face_index]
-                global_indices, ijk_indices = decode_triangle_indices(triangle_encoding, self.element_order)
+    def compute_unit_body_forces(self):
+        """
+        Computes the assembled body forces of a unit gravity in the x and in the y direction, so the
+        body forces of any gravity g are a linear combination of them.
+        :return unit_body_forces: (2n)x2 array.
+        """
+        # Number of nodes in the element
+        m = int((self.element_order + 1) * (self.element_order + 2) / 2)
 
-                N_int_values = np.zeros([2, 2*m])
-                for i in range(len(global_indices)):
-                    def f(x):
-                        # xi = cartesian_to_barycentric(x, triangle)
-                        # shape_function_val = silvester_shape_function(ijk_indices[i], xi,
-                        #                                           self.element_order)
-                        shape_function_val = vandermonde_shape_function(self.FEM_V[global_indices], x, self.element_order)[:,i]
-                        return shape_function_val
+        scheme = get_triangle_scheme(self.quadrature_degrees['body_force'])
 
-                    int_val = scheme.integrate(f, triangle)
-                    N_int_values[0, i*2] = int_val
-                    N_int_values[1, 1 + i*2] = int_val
+        def compute_element_gravity_term(face_index):
+            triangle = self.mesh_points[self.mesh_faces[face_index]]
 
-                f_g_e = self.material_properties.density * N_int_values.T@self.gravity
+            triangle_encoding = self.FEM_encoding[face_index]
+            global_indices, ijk_indices = decode_triangle_indices(triangle_encoding, self.element_order)
 
-                return f_g_e
+            N_int_values = np.zeros([2, 2*m])
+            for i in range(len(global_indices)):
+                def f(x):
+                    # xi = cartesian_to_barycentric(x, triangle)
+                    # shape_function_val = silvester_shape_function(ijk_indices[i], xi,
+                    #                                           self.element_order)
+                    shape_function_val = vandermonde_shape_function(self.FEM_V[global_indices], x, self.element_order)[:,i]
+                    return shape_function_val
 
-            all_gravity_terms = np.zeros([len(self.mesh_faces), 2*m], dtype=np.float64)
-            for i in range(len(self.mesh_faces)):
-                f_g_e = compute_element_gravity_term(i)
-                all_gravity_terms[i] = f_g_e
+                int_val = scheme.integrate(f, triangle)
+                N_int_values[0, i*2] = int_val
+                N_int_values[1, 1 + i*2] = int_val
 
-            # Assemble the stiffness matrix
-            f_g = np.zeros([2 * self.total_number_of_nodes], dtype=np.float64)
-            for i in range(len(self.mesh_faces)):
-                triangle_encoding = self.FEM_encoding[i]
+            f_g_e = self.material_properties.density * N_int_values.T
 
-                global_indices, ijk_indices = decode_triangle_indices(triangle_encoding,
-                                                                      self.element_order)
-                global_indices_list = []
-                for j in range(len(global_indices)):
-                    global_indices_list.append(global_indices[j] * 2)
-                    global_indices_list.append(global_indices[j] * 2 + 1)
-                global_indices_list = np.array(global_indices_list)
+            return f_g_e
 
-                f_g[global_indices_list] += all_gravity_terms[i]
+        all_gravity_terms = np.zeros([len(self.mesh_faces), 2*m, 2], dtype=np.float64)
+        for i in range(len(self.mesh_faces)):
+            f_g_e = self.sample_element_cost('body_forces', compute_element_gravity_term, i)
+            all_gravity_terms[i] = f_g_e
+
+        # Assemble the unit body forces
+        f_g = np.zeros([2 * self.total_number_of_nodes, 2], dtype=np.float64)
+        for i in range(len(self.mesh_faces)):
+            triangle_encoding = self.FEM_encoding[i]
 
-            P_0g = - f_g
+            global_indices, ijk_indices = decode_triangle_indices(triangle_encoding,
+                                                                  self.element_order)
+            global_indices_list = []
+            for j in range(len(global_indices)):
+                global_indices_list.append(global_indices[j] * 2)
+                global_indices_list.append(global_indices[j] * 2 + 1)
+            global_indices_list = np.array(global_indices_list)
 
-            f_b += P_0g
+            f_g[global_indices_list] += all_gravity_terms[i]
 
-        return f_b
+        return f_g
 
     def compute_traction_forces(self):
         """
@@ -551,7 +1047,19 @@ class Simulator:
 
             :return: A (2n)x1 vector.
             """
+        unit_traction_forces = self.compute_unit_traction_forces()
+        number_of_segments = unit_traction_forces.shape[1] // 2
+
+        return -(unit_traction_forces @ np.tile(np.asarray(self.traction_force, dtype=np.float64), number_of_segments))
 
+    def compute_unit_traction_forces(self):
+        """
+        Computes the forces of a unit traction in the x and in the y direction on every segment (element
+        edge) of the traction edge, so the traction forces of any traction, also one that differs per
+        segment, are a linear combination of them.
+        :return unit_traction_forces: Sparse (2n)x(2 number of segments) matrix. Column 2s + c is the
+            force of a unit traction in direction c on segment s.
+        """
         num_internal_nodes = (self.element_order -1) * (self.element_order - 2) / 2
 
         def compute_element_traction(traction_encoding_index):
@@ -625,37 +1133,33 @@ class Simulator:
 
                     return shape_function_val1
 
-                scheme = quadpy.c1.gauss_legendre(self.element_order + 1)
+                scheme = get_line_scheme(self.quadrature_degrees['traction'])
                 val = scheme.integrate(f, [0.0, element_length])
 
                 N_int_vals[0, l*2] = val
                 N_int_vals[1, 1 + l*2] = val
 
-            f_t_e = N_int_vals.T@self.traction_force
+            f_t_e = N_int_vals.T
 
             f_t_e_global_indices = global_indices[local_edge_indices]
 
             return f_t_e, f_t_e_global_indices
 
-        m = int((self.element_order + 1) * (self.element_order + 2) / 2)
-        all_traction_terms = []
-        all_traction_indices = []
+        rows = []
+        columns = []
+        values = []
         for i in range(len(self.traction_encodings)):
-            f_t_e, f_t_e_indices = compute_element_traction(i)
-            all_traction_terms.append(f_t_e)
-            all_traction_indices.append(f_t_e_indices)
-
-        f_t = np.zeros([2 * self.total_number_of_nodes], dtype=np.float64)
-        for i in range(len(all_traction_terms)):
-            f_t_e = all_traction_terms[i]
-            global_indices = all_traction_indices[i]
+            f_t_e, global_indices = compute_element_traction(i)
 
             global_indices_list = []
             for j in range(len(global_indices)):
                 global_indices_list.append(global_indices[j] * 2)
                 global_indices_list.append(global_indices[j] * 2 + 1)
-            global_indices_list = np.array(global_indices_list)
 
-            f_t[global_indices_list] += f_t_e
+            for c in range(2):
+                rows.extend(global_indices_list)
+                columns.extend([2 * i + c] * len(global_indices_list))
+                values.extend(f_t_e[:, c])
 
-        return -f_t
\ No newline at end of file
+        return sparse.csr_matrix((values, (rows, columns)),
+                                 shape=(2 * self.total_number_of_nodes, 2 * len(self.traction_encodings)))
\ No newline at end of file
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+
+class CondensedMassSolver:
+    """
+    Solves with the mass matrix after condensing the element-interior dofs.
+
+    For orders >= 3 the interior nodes of an element only couple with the nodes of the same element,
+    so the interior block M_ii of the mass matrix is block diagonal. The interior dofs are eliminated
+    element by element with the Schur complements S_e = M_e,bb - M_e,bi M_e,ii^-1 M_e,ib before
+    assembly, and only the global system S a_b = f_b - sum_e M_e,bi M_e,ii^-1 f_e,i on the vertex
+    and edge dofs is factorized. The interior accelerations are recovered afterwards from
+    a_e,i = M_e,ii^-1 (f_e,i - M_e,ib a_e,b).
+
+    The Dirichlet (constrained) dofs are vertex or edge dofs. Their rows and columns are removed from
+    the condensed system and their accelerations are zero.
+
+    Only the condensed matrix is factorized (or inverted). The mass matrix of all the dofs is still
+    assembled by the simulator, as a sparse matrix, for the damping forces and the energies.
+
+    The solver is used like an inverse mass matrix: a = solver @ f.
+    """
+
+    def __init__(self, all_M_e, element_matrix_dofs, interior_local_dofs, number_of_dofs, backend='dense',
+                 constrained_dofs=None):
+        """
+        :param all_M_e: (number of elements)x(2m)x(2m) array of element mass matrices.
+        :param element_matrix_dofs: (number of elements)x(2m) array of the global dofs of the rows of
+            the element matrices.
+        :param interior_local_dofs: The local dofs of the element-interior nodes.
+        :param number_of_dofs:
+        :param backend: 'dense' to invert the condensed matrix, 'sparse' to factorize it.
+        :param constrained_dofs: The global dofs with zero accelerations, or None.
+        """
+        interior_local_dofs = np.asarray(interior_local_dofs, dtype=np.int64)
+        boundary_local_dofs = np.setdiff1d(np.arange(all_M_e.shape[1]), interior_local_dofs)
+
+        self.shape = (number_of_dofs, number_of_dofs)
+        self.interior_dofs = element_matrix_dofs[:, interior_local_dofs]
+        self.element_boundary_dofs = element_matrix_dofs[:, boundary_local_dofs]
+
+        # Number the dofs of the condensed system
+        self.boundary_dofs = np.unique(self.element_boundary_dofs)
+        self.condensed_dofs = np.searchsorted(self.boundary_dofs, self.element_boundary_dofs)
+        number_of_condensed_dofs = len(self.boundary_dofs)
+
+        M_bb = all_M_e[:, boundary_local_dofs[:, None], boundary_local_dofs]
+        M_bi = all_M_e[:, boundary_local_dofs[:, None], interior_local_dofs]
+        M_ib = all_M_e[:, interior_local_dofs[:, None], boundary_local_dofs]
+        M_ii = all_M_e[:, interior_local_dofs[:, None], interior_local_dofs]
+
+        self.M_ii_inverse = np.linalg.inv(M_ii)
+        self.M_ib = M_ib
+        self.M_bi_M_ii_inverse = M_bi @ self.M_ii_inverse
+        all_S_e = M_bb - self.M_bi_M_ii_inverse @ M_ib
+
+        # Assemble and factorize the condensed matrix of the free dofs
+        rows = np.repeat(self.condensed_dofs[:, :, None], self.condensed_dofs.shape[1], axis=2)
+        columns = np.repeat(self.condensed_dofs[:, None, :], self.condensed_dofs.shape[1], axis=1)
+        S = sparse.coo_matrix((all_S_e.ravel(), (rows.ravel(), columns.ravel())),
+                              shape=(number_of_condensed_dofs, number_of_condensed_dofs)).tocsr()
+        is_free = ~np.isin(self.boundary_dofs, constrained_dofs if constrained_dofs is not None else [])
+        self.free_condensed_dofs = np.flatnonzero(is_free)
+        S = S[self.free_condensed_dofs][:, self.free_condensed_dofs]
+        if backend == 'dense':
+            self.S_inverse = np.linalg.inv(S.toarray())
+        else:
+            factorization = sparse_linalg.splu(S.tocsc())
+            self.S_inverse = sparse_linalg.LinearOperator(S.shape, matvec=factorization.solve, dtype=S.dtype)
+
+        self.number_of_condensed_dofs = number_of_condensed_dofs
+
+    def __matmul__(self, f):
+        f_i = f[self.interior_dofs]
+
+        # Condensed right hand side
+        g = f[self.boundary_dofs] - np.bincount(self.condensed_dofs.ravel(),
+                                                weights=np.einsum('ebi,ei->eb', self.M_bi_M_ii_inverse, f_i).ravel(),
+                                                minlength=self.number_of_condensed_dofs)
+        a_b = np.zeros(self.number_of_condensed_dofs, dtype=np.result_type(g, self.M_ii_inverse))
+        a_b[self.free_condensed_dofs] = self.S_inverse @ g[self.free_condensed_dofs]
+
+        # Recover the interior dofs
+        a_e_b = a_b[self.condensed_dofs]
+        a_i = np.einsum('eij,ej->ei', self.M_ii_inverse, f_i - np.einsum('eib,eb->ei', self.M_ib, a_e_b))
+
+        a = np.empty(self.shape[0], dtype=np.result_type(f, a_b))
+        a[self.boundary_dofs] = a_b
+        a[self.interior_dofs] = a_i
+
+        return a
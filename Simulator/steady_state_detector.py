@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class SteadyStateDetector:
+    """
+    Detects that the cantilever has settled, so the simulation can stop early.
+
+    The state is steady when the residual force, the kinetic energy and the velocity norm are all
+    below their tolerances for hold_steps consecutive steps. The measures are relative: the residual
+    force to the external forces, and the kinetic energy and the velocity norm to the largest values
+    seen so far in the simulation.
+
+    The accelerations solve the mass system constrained to the free dofs, M_ff a_f = r_f, and the
+    accelerations of the clamped (Dirichlet) dofs are zero. The residual force r_f, the unbalanced
+    force on the free dofs, is therefore the free part of M a.
+    """
+
+    def __init__(self, M, f_external, free_dofs, residual_force_tolerance=1e-4, kinetic_energy_tolerance=1e-8,
+                 velocity_tolerance=1e-4, hold_steps=100):
+        """
+        :param M: The mass matrix.
+        :param f_external: The external forces (gravity and traction) acting on the nodes.
+        :param free_dofs: The dofs without Dirichlet boundary conditions.
+        :param residual_force_tolerance:
+        :param kinetic_energy_tolerance:
+        :param velocity_tolerance:
+        :param hold_steps: The number of consecutive steps the tolerances must be met.
+        """
+        self.M = M
+        self.free_dofs = free_dofs
+        self.residual_force_tolerance = residual_force_tolerance
+        self.kinetic_energy_tolerance = kinetic_energy_tolerance
+        self.velocity_tolerance = velocity_tolerance
+        self.hold_steps = hold_steps
+
+        self.force_scale = np.linalg.norm(f_external[free_dofs])
+        self.kinetic_energy_scale = 0.0
+        self.velocity_scale = 0.0
+
+        self.residual_force = np.inf
+        self.kinetic_energy = np.inf
+        self.velocity_norm = np.inf
+        self.number_of_steady_steps = 0
+
+    def record(self, v_n, a_n, f_external=None):
+        """
+        Records the state after a step and returns True if it has been steady for hold_steps steps.
+        :param v_n: The velocities after the step.
+        :param a_n: The accelerations of the step.
+        :param f_external: The external forces of the step if they change over time. The residual
+            force is then relative to the largest external forces so far.
+        :return settled:
+        """
+        if f_external is not None:
+            self.force_scale = max(self.force_scale, np.linalg.norm(f_external[self.free_dofs]))
+
+        residual_force = np.linalg.norm((self.M @ a_n)[self.free_dofs])
+
+        kinetic_energy = 0.5 * np.dot(v_n, self.M @ v_n)
+        velocity_norm = np.linalg.norm(v_n)
+        self.kinetic_energy_scale = max(self.kinetic_energy_scale, kinetic_energy)
+        self.velocity_scale = max(self.velocity_scale, velocity_norm)
+
+        # Relative measures, infinite until there is a scale to compare with
+        self.residual_force = residual_force / self.force_scale if self.force_scale > 0 else residual_force
+        self.kinetic_energy = kinetic_energy / self.kinetic_energy_scale if self.kinetic_energy_scale > 0 else np.inf
+        self.velocity_norm = velocity_norm / self.velocity_scale if self.velocity_scale > 0 else np.inf
+
+        if (self.residual_force < self.residual_force_tolerance and
+                self.kinetic_energy < self.kinetic_energy_tolerance and
+                self.velocity_norm < self.velocity_tolerance):
+            self.number_of_steady_steps += 1
+        else:
+            self.number_of_steady_steps = 0
+
+        return self.number_of_steady_steps >= self.hold_steps
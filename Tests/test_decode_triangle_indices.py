@@ -0,0 +1,31 @@
+# Run from the repository root with python -m pytest
+import numpy as np
+import pytest
+
+from Mesh.Cantilever.generate_2d_cantilever_kennys import generate_2d_cantilever_kennys
+from Mesh.HigherOrderMesh.decode_all_triangle_indices import decode_all_triangle_indices
+from Mesh.HigherOrderMesh.decode_triangle_indices import decode_triangle_indices
+from Mesh.HigherOrderMesh.generate_FEM_mesh import generate_FEM_mesh
+
+
+def get_expected_positions(V, global_indices, ijk_indices, n):
+    # The node of the ijk index is at the barycentric coordinates ijk / n of the corners
+    corners = [int(np.where(ijk_indices[:, c] == n)[0][0]) for c in range(3)]
+    return (ijk_indices / n) @ V[global_indices[corners]]
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5])
+def test_decoded_nodes_are_at_their_ijk_positions(n):
+    # The edges of this mesh are shared with both orientations, so the reversed edges are decoded
+    points, faces = generate_2d_cantilever_kennys(2.0, 0.5, 5, 3)
+    V, encodings = generate_FEM_mesh(points.astype(np.float64), faces, n)
+
+    for encoding in encodings:
+        global_indices, ijk_indices = decode_triangle_indices(encoding, n)
+        np.testing.assert_allclose(V[global_indices], get_expected_positions(V, global_indices, ijk_indices, n),
+                                   atol=1e-12)
+
+    all_global_indices, all_ijk_indices = decode_all_triangle_indices(encodings, n)
+    for global_indices in all_global_indices:
+        np.testing.assert_allclose(V[global_indices], get_expected_positions(V, global_indices, all_ijk_indices, n),
+                                   atol=1e-12)
@@ -0,0 +1,49 @@
+# Run from the repository root with python -m pytest
+import numpy as np
+import pytest
+
+pytest.importorskip('quadpy')
+
+import Materials.MaterialProperties as mat_prop
+from Simulator.simulator import Simulator
+
+END_TIME = 0.02
+
+
+def compute_energy_drift(mass_matrix_backend, integrator, time_step, element_order=1, static_condensation=False):
+    material_properties = mat_prop.MaterialPropertiesQuery().get_material_properties('Test 1')
+    simulator = Simulator(int(round(END_TIME / time_step)), time_step, material_properties, 2.0, 0.5, 5, 3,
+                          np.array([0, -1.0]), np.array([0, -9.81]), element_order,
+                          mass_matrix_backend=mass_matrix_backend, integrator=integrator,
+                          static_condensation=static_condensation)
+    energies = np.array(simulator.simulate(track_energy=True).energies)
+    return np.max(np.abs(energies.sum(axis=0))) / np.max(np.abs(energies))
+
+
+@pytest.mark.parametrize('mass_matrix_backend', ['dense', 'sparse', 'lumped'])
+def test_energy_drift_is_second_order(mass_matrix_backend):
+    # The accelerations of the consistent mass matrices must solve the constrained system, otherwise
+    # the drift does not shrink with the time step
+    drifts = [compute_energy_drift(mass_matrix_backend, 'velocity_verlet', time_step) for time_step in [4e-4, 2e-4]]
+    assert drifts[0] < 1e-4
+    assert drifts[1] < drifts[0] / 3
+
+
+@pytest.mark.parametrize('mass_matrix_backend', ['dense', 'sparse'])
+@pytest.mark.parametrize('integrator, order', [('velocity_verlet', 2), ('central_difference', 2),
+                                               ('bogacki_shampine', 3)])
+def test_energy_drift_order_of_the_integrators(mass_matrix_backend, integrator, order):
+    drifts = [compute_energy_drift(mass_matrix_backend, integrator, time_step) for time_step in [4e-4, 2e-4, 1e-4]]
+    measured_orders = np.log2(np.array(drifts[:-1]) / drifts[1:])
+    assert np.all(measured_orders > order - 0.2), measured_orders
+
+
+@pytest.mark.parametrize('mass_matrix_backend', ['dense', 'sparse'])
+def test_energy_is_conserved_by_semi_implicit_euler(mass_matrix_backend):
+    assert compute_energy_drift(mass_matrix_backend, 'semi_implicit_euler', 4e-4) < 1e-10
+
+
+@pytest.mark.parametrize('mass_matrix_backend', ['dense', 'sparse'])
+def test_energy_is_conserved_with_static_condensation(mass_matrix_backend):
+    assert compute_energy_drift(mass_matrix_backend, 'semi_implicit_euler', 4e-4, element_order=3,
+                                static_condensation=True) < 1e-10
@@ -0,0 +1,64 @@
+# Run from the repository root with python -m pytest
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from Materials.constitutive_models import SaintVenantKirchhoff, CompressibleNeoHookean, IncompressibleNeoHookean
+from Simulator import numba_kernels
+from Simulator.internal_force_kernel import compute_internal_forces
+
+NUMBER_OF_NODES = 40
+NUMBER_OF_ELEMENTS = 30
+NODES_PER_ELEMENT = 6
+NUMBER_OF_QUADRATURE_POINTS = 4
+
+
+def make_elements(rng):
+    # Random elements with a small displacement, so det(F) stays positive for the neo-Hookean models
+    element_nodes = np.array([rng.choice(NUMBER_OF_NODES, NODES_PER_ELEMENT, replace=False)
+                              for _ in range(NUMBER_OF_ELEMENTS)])
+    element_dofs = np.stack([2 * element_nodes, 2 * element_nodes + 1], axis=-1).reshape([NUMBER_OF_ELEMENTS, -1])
+    dN_dX = rng.standard_normal((NUMBER_OF_ELEMENTS, NUMBER_OF_QUADRATURE_POINTS, NODES_PER_ELEMENT, 2))
+    quadrature_weights = rng.uniform(0.1, 1.0, (NUMBER_OF_ELEMENTS, NUMBER_OF_QUADRATURE_POINTS))
+    u = 1e-2 * rng.standard_normal(2 * NUMBER_OF_NODES)
+    return u, element_dofs, dN_dX, quadrature_weights
+
+
+@pytest.mark.parametrize('model_class', [SaintVenantKirchhoff, CompressibleNeoHookean, IncompressibleNeoHookean])
+def test_internal_forces_match_numpy(model_class):
+    u, element_dofs, dN_dX, quadrature_weights = make_elements(np.random.default_rng(0))
+    constitutive_model = model_class(2.0e5, 1.0e5)
+
+    shape = (NUMBER_OF_ELEMENTS, NUMBER_OF_QUADRATURE_POINTS)
+    fields = [[np.empty(shape + (2, 2)), np.empty(shape + (2, 2)), np.empty(shape)] for _ in range(2)]
+    k = compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, constitutive_model,
+                                2 * NUMBER_OF_NODES, *fields[0])
+    k_numba = numba_kernels.compute_internal_forces(u, element_dofs, dN_dX, quadrature_weights, constitutive_model,
+                                                    2 * NUMBER_OF_NODES, *fields[1])
+
+    np.testing.assert_allclose(k_numba, k, rtol=1e-10, atol=1e-10 * np.max(np.abs(k)))
+    for field, field_numba in zip(*fields):
+        np.testing.assert_allclose(field_numba, field, rtol=1e-10, atol=1e-12)
+
+
+def test_lumped_mass_update_matches_numpy():
+    rng = np.random.default_rng(1)
+    f, k, v = rng.standard_normal((3, 2 * NUMBER_OF_NODES))
+    damping_diagonal = rng.uniform(0.0, 1.0, 2 * NUMBER_OF_NODES)
+    inverse_mass_diagonal = rng.uniform(0.5, 2.0, 2 * NUMBER_OF_NODES)
+
+    damping_term, a = numba_kernels.lumped_mass_update(f, k, v, damping_diagonal, inverse_mass_diagonal)
+
+    np.testing.assert_allclose(damping_term, damping_diagonal * v, rtol=1e-14)
+    np.testing.assert_allclose(a, inverse_mass_diagonal * (f - damping_diagonal * v - k), rtol=1e-12, atol=1e-14)
+
+
+def test_scatter_add_matches_bincount():
+    rng = np.random.default_rng(2)
+    indices = rng.integers(0, 2 * NUMBER_OF_NODES, (NUMBER_OF_ELEMENTS, 2 * NODES_PER_ELEMENT))
+    values = rng.standard_normal(indices.shape)
+
+    np.testing.assert_allclose(numba_kernels.scatter_add(indices, values, 2 * NUMBER_OF_NODES),
+                               np.bincount(indices.ravel(), weights=values.ravel(), minlength=2 * NUMBER_OF_NODES),
+                               rtol=1e-12, atol=1e-14)
@@ -1,12 +1,12 @@
 import math
 import os
-import pickle
 import sys
 
 import Materials.MaterialProperties as mat_prop
 from Plots.plot_sim_result_1 import plot_sim_result_1
 from Plots.plot_sim_result_energies_1 import plot_sim_result_energies_1
 from Plots.plot_sim_result_gif_1 import make_sim_result_gif_1
+from Simulator.simulation_cache import SimulationCache
 from Simulator.simulator import Simulator
 
 import time
@@ -58,16 +58,10 @@ def main():
                           gravity, element_order)
 
     sim_file_name = f'result_{length}l_{height}h_{number_of_nodes_x}xn_{number_of_nodes_y}yn_{traction_force}tf_{time_to_simulate}t_{time_step}ts_{element_order}order_{material_name}mn_{gravity}g_{simulator.material_properties.damping_coefficient}dc'
-    try:
-        f = open(sim_file_name, 'rb')
-        result = pickle.load(f)
-        f.close()
-    except:
-        # Start simulation
-        result = simulator.simulate()
-        f = open(sim_file_name, 'wb')
-        pickle.dump(result, f)
-        f.close()
+    # Reuse the result of an identical earlier simulation if it is cached, otherwise run the simulation.
+    # Cached results are read lazily, so only the header and the mesh are read here.
+    simulation_cache = SimulationCache('simulation_cache', max_size_bytes=10 * 1024 ** 3)
+    result = simulation_cache.simulate(simulator)
 
     # Plot the final simulation result
     plot_sim_result_1(simulator.FEM_V, simulator.FEM_encoding, result.nodal_displacements[-1],
@@ -77,7 +71,8 @@ def main():
     # Plot the various energies as a function of time
     # plot_sim_result_energies_1(simulator.FEM_V, simulator.FEM_encoding,
     #                            simulator.material_properties.density, result,
-    #                            simulator.gravity, simulator.all_A_e, simulator.lambda_, simulator.mu, simulator.element_order)
+    #                            simulator.gravity, simulator.all_A_e, simulator.lambda_, simulator.mu, simulator.element_order,
+    #                            simulator.quadrature_weights, simulator.constitutive_model)
 
     # make a gif of the simulation
     make_sim_result_gif_1(simulator.FEM_V, simulator.FEM_encoding,